@@ -1,342 +1,30 @@
-import os
-import uuid
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
-from werkzeug.utils import secure_filename
-from PIL import Image
-import numpy as np
-import json
-from datetime import datetime
-from dotenv import load_dotenv
-import torch
-from transformers import AutoImageProcessor, AutoModelForImageClassification
-
-# Load environment variables
-load_dotenv()
-
-# Initialize Flask app
-app = Flask(__name__, 
-            template_folder='app/templates',
-            static_folder='app/static')
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev_key_for_testing')
-app.config['UPLOAD_FOLDER'] = os.path.join('app', 'static', 'uploads')
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload
-app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'txt'}
-
-# Ensure upload directory exists
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-
-# Initialize AI models (lazy loading)
-image_processor = None
-image_model = None
-
-def load_ai_models():
-    """Load AI models on demand to save memory"""
-    global image_processor, image_model
-    
-    if image_processor is None or image_model is None:
-        try:
-            # Use a small, efficient model for image quality assessment
-            model_name = "google/vit-base-patch16-224"
-            image_processor = AutoImageProcessor.from_pretrained(model_name)
-            image_model = AutoModelForImageClassification.from_pretrained(model_name)
-            return True
-        except Exception as e:
-            print(f"Error loading AI models: {str(e)}")
-            return False
-    return True
+"""
+Shelf Vision Audit Tool - full version
 
-# Helper functions
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
+Serves every engine from one process: requests pick mock, opencv or vit with
+the mode parameter and run the ViT engine by default (ENGINES and
+DEFAULT_ENGINE change that). The routes and components live in
+app_factory.py and audit_service.py.
+"""
 
-def generate_unique_filename(filename):
-    """Generate a unique filename with timestamp and UUID"""
-    ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
-    unique_name = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
-    return f"{unique_name}.{ext}" if ext else unique_name
-
-def parse_metadata_file(file_path):
-    """Parse the metadata txt file into a structured format"""
-    metadata = []
-    with open(file_path, 'r') as f:
-        lines = f.readlines()
-        
-    # Simple parsing logic - adjust based on actual format
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-            
-        # Assuming tab or space-separated values
-        parts = line.split()
-        if len(parts) >= 3:  # At minimum: SKU, price, section
-            item = {
-                'sku': parts[0],
-                'price': parts[1],
-                'section': parts[2],
-                'additional_info': parts[3:] if len(parts) > 3 else []
-            }
-            metadata.append(item)
-    
-    return metadata
-
-def analyze_image_quality(image_path):
-    """Analyze image quality using AI and traditional methods"""
-    issues = []
-    
-    try:
-        # Basic image analysis with PIL
-        img = Image.open(image_path)
-        width, height = img.size
-        
-        # Check for low resolution
-        if width < 800 or height < 600:
-            issues.append({
-                'type': 'resolution',
-                'severity': 'medium',
-                'description': f'Low resolution image ({width}x{height})'
-            })
-        
-        # Check file size
-        file_size = os.path.getsize(image_path) / (1024 * 1024)  # Size in MB
-        if file_size < 0.1:
-            issues.append({
-                'type': 'file_size',
-                'severity': 'low',
-                'description': f'Small file size ({file_size:.2f} MB)'
-            })
-        
-        # Advanced analysis with AI if models are available
-        if load_ai_models():
-            try:
-                # Convert PIL image to RGB if it's not
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                
-                # Process image with the model
-                inputs = image_processor(images=img, return_tensors="pt")
-                
-                with torch.no_grad():
-                    outputs = image_model(**inputs)
-                
-                # For demonstration, we'll use the model's confidence as a quality indicator
-                # In a real app, you'd use a model specifically trained for image quality assessment
-                confidence = torch.nn.functional.softmax(outputs.logits, dim=1).max().item()
-                
-                if confidence < 0.7:
-                    issues.append({
-                        'type': 'ai_quality',
-                        'severity': 'medium',
-                        'description': f'AI detected potential image quality issues (confidence: {confidence:.2f})'
-                    })
-            except Exception as e:
-                print(f"AI analysis error: {str(e)}")
-                # Fallback to basic analysis only
-                pass
-        
-        return issues
-    except Exception as e:
-        return [{
-            'type': 'error',
-            'severity': 'high',
-            'description': f'Error analyzing image: {str(e)}'
-        }]
-
-def detect_products_in_image(image_path):
-    """
-    Detect products in the image using AI or fallback to mock data
-    """
-    # For demonstration, we'll use mock data
-    # In a real app, you'd use object detection models like YOLO or Faster R-CNN
-    product_regions = [
-        {'x': 50, 'y': 30, 'width': 100, 'height': 80, 'area': 8000, 'confidence': 0.92},
-        {'x': 200, 'y': 30, 'width': 120, 'height': 80, 'area': 9600, 'confidence': 0.88},
-        {'x': 370, 'y': 30, 'width': 90, 'height': 80, 'area': 7200, 'confidence': 0.95},
-        {'x': 510, 'y': 30, 'width': 110, 'height': 80, 'area': 8800, 'confidence': 0.91},
-        {'x': 670, 'y': 30, 'width': 80, 'height': 80, 'area': 6400, 'confidence': 0.87},
-        {'x': 50, 'y': 150, 'width': 100, 'height': 80, 'area': 8000, 'confidence': 0.93},
-        {'x': 200, 'y': 150, 'width': 120, 'height': 80, 'area': 9600, 'confidence': 0.89},
-        {'x': 370, 'y': 150, 'width': 90, 'height': 80, 'area': 7200, 'confidence': 0.94},
-        {'x': 510, 'y': 150, 'width': 110, 'height': 80, 'area': 8800, 'confidence': 0.90},
-        {'x': 670, 'y': 150, 'width': 80, 'height': 80, 'area': 6400, 'confidence': 0.86}
-    ]
-    
-    return product_regions
-
-def compare_metadata_with_image(metadata, detected_products, image_path):
-    """Compare metadata with detected products to find anomalies"""
-    anomalies = []
-    
-    # Count products in metadata
-    metadata_product_count = len(metadata)
-    
-    # Count detected products
-    detected_product_count = len(detected_products)
-    
-    # Check for count mismatch
-    if metadata_product_count != detected_product_count:
-        anomalies.append({
-            'type': 'count_mismatch',
-            'severity': 'high',
-            'description': f'Metadata has {metadata_product_count} products, but {detected_product_count} were detected in the image',
-            'metadata_count': metadata_product_count,
-            'detected_count': detected_product_count
-        })
-    
-    # Simulate position mismatches for demonstration
-    # In a real app, you'd use AI to match products with metadata based on visual features
-    if len(detected_products) > 0 and len(metadata) > 0:
-        # Simulate a mismatch for the first product
-        anomalies.append({
-            'type': 'position_mismatch',
-            'severity': 'medium',
-            'description': f'Product {metadata[0]["sku"]} position does not match metadata section {metadata[0]["section"]}',
-            'coordinates': {
-                'x': detected_products[0]['x'],
-                'y': detected_products[0]['y'],
-                'width': detected_products[0]['width'],
-                'height': detected_products[0]['height']
-            },
-            'metadata_item': metadata[0]
-        })
-        
-        # Simulate a price mismatch for the second product (if available)
-        if len(detected_products) > 1 and len(metadata) > 1:
-            anomalies.append({
-                'type': 'price_mismatch',
-                'severity': 'high',
-                'description': f'Product {metadata[1]["sku"]} price tag does not match metadata price {metadata[1]["price"]}',
-                'coordinates': {
-                    'x': detected_products[1]['x'],
-                    'y': detected_products[1]['y'],
-                    'width': detected_products[1]['width'],
-                    'height': detected_products[1]['height']
-                },
-                'metadata_item': metadata[1],
-                'detected_price': '$' + str(float(metadata[1]['price'].replace('$', '')) + 5.00)
-            })
-    
-    return anomalies
+import os
 
-# Routes
-@app.route('/')
-def index():
-    return render_template('index.html')
+from app_factory import create_app
 
-@app.route('/upload', methods=['POST'])
-def upload_files():
-    if 'image' not in request.files or 'metadata' not in request.files:
-        flash('Both image and metadata files are required', 'danger')
-        return redirect(url_for('index'))
-    
-    image_file = request.files['image']
-    metadata_file = request.files['metadata']
-    
-    if image_file.filename == '' or metadata_file.filename == '':
-        flash('No selected files', 'danger')
-        return redirect(url_for('index'))
-    
-    if not (allowed_file(image_file.filename) and allowed_file(metadata_file.filename)):
-        flash('Invalid file type', 'danger')
-        return redirect(url_for('index'))
-    
-    # Save image file
-    image_filename = generate_unique_filename(secure_filename(image_file.filename))
-    image_path = os.path.join(app.config['UPLOAD_FOLDER'], image_filename)
-    image_file.save(image_path)
-    
-    # Save metadata file
-    metadata_filename = generate_unique_filename(secure_filename(metadata_file.filename))
-    metadata_path = os.path.join(app.config['UPLOAD_FOLDER'], metadata_filename)
-    metadata_file.save(metadata_path)
-    
-    # Process files and analyze
-    return redirect(url_for('analyze', image=image_filename, metadata=metadata_filename))
+app = create_app(import_name=__name__)
+audit = app.extensions['audit']
 
-@app.route('/analyze')
-def analyze():
-    image_filename = request.args.get('image')
-    metadata_filename = request.args.get('metadata')
-    
-    if not image_filename or not metadata_filename:
-        flash('Missing files for analysis', 'danger')
-        return redirect(url_for('index'))
-    
-    image_path = os.path.join(app.config['UPLOAD_FOLDER'], image_filename)
-    metadata_path = os.path.join(app.config['UPLOAD_FOLDER'], metadata_filename)
-    
-    # Parse metadata
-    metadata = parse_metadata_file(metadata_path)
-    
-    # Analyze image quality
-    quality_issues = analyze_image_quality(image_path)
-    
-    # Detect products in image
-    detected_products = detect_products_in_image(image_path)
-    
-    # Compare metadata with detected products
-    anomalies = compare_metadata_with_image(metadata, detected_products, image_path)
-    
-    # Prepare results for display
-    results = {
-        'image_url': url_for('static', filename=f'uploads/{image_filename}'),
-        'metadata': metadata,
-        'quality_issues': quality_issues,
-        'detected_products': detected_products,
-        'anomalies': anomalies,
-        'ai_enabled': load_ai_models()
-    }
-    
-    return render_template('results.html', results=results)
+# Used by serving.py and benchmark_pipeline.py
+model_registry = audit.model_registry
+upload_storage = audit.upload_storage
+parse_metadata_file = audit.parse_metadata_file
+analyze_image_quality = audit.engine().analyze_quality
+detect_products_in_image = audit.engine().detect_products
+compare_metadata_with_image = audit.engine().compare
 
-@app.route('/api/analyze', methods=['POST'])
-def api_analyze():
-    """API endpoint for programmatic analysis"""
-    if 'image' not in request.files or 'metadata' not in request.files:
-        return jsonify({'error': 'Both image and metadata files are required'}), 400
-    
-    image_file = request.files['image']
-    metadata_file = request.files['metadata']
-    
-    if image_file.filename == '' or metadata_file.filename == '':
-        return jsonify({'error': 'No selected files'}), 400
-    
-    if not (allowed_file(image_file.filename) and allowed_file(metadata_file.filename)):
-        return jsonify({'error': 'Invalid file type'}), 400
-    
-    # Save image file
-    image_filename = generate_unique_filename(secure_filename(image_file.filename))
-    image_path = os.path.join(app.config['UPLOAD_FOLDER'], image_filename)
-    image_file.save(image_path)
-    
-    # Save metadata file
-    metadata_filename = generate_unique_filename(secure_filename(metadata_file.filename))
-    metadata_path = os.path.join(app.config['UPLOAD_FOLDER'], metadata_filename)
-    metadata_file.save(metadata_path)
-    
-    # Parse metadata
-    metadata = parse_metadata_file(metadata_path)
-    
-    # Analyze image quality
-    quality_issues = analyze_image_quality(image_path)
-    
-    # Detect products in image
-    detected_products = detect_products_in_image(image_path)
-    
-    # Compare metadata with detected products
-    anomalies = compare_metadata_with_image(metadata, detected_products, image_path)
-    
-    # Prepare results
-    results = {
-        'image_url': url_for('static', filename=f'uploads/{image_filename}', _external=True),
-        'metadata': metadata,
-        'quality_issues': quality_issues,
-        'detected_products': detected_products,
-        'anomalies': anomalies,
-        'ai_enabled': load_ai_models()
-    }
-    
-    return jsonify(results)
+def audit_files(image_path, metadata_path, tiled=None, mode=None):
+    """Full pipeline for saved files; module level so process pools can run it"""
+    return audit.audit_files(image_path, metadata_path, tiled, mode)
 
 if __name__ == '__main__':
-    app.run(debug=os.environ.get('DEBUG', 'False').lower() == 'true') 
\ No newline at end of file
+    app.run(debug=os.environ.get('DEBUG', 'False').lower() == 'true') 
@@ -0,0 +1,714 @@
+"""
+Flask application factory
+
+create_app(config) builds the web app every variant runs: configuration
+from the environment (overridden by config), the shared components in an
+AuditService stored as app.extensions['audit'], and the routes. The
+variants only differ in their engines:
+
+    app = create_app({'ENGINES': 'mock,opencv,vit', 'DEFAULT_ENGINE': 'vit'})
+
+Requests pick one of the enabled engines with mode=mock|opencv|vit (form
+field or query string); without one the DEFAULT_ENGINE runs.
+"""
+
+import os
+import shutil
+import tempfile
+from datetime import datetime
+
+from dotenv import load_dotenv
+from flask import Flask, current_app, render_template, request, redirect, url_for, flash, jsonify, Response
+
+import instrumentation
+import lazy_modules
+from audit_service import AuditService
+from bulk_audit import extract_archive, find_pairs, get_shared_pool, run_bulk, to_json_lines
+from engines import ENGINES, ENGINE_VIT
+from jobs import JobQueueFull
+from model_registry import DEFAULT_MODEL_NAME
+from product_detection import DEFAULT_DETECTION_MODEL
+from result_cache import hash_bytes
+from result_store import TREND_BUCKETS
+from serving import worker_memory
+from upload_ingest import UploadRejected, IMAGE_KINDS, METADATA_KINDS
+
+# Load environment variables
+load_dotenv()
+
+
+def configure(app, config=None):
+    """Read the settings from the environment, then apply the config overrides"""
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev_key_for_testing')
+    app.config['UPLOAD_FOLDER'] = os.path.join('app', 'static', 'uploads')
+    app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload
+    app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'txt'}
+    app.config['MAX_WORKING_RESOLUTION'] = int(os.environ.get('MAX_WORKING_RESOLUTION', 1600))  # Longest side for CV stages
+
+    # Engines this process can run (comma-separated) and the one used when a request has no mode
+    app.config['ENGINES'] = os.environ.get('ENGINES', ','.join(ENGINES))
+    app.config['DEFAULT_ENGINE'] = os.environ.get('DEFAULT_ENGINE', ENGINE_VIT).lower()
+
+    # Quality cascade: header checks, then the NumPy signals, and the ViT pass only for images they
+    # leave ambiguous (a signal within QUALITY_CASCADE_MARGIN of its limit, relative to the limit).
+    # QUALITY_PREFILTER is the older name of the switch
+    app.config['QUALITY_CASCADE'] = os.environ.get('QUALITY_CASCADE', os.environ.get('QUALITY_PREFILTER', 'True')).lower() == 'true'
+    app.config['QUALITY_CASCADE_MARGIN'] = float(os.environ.get('QUALITY_CASCADE_MARGIN', 0.35))
+    app.config['QUALITY_AI_THRESHOLD'] = float(os.environ.get('QUALITY_AI_THRESHOLD', 0.7))  # ViT confidence below this is an issue
+    # Tiled quality mode: per-region heatmap and bad-region boxes; requests can also ask with tiled=1
+    app.config['QUALITY_TILED'] = os.environ.get('QUALITY_TILED', 'False').lower() == 'true'
+    app.config['QUALITY_TILE_GRID'] = tuple(int(n) for n in os.environ.get('QUALITY_TILE_GRID', '4x4').lower().split('x'))
+    app.config['QUALITY_TILE_AI'] = os.environ.get('QUALITY_TILE_AI', 'True').lower() == 'true'  # Run the ViT on all tiles as one batch
+
+    # MODEL_LOAD_MODE: 'background' (load at startup without blocking), 'startup' (block until loaded)
+    # or 'lazy' (load on the first request that needs it)
+    app.config['MODEL_NAME'] = os.environ.get('MODEL_NAME', DEFAULT_MODEL_NAME)
+    app.config['MODEL_LOAD_MODE'] = os.environ.get('MODEL_LOAD_MODE', 'background').lower()
+    # Models in MODEL_CACHE_DIR (python model_cache.py download) load memory-mapped without network access;
+    # MODEL_OFFLINE never falls back to the Hugging Face Hub. MODEL_CACHE_VERIFY: 'quick', 'full' (SHA-256) or 'off'
+    app.config['MODEL_CACHE_DIR'] = os.environ.get('MODEL_CACHE_DIR', 'model_cache')
+    app.config['MODEL_OFFLINE'] = os.environ.get('MODEL_OFFLINE', 'False').lower() == 'true'
+    app.config['MODEL_CACHE_VERIFY'] = os.environ.get('MODEL_CACHE_VERIFY', 'quick').lower()
+    # INFERENCE_BACKEND: 'torch' (fp32 eager), 'quantized' (dynamic int8) or 'onnx' (ONNX Runtime)
+    app.config['INFERENCE_BACKEND'] = os.environ.get('INFERENCE_BACKEND', 'torch').lower()
+    app.config['ONNX_MODEL_PATH'] = os.environ.get('ONNX_MODEL_PATH', os.path.join('model_cache', 'vit-base-patch16-224.onnx'))
+    app.config['INFERENCE_PARITY_CHECK'] = os.environ.get('INFERENCE_PARITY_CHECK', 'True').lower() == 'true'
+
+    # Coalesce concurrent ViT calls into batched forward passes
+    app.config['INFERENCE_BATCHING'] = os.environ.get('INFERENCE_BATCHING', 'True').lower() == 'true'
+    app.config['INFERENCE_MAX_BATCH_SIZE'] = int(os.environ.get('INFERENCE_MAX_BATCH_SIZE', 8))
+    app.config['INFERENCE_MAX_WAIT_MS'] = float(os.environ.get('INFERENCE_MAX_WAIT_MS', 10))
+
+    # Content-addressed result cache: in-memory LRU plus an optional on-disk tier
+    app.config['RESULT_CACHE_SIZE'] = int(os.environ.get('RESULT_CACHE_SIZE', 256))
+    app.config['RESULT_CACHE_DIR'] = os.environ.get('RESULT_CACHE_DIR', '')
+    app.config['RESULT_CACHE_MAX_MB'] = int(os.environ.get('RESULT_CACHE_MAX_MB', 512))
+    app.config['RESULT_CACHE_TTL'] = int(os.environ.get('RESULT_CACHE_TTL', 24 * 3600))
+
+    # Background job pool for /api/jobs; JOB_EXECUTOR is 'thread' or 'process'
+    app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+    app.config['JOB_MAX_QUEUE'] = int(os.environ.get('JOB_MAX_QUEUE', 32))
+    app.config['JOB_EXECUTOR'] = os.environ.get('JOB_EXECUTOR', 'thread').lower()
+    app.config['JOB_RESULT_TTL'] = int(os.environ.get('JOB_RESULT_TTL', 3600))
+
+    # Uploads are hashed and validated while streaming in; writing them to UPLOAD_FOLDER
+    # is 'async' (background thread), 'sync', or 'off' (only when a later step needs the file)
+    app.config['UPLOAD_PERSIST'] = os.environ.get('UPLOAD_PERSIST', 'async').lower()
+    app.config['UPLOAD_SPOOL_LIMIT'] = int(os.environ.get('UPLOAD_SPOOL_LIMIT', 16 * 1024 * 1024))  # Bytes kept in memory
+
+    # Uploads are stored once per content hash in sharded folders (uploads/ab/cd/<sha256>.jpg); the sweeper
+    # removes files older than UPLOAD_RETENTION_DAYS and the oldest ones while over UPLOAD_QUOTA_MB (0 = off)
+    app.config['UPLOAD_RETENTION_DAYS'] = float(os.environ.get('UPLOAD_RETENTION_DAYS', 0))
+    app.config['UPLOAD_QUOTA_MB'] = int(os.environ.get('UPLOAD_QUOTA_MB', 0))
+    app.config['UPLOAD_SWEEP_INTERVAL'] = int(os.environ.get('UPLOAD_SWEEP_INTERVAL', 600))  # Seconds between sweeps
+
+    # Per-stage timing histograms, /metrics and Server-Timing headers; when disabled
+    # every stage timer is a shared no-op and no request hooks are installed
+    app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', 'True').lower() == 'true'
+
+    # Product detector: 'classical' (OpenCV edges + NumPy NMS), 'model' (transformers
+    # object detection on CPU, loaded on first use) or 'mock' (fixed demo boxes)
+    app.config['DETECTOR_BACKEND'] = os.environ.get('DETECTOR_BACKEND', 'classical').lower()
+    app.config['DETECTION_MODEL'] = os.environ.get('DETECTION_MODEL', DEFAULT_DETECTION_MODEL)
+    app.config['DETECTION_THRESHOLD'] = float(os.environ.get('DETECTION_THRESHOLD', 0.5))
+
+    # Metadata files are parsed once per distinct content and reused; planograms can also be
+    # uploaded ahead of time through /api/planograms and referred to by id or name
+    app.config['PLANOGRAM_CACHE_SIZE'] = int(os.environ.get('PLANOGRAM_CACHE_SIZE', 64))  # Unnamed planograms kept
+
+    # Audit history: every result is saved to SQLite so result pages and history queries never rerun the pipeline.
+    # Job records and uploaded planograms are kept in the same file, shared by all server processes
+    app.config['RESULT_DB_PATH'] = os.environ.get('RESULT_DB_PATH', os.path.join('instance', 'audit_results.db'))
+
+    app.config.update(config or {})
+
+    # ENGINES may be given as 'mock,opencv' or as a list
+    engines = app.config['ENGINES']
+    if isinstance(engines, str):
+        engines = engines.split(',')
+    app.config['ENGINES'] = tuple(name.strip().lower() for name in engines if name.strip())
+
+    if app.config['MODEL_OFFLINE']:
+        # Also keeps other Hugging Face loads (e.g. the detector) from reaching for the network
+        os.environ.setdefault('HF_HUB_OFFLINE', '1')
+
+    # Ensure upload directory exists
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+
+# Routes, registered on each app by create_app
+_ROUTES = []
+
+
+def route(rule, **options):
+    def register(view):
+        _ROUTES.append((rule, view, options))
+        return view
+    return register
+
+
+def create_app(config=None, import_name=__name__):
+    """
+    Build the app. config overrides the environment settings; import_name is
+    the module that keeps the app as its `app` attribute, which process
+    pools import to rebuild it.
+    """
+    app = Flask(import_name,
+                template_folder='app/templates',
+                static_folder='app/static',
+                root_path=os.path.dirname(os.path.abspath(__file__)))
+    configure(app, config)
+
+    audit = AuditService(app.config, app_module=import_name if import_name != __name__ else None)
+    app.extensions['audit'] = audit
+    instrumentation.init_app(app, audit.metrics)
+
+    for rule, view, options in _ROUTES:
+        app.add_url_rule(rule, view_func=view, **options)
+    return app
+
+
+def service():
+    """The AuditService of the app handling the current request"""
+    return current_app.extensions['audit']
+
+
+def request_engine():
+    """Engine for the mode form/query field, else the default one. Raises ValueError."""
+    return service().engine(request.values.get('mode'))
+
+
+def wants_tiled_quality():
+    """tiled=1/0 in the query string or form overrides QUALITY_TILED"""
+    value = request.values.get('tiled')
+    if value is None or value == '':
+        return current_app.config['QUALITY_TILED']
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
+def request_store_id(planogram=None):
+    """store_id form/query field, else the name the planogram was uploaded under"""
+    return request.values.get('store_id') or (planogram.name if planogram is not None else None)
+
+
+def results_view(analysis, image_filename, external=False):
+    """The result fields shown on the results page and returned by the API"""
+    return {
+        'audit_id': analysis.get('audit_id'),
+        'image_url': url_for('static', filename=f'uploads/{image_filename}', _external=external) if image_filename else None,
+        'metadata': analysis['metadata'],
+        'quality_issues': analysis['quality_issues'],
+        'detected_products': analysis['detected_products'],
+        'anomalies': analysis['anomalies'],
+        'quality_map': analysis.get('quality_map'),
+        'detection': analysis.get('detection'),
+        'shelf_layout': analysis.get('shelf_layout'),
+        'metadata_errors': analysis.get('metadata_errors'),
+        'engine': analysis.get('engine'),
+        'quality_tier': analysis.get('quality_tier'),
+        'ai_enabled': analysis['ai_enabled']
+    }
+
+
+@route('/')
+def index():
+    audit = service()
+    return render_template('index.html', tiled_quality_available=True,
+                           tiled_quality_default=current_app.config['QUALITY_TILED'],
+                           engines=list(audit.engines), default_engine=current_app.config['DEFAULT_ENGINE'])
+
+
+@route('/health')
+def health():
+    """Liveness check; never touches the model"""
+    return jsonify({'status': 'ok'})
+
+
+@route('/ready')
+def ready():
+    """Readiness check; reports 503 while the model is still loading, or when an offline node failed to load it"""
+    audit = service()
+    model_status = audit.model_status()
+    if model_status is None:
+        # No enabled engine needs the model
+        return jsonify({'ready': True, 'model': None}), 200
+    is_ready = model_status['state'] != 'loading' and not (audit.model_registry.offline and model_status['state'] == 'failed')
+    return jsonify({'ready': is_ready, 'model': model_status}), (200 if is_ready else 503)
+
+
+@route('/api/stats/inference')
+def inference_stats():
+    """Batching metrics for tuning INFERENCE_MAX_BATCH_SIZE and INFERENCE_MAX_WAIT_MS"""
+    audit = service()
+    batching = audit.inference_batcher.stats() if audit.inference_batcher is not None else {}
+    return jsonify({'batching_enabled': current_app.config['INFERENCE_BATCHING'] and audit.inference_batcher is not None,
+                    **batching, 'engines': list(audit.engines), 'quality_cascade': audit.cascade_stats(),
+                    'process': {'pid': os.getpid(), 'memory': worker_memory()},
+                    'imports': lazy_modules.import_report()})
+
+
+@route('/api/stats/cache')
+def cache_stats():
+    """Hit/miss counters for the result cache"""
+    return jsonify(service().result_cache.stats())
+
+
+@route('/api/stats/audits')
+def audit_stats():
+    """Number of audits and anomalies in the audit history"""
+    return jsonify(service().result_store.stats())
+
+
+@route('/upload', methods=['POST'])
+def upload_files():
+    audit = service()
+    if 'image' not in request.files or 'metadata' not in request.files:
+        flash('Both image and metadata files are required', 'danger')
+        return redirect(url_for('index'))
+
+    image_file = request.files['image']
+    metadata_file = request.files['metadata']
+
+    if image_file.filename == '' or metadata_file.filename == '':
+        flash('No selected files', 'danger')
+        return redirect(url_for('index'))
+
+    if not (audit.allowed_file(image_file.filename) and audit.allowed_file(metadata_file.filename)):
+        flash('Invalid file type', 'danger')
+        return redirect(url_for('index'))
+
+    try:
+        engine = request_engine()
+    except ValueError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('index'))
+
+    try:
+        with audit.metrics.stage('ingest'):
+            image_upload, metadata_upload = audit.read_uploads(image_file, metadata_file)
+    except UploadRejected:
+        flash('Invalid file type', 'danger')
+        return redirect(url_for('index'))
+
+    try:
+        with audit.metrics.stage('parse_metadata'):
+            planogram, _ = audit.compile_metadata_upload(metadata_upload)
+
+        # Identical submissions go to the audit saved the first time
+        tiled = wants_tiled_quality()
+        cache_key, cached = audit.lookup_cached_result(image_upload.sha256, planogram, engine, tiled)
+        if cached and cached.get('audit_id'):
+            return redirect(url_for('analyze', audit=cached['audit_id']))
+
+        # Save image and metadata files; the results page shows the saved image
+        with audit.metrics.stage('persist'):
+            image_filename = audit.persist_upload(image_upload, required=True)
+            metadata_filename = audit.persist_upload(metadata_upload, required=True)
+
+        # Analyze once and save the result; the results page loads it from the audit history
+        analysis = audit.run_analysis(audit.decode_upload(image_upload), planogram.items(), engine, tiled, planogram.errors)
+        audit_id = audit.save_audit(analysis, image_upload.sha256, planogram, engine, tiled, request_store_id(planogram),
+                                    image_filename, metadata_filename)
+        audit.result_cache.set(cache_key, {**analysis, 'audit_id': audit_id, 'image_filename': image_filename, 'metadata_filename': metadata_filename})
+    finally:
+        image_upload.close()
+        metadata_upload.close()
+
+    if audit_id is None:
+        return redirect(url_for('analyze', image=image_filename, metadata=metadata_filename, tiled=int(tiled), mode=engine.name))
+    return redirect(url_for('analyze', audit=audit_id))
+
+
+@route('/analyze')
+def analyze():
+    audit = service()
+    # Saved audits are shown as they were, without running the pipeline again
+    audit_id = request.args.get('audit')
+    if audit_id:
+        with audit.metrics.stage('load_result'):
+            saved = audit.result_store.get(audit_id)
+        if saved is None:
+            flash('Unknown audit', 'danger')
+            return redirect(url_for('index'))
+        results = results_view({**saved['result'], 'audit_id': audit_id}, saved['image_filename'])
+        with audit.metrics.stage('render'):
+            return render_template('results.html', results=results)
+
+    image_filename = request.args.get('image')
+    metadata_filename = request.args.get('metadata')
+
+    if not image_filename or not metadata_filename:
+        flash('Missing files for analysis', 'danger')
+        return redirect(url_for('index'))
+
+    try:
+        image_path = audit.upload_storage.path(image_filename)
+        metadata_path = audit.upload_storage.path(metadata_filename)
+    except ValueError:
+        flash('Missing files for analysis', 'danger')
+        return redirect(url_for('index'))
+
+    if not (os.path.isfile(image_path) and os.path.isfile(metadata_path)):
+        flash('Missing files for analysis', 'danger')
+        return redirect(url_for('index'))
+
+    try:
+        engine = request_engine()
+    except ValueError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('index'))
+
+    # Parse metadata, unless this planogram was already compiled
+    with audit.metrics.stage('parse_metadata'):
+        planogram, _ = audit.planogram_store.compile_file(metadata_path)
+
+    # Reuse the stored result for content we have already analyzed
+    with audit.metrics.stage('read_upload'):
+        with open(image_path, 'rb') as f:
+            image_bytes = f.read()
+    tiled = wants_tiled_quality()
+    image_hash = hash_bytes(image_bytes)
+    cache_key, analysis = audit.lookup_cached_result(image_hash, planogram, engine, tiled)
+
+    if analysis is None:
+        analysis = audit.run_analysis(audit.decode_bytes(image_bytes, path=image_path), planogram.items(), engine, tiled, planogram.errors)
+        audit_id = audit.save_audit(analysis, image_hash, planogram, engine, tiled, request_store_id(planogram),
+                                    image_filename, metadata_filename)
+        analysis = {**analysis, 'audit_id': audit_id}
+        audit.result_cache.set(cache_key, {**analysis, 'image_filename': image_filename, 'metadata_filename': metadata_filename})
+
+    # Prepare results for display
+    results = results_view(analysis, image_filename)
+
+    with audit.metrics.stage('render'):
+        return render_template('results.html', results=results)
+
+
+@route('/api/analyze', methods=['POST'])
+def api_analyze():
+    """API endpoint for programmatic analysis"""
+    audit = service()
+    # The metadata can be sent as a file or as the id or name of an uploaded planogram
+    planogram_reference = request.form.get('planogram', '')
+    if 'image' not in request.files or ('metadata' not in request.files and not planogram_reference):
+        return jsonify({'error': 'An image file and a metadata file or planogram are required'}), 400
+
+    image_file = request.files['image']
+    metadata_file = request.files.get('metadata')
+
+    if image_file.filename == '' or (metadata_file is not None and metadata_file.filename == ''):
+        return jsonify({'error': 'No selected files'}), 400
+
+    if not audit.allowed_file(image_file.filename) or (metadata_file is not None and not audit.allowed_file(metadata_file.filename)):
+        return jsonify({'error': 'Invalid file type'}), 400
+
+    try:
+        engine = request_engine()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    planogram = None
+    if metadata_file is None:
+        planogram = audit.planogram_store.get(planogram_reference)
+        if planogram is None:
+            return jsonify({'error': f'Unknown planogram {planogram_reference}'}), 404
+
+    try:
+        with audit.metrics.stage('ingest'):
+            if metadata_file is None:
+                image_upload = audit.ingest(image_file, IMAGE_KINDS)
+                metadata_upload = None
+            else:
+                image_upload, metadata_upload = audit.read_uploads(image_file, metadata_file)
+    except UploadRejected as e:
+        return jsonify({'error': f'Invalid file type: {str(e)}'}), 400
+
+    try:
+        # Parse metadata, unless this planogram was already compiled
+        if planogram is None:
+            with audit.metrics.stage('parse_metadata'):
+                planogram, _ = audit.compile_metadata_upload(metadata_upload)
+
+        # Identical submissions return the stored result without saving or analyzing again
+        tiled = wants_tiled_quality()
+        cache_key, analysis = audit.lookup_cached_result(image_upload.sha256, planogram, engine, tiled)
+        if analysis is not None:
+            image_filename = analysis['image_filename']
+        else:
+            # Save image and metadata files (in the background unless UPLOAD_PERSIST=sync)
+            with audit.metrics.stage('persist'):
+                image_filename = audit.persist_upload(image_upload)
+                metadata_filename = audit.persist_upload(metadata_upload) if metadata_upload is not None else None
+
+            # Analyze the ingested bytes instead of reading the saved copy back
+            analysis = audit.run_analysis(audit.decode_upload(image_upload), planogram.items(), engine, tiled, planogram.errors)
+            audit_id = audit.save_audit(analysis, image_upload.sha256, planogram, engine, tiled, request_store_id(planogram),
+                                        image_filename, metadata_filename)
+            analysis = {**analysis, 'audit_id': audit_id}
+            audit.result_cache.set(cache_key, {**analysis, 'image_filename': image_filename, 'metadata_filename': metadata_filename})
+    finally:
+        image_upload.close()
+        if metadata_upload is not None:
+            metadata_upload.close()
+
+    # Prepare results
+    results = {**results_view(analysis, image_filename, external=True), 'planogram_id': planogram.id}
+
+    return jsonify(results)
+
+
+@route('/api/planograms', methods=['POST'])
+def upload_planogram():
+    """Compile a metadata file once, optionally under a name, for later audits to refer to"""
+    audit = service()
+    if 'metadata' not in request.files or request.files['metadata'].filename == '':
+        return jsonify({'error': 'A metadata file is required'}), 400
+
+    metadata_file = request.files['metadata']
+    if not audit.allowed_file(metadata_file.filename):
+        return jsonify({'error': 'Invalid file type'}), 400
+
+    try:
+        with audit.metrics.stage('ingest'):
+            metadata_upload = audit.ingest(metadata_file, METADATA_KINDS)
+    except UploadRejected as e:
+        return jsonify({'error': f'Invalid file type: {str(e)}'}), 400
+
+    # Uploading again under the same name refreshes it to the new contents
+    try:
+        with audit.metrics.stage('parse_metadata'):
+            planogram, created = audit.compile_metadata_upload(metadata_upload, name=request.form.get('name') or None,
+                                                               persist=True)
+    finally:
+        metadata_upload.close()
+
+    response = jsonify(planogram.summary())
+    response.headers['Location'] = url_for('get_planogram', reference=planogram.id)
+    return response, 201 if created else 200
+
+
+@route('/api/planograms')
+def list_planograms():
+    planogram_store = service().planogram_store
+    return jsonify({**planogram_store.stats(), 'planograms': planogram_store.summaries()})
+
+
+@route('/api/planograms/<reference>')
+def get_planogram(reference):
+    """A compiled planogram by id or name, with its products"""
+    planogram = service().planogram_store.get(reference)
+    if planogram is None:
+        return jsonify({'error': 'Unknown planogram'}), 404
+    return jsonify({**planogram.summary(), 'metadata': planogram.items()})
+
+
+def job_response(job):
+    """Serialize a job snapshot for the API"""
+    response = {
+        'job_id': job['id'],
+        'status': job['status'],
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at']
+    }
+
+    if job['status'] == 'done':
+        response['result'] = results_view(job['result'], job['context']['image_filename'], external=True)
+    elif job['status'] == 'failed':
+        response['error'] = job['error']
+
+    return response
+
+
+@route('/api/jobs', methods=['POST'])
+def create_job():
+    """Queue an analysis and return a job id immediately"""
+    audit = service()
+    if 'image' not in request.files or 'metadata' not in request.files:
+        return jsonify({'error': 'Both image and metadata files are required'}), 400
+
+    image_file = request.files['image']
+    metadata_file = request.files['metadata']
+
+    if image_file.filename == '' or metadata_file.filename == '':
+        return jsonify({'error': 'No selected files'}), 400
+
+    if not (audit.allowed_file(image_file.filename) and audit.allowed_file(metadata_file.filename)):
+        return jsonify({'error': 'Invalid file type'}), 400
+
+    try:
+        engine = request_engine()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        with audit.metrics.stage('ingest'):
+            image_upload, metadata_upload = audit.read_uploads(image_file, metadata_file)
+    except UploadRejected as e:
+        return jsonify({'error': f'Invalid file type: {str(e)}'}), 400
+
+    try:
+        # Identical submissions complete immediately from the result cache
+        tiled = wants_tiled_quality()
+        planogram, _ = audit.compile_metadata_upload(metadata_upload)
+        cache_key, cached = audit.lookup_cached_result(image_upload.sha256, planogram, engine, tiled)
+        if cached is not None:
+            job_id = audit.job_manager.add_result(cached, context={'image_filename': cached['image_filename']})
+            return jsonify(job_response(audit.job_manager.get(job_id))), 200
+
+        # Save image and metadata files; workers read them from disk
+        image_filename = audit.persist_upload(image_upload, required=True)
+        metadata_filename = audit.persist_upload(metadata_upload, required=True)
+    finally:
+        image_upload.close()
+        metadata_upload.close()
+
+    image_path = audit.upload_storage.path(image_filename)
+    metadata_path = audit.upload_storage.path(metadata_filename)
+
+    store_id = request_store_id(planogram)
+
+    def store_result(analysis):
+        # Runs before the job is reported done, so the audit id is part of its result
+        audit_id = audit.save_audit(analysis, image_upload.sha256, planogram, engine, tiled, store_id, image_filename, metadata_filename)
+        analysis['audit_id'] = audit_id
+        audit.result_cache.set(cache_key, {**analysis, 'image_filename': image_filename, 'metadata_filename': metadata_filename})
+
+    try:
+        job_id = audit.submit_audit(image_path, metadata_path, tiled, engine,
+                                    context={'image_filename': image_filename},
+                                    on_success=store_result)
+    except JobQueueFull as e:
+        # Stored files may be shared with other submissions of the same content; the sweeper expires them
+        response = jsonify({'error': f'Too many pending jobs, retry later ({str(e)})'})
+        response.headers['Retry-After'] = '5'
+        return response, 429
+
+    response = jsonify({'job_id': job_id, 'status': 'queued', 'status_url': url_for('get_job', job_id=job_id, _external=True)})
+    response.headers['Location'] = url_for('get_job', job_id=job_id)
+    return response, 202
+
+
+@route('/api/jobs/<job_id>')
+def get_job(job_id):
+    """Report job status, and the analysis once it is done"""
+    job = service().job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+
+    return jsonify(job_response(job))
+
+
+@route('/api/bulk', methods=['POST'])
+def api_bulk():
+    """Audit a zip/tar archive of image + metadata pairs, streaming JSON Lines as results finish"""
+    if 'archive' not in request.files or request.files['archive'].filename == '':
+        return jsonify({'error': 'An archive file is required'}), 400
+
+    try:
+        engine = request_engine()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    # The pool workers rebuild this app variant and audit with the same engine
+    pool = get_shared_pool(service().app_module, engine.name)
+
+    extract_dir = tempfile.mkdtemp(prefix='bulk_')
+    archive_path = os.path.join(extract_dir, 'upload.archive')
+    request.files['archive'].save(archive_path)
+
+    try:
+        extract_archive(archive_path, os.path.join(extract_dir, 'pairs'))
+    except (ValueError, OSError) as e:
+        shutil.rmtree(extract_dir, ignore_errors=True)
+        return jsonify({'error': f'Invalid archive: {str(e)}'}), 400
+
+    base_dir = os.path.join(extract_dir, 'pairs')
+    pairs, unmatched = find_pairs(base_dir)
+
+    def generate():
+        try:
+            yield from to_json_lines(run_bulk(pairs, pool, base_dir=base_dir, unmatched=unmatched))
+        finally:
+            shutil.rmtree(extract_dir, ignore_errors=True)
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
+def history_filters():
+    """store_id, since and until query parameters; times are unix seconds or ISO 8601. Raises ValueError."""
+    filters = {'store_id': request.args.get('store_id') or None}
+    for name in ('since', 'until'):
+        value = request.args.get(name)
+        if not value:
+            filters[name] = None
+            continue
+        try:
+            filters[name] = float(value)
+        except ValueError:
+            filters[name] = datetime.fromisoformat(value).timestamp()
+    return filters
+
+
+def page_args():
+    return {'limit': request.args.get('limit', 50, type=int), 'cursor': request.args.get('cursor') or None}
+
+
+@route('/api/audits')
+def list_audits():
+    """Saved audits, newest first; pass next_cursor back as cursor for the next page"""
+    try:
+        return jsonify(service().result_store.list_audits(**history_filters(), **page_args()))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+
+@route('/api/audits/<audit_id>')
+def get_audit(audit_id):
+    """One saved audit with its full result"""
+    saved = service().result_store.get(audit_id)
+    if saved is None:
+        return jsonify({'error': 'Unknown audit'}), 404
+    result = results_view({**saved.pop('result'), 'audit_id': audit_id}, saved['image_filename'], external=True)
+    return jsonify({**saved, 'result': result})
+
+
+@route('/api/anomalies')
+def list_anomalies():
+    """Anomalies across all saved audits, newest first, optionally of one type"""
+    try:
+        return jsonify(service().result_store.list_anomalies(anomaly_type=request.args.get('type') or None,
+                                                             **history_filters(), **page_args()))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+
+@route('/api/anomalies/trend')
+def anomaly_trend():
+    """Anomaly counts per hour, day or week and type, for dashboards"""
+    bucket = request.args.get('bucket', 'day')
+    if bucket not in TREND_BUCKETS:
+        return jsonify({'error': f'bucket must be one of {", ".join(TREND_BUCKETS)}'}), 400
+    try:
+        trend = service().result_store.anomaly_trend(bucket, anomaly_type=request.args.get('type') or None, **history_filters())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'bucket': bucket, 'trend': trend})
+
+
+@route('/api/stats/jobs')
+def job_stats():
+    return jsonify(service().job_manager.stats())
+
+
+@route('/api/stats/storage')
+def storage_stats():
+    """Dedup hits and the outcome of the last retention/quota sweep"""
+    return jsonify(service().upload_storage.stats())
+
+
+@route('/metrics')
+def metrics_endpoint():
+    """Prometheus text exposition of stage timings and component counters"""
+    if not current_app.config['METRICS_ENABLED']:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    return Response(service().metrics.render(), mimetype='text/plain; version=0.0.4')
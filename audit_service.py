@@ -0,0 +1,348 @@
+"""
+Shared audit pipeline behind every app variant
+
+AuditService owns the components an app needs whichever engines it runs:
+result cache, job pool, upload storage, planogram store, audit history,
+metrics and, when the ViT engine is enabled, the model registry and
+inference batcher. Engines (engines.py) only supply the analysis steps, so
+caching, persistence and instrumentation are written once.
+"""
+
+import importlib
+import time
+
+import instrumentation
+import metadata_parser
+import quality_metrics
+import shelf_layout
+from engines import ENGINE_VIT, create_engine, engine_detector
+from image_pipeline import DecodedImage, as_decoded_image
+from inference_batcher import InferenceBatcher
+from jobs import JobManager, JobStore
+from model_registry import ModelRegistry
+from planogram_store import PlanogramDatabase, PlanogramStore
+from product_detection import create_detector, DETECTOR_MOCK, DETECTOR_MODEL
+from result_cache import ResultCache, make_cache_key
+from result_store import ResultStore
+from upload_ingest import ingest_upload, UploadPersister, UploadRejected, IMAGE_KINDS, METADATA_KINDS
+from upload_storage import UploadStorage
+
+
+def run_audit_job(app_module, image_path, metadata_path, tiled, mode):
+    """
+    Job entry point for process pools. Bound methods don't pickle, so the
+    spawned child imports the app module (building its own app once) and
+    audits with that app's service.
+    """
+    audit = importlib.import_module(app_module).app.extensions['audit']
+    return audit.audit_files(image_path, metadata_path, tiled, mode)
+
+
+class AuditService:
+    """Components and pipeline steps shared by the routes of one app"""
+
+    def __init__(self, config, app_module=None):
+        self.config = config
+        self.app_module = app_module
+
+        # Per-stage timing histograms; when disabled every stage timer is a shared no-op
+        self.metrics = instrumentation.Metrics(enabled=config['METRICS_ENABLED'])
+
+        # The model is only set up (and loaded) when an enabled engine needs it
+        self.model_registry = None
+        self.inference_batcher = None
+        if ENGINE_VIT in config['ENGINES']:
+            self.model_registry = ModelRegistry(config['MODEL_NAME'],
+                                                backend_name=config['INFERENCE_BACKEND'],
+                                                onnx_path=config['ONNX_MODEL_PATH'],
+                                                check_parity=config['INFERENCE_PARITY_CHECK'],
+                                                cache_dir=config['MODEL_CACHE_DIR'],
+                                                offline=config['MODEL_OFFLINE'],
+                                                verify_mode=config['MODEL_CACHE_VERIFY'])
+            if config['MODEL_LOAD_MODE'] == 'background':
+                self.model_registry.start_background_load()
+            elif config['MODEL_LOAD_MODE'] == 'startup':
+                self.model_registry.load()
+
+            # Coalesce concurrent ViT calls into batched forward passes
+            self.inference_batcher = InferenceBatcher(self.model_registry.get,
+                                                      max_batch_size=config['INFERENCE_MAX_BATCH_SIZE'],
+                                                      max_wait_ms=config['INFERENCE_MAX_WAIT_MS'])
+
+        self.result_cache = ResultCache(max_entries=config['RESULT_CACHE_SIZE'],
+                                        disk_dir=config['RESULT_CACHE_DIR'] or None,
+                                        disk_max_bytes=config['RESULT_CACHE_MAX_MB'] * 1024 * 1024,
+                                        ttl_seconds=config['RESULT_CACHE_TTL'])
+
+        # Job records and uploaded planograms go to the audit database, so every server process can see them
+        self.job_manager = JobManager(workers=config['JOB_WORKERS'],
+                                      max_queue=config['JOB_MAX_QUEUE'],
+                                      executor=config['JOB_EXECUTOR'],
+                                      result_ttl=config['JOB_RESULT_TTL'],
+                                      store=JobStore(config['RESULT_DB_PATH']))
+
+        self.upload_storage = UploadStorage(config['UPLOAD_FOLDER'],
+                                            retention_seconds=config['UPLOAD_RETENTION_DAYS'] * 86400,
+                                            quota_bytes=config['UPLOAD_QUOTA_MB'] * 1024 * 1024)
+        self.upload_storage.start_sweeper(config['UPLOAD_SWEEP_INTERVAL'])
+        self.upload_persister = UploadPersister(self.upload_storage, mode=config['UPLOAD_PERSIST'])
+
+        self.planogram_store = PlanogramStore(metadata_parser.iter_metadata_bytes, metadata_parser.iter_metadata_file,
+                                              max_entries=config['PLANOGRAM_CACHE_SIZE'],
+                                              database=PlanogramDatabase(config['RESULT_DB_PATH']))
+
+        self.result_store = ResultStore(config['RESULT_DB_PATH'])
+
+        # Each engine runs its own detector (the mock engine the mock one, the others DETECTOR_BACKEND);
+        # engines with the same detector share it, and all share the metrics and model
+        self.detectors = {}
+        self.engines = {}
+        for name in config['ENGINES']:
+            backend = engine_detector(name, config['DETECTOR_BACKEND'])
+            if backend not in self.detectors:
+                self.detectors[backend] = self._create_detector(backend)
+            options = {}
+            if name == ENGINE_VIT:
+                options = {'model_registry': self.model_registry,
+                           'inference_batcher': self.inference_batcher if config['INFERENCE_BATCHING'] else None,
+                           'block': config['MODEL_LOAD_MODE'] != 'background',
+                           'cascade': config['QUALITY_CASCADE'],
+                           'cascade_margin': config['QUALITY_CASCADE_MARGIN'],
+                           'ai_threshold': config['QUALITY_AI_THRESHOLD'],
+                           'tile_ai': config['QUALITY_TILE_AI']}
+            self.engines[name] = create_engine(name, self.detectors[backend], self.metrics, **options)
+        if config['DEFAULT_ENGINE'] not in self.engines:
+            raise ValueError(f"DEFAULT_ENGINE {config['DEFAULT_ENGINE']!r} is not one of the enabled engines "
+                             f"({', '.join(self.engines)})")
+
+        self.metrics.register_collector(self.collect_component_metrics)
+
+    def _create_detector(self, backend):
+        """Build a detector backend; one that can't be created falls back to the mock detections"""
+        try:
+            options = {}
+            if backend == DETECTOR_MODEL:
+                options = {'model_name': self.config['DETECTION_MODEL'], 'score_threshold': self.config['DETECTION_THRESHOLD']}
+            return create_detector(backend, **options)
+        except Exception as e:
+            print(f"Error creating {backend} detector, using mock detections: {str(e)}")
+            return create_detector(DETECTOR_MOCK)
+
+    def engine(self, mode=None):
+        """The engine for a request's mode parameter, else the default one. Raises ValueError."""
+        if not mode:
+            return self.engines[self.config['DEFAULT_ENGINE']]
+        engine = self.engines.get(mode.lower())
+        if engine is None:
+            raise ValueError(f'Unknown mode {mode!r}; expected one of {", ".join(self.engines)}')
+        return engine
+
+    def allowed_file(self, filename):
+        return '.' in filename and filename.rsplit('.', 1)[1].lower() in self.config['ALLOWED_EXTENSIONS']
+
+    def ingest(self, file, kinds):
+        return ingest_upload(file, kinds, spool_limit=self.config['UPLOAD_SPOOL_LIMIT'])
+
+    def read_uploads(self, image_file, metadata_file):
+        """Stream both uploads into memory, checking their contents. Raises UploadRejected."""
+        image_upload = self.ingest(image_file, IMAGE_KINDS)
+        try:
+            metadata_upload = self.ingest(metadata_file, METADATA_KINDS)
+        except UploadRejected:
+            image_upload.close()
+            raise
+        return image_upload, metadata_upload
+
+    def persist_upload(self, upload, required=False):
+        """Save an ingested upload under its content hash; None when persistence is off"""
+        return self.upload_persister.persist(upload, required=required)
+
+    def decode_upload(self, upload):
+        """DecodedImage over the ingested bytes, without reading a saved copy back"""
+        return DecodedImage(path=upload.temp_path, data=upload.data,
+                            max_working_side=self.config['MAX_WORKING_RESOLUTION'])
+
+    def decode_bytes(self, image_bytes, path=None):
+        return DecodedImage.from_bytes(image_bytes, path=path, max_working_side=self.config['MAX_WORKING_RESOLUTION'])
+
+    def parse_metadata_file(self, file_path, errors=None):
+        """Parse the metadata file into a structured format; bad rows go to errors (a MetadataErrors)"""
+        return list(metadata_parser.iter_metadata_file(file_path, errors))
+
+    def compile_metadata_upload(self, upload, name=None, persist=False):
+        """
+        Compiled planogram for an ingested metadata upload, streamed from memory
+        or its spill file; persist also saves it for the other server processes
+        """
+        if upload.data is None:
+            return self.planogram_store.compile_file(upload.temp_path, upload.sha256, name=name, persist=persist)
+        return self.planogram_store.compile(upload.data, upload.sha256, name=name, persist=persist)
+
+    def result_variant(self, engine, tiled=False):
+        """Results depend on the engine and detector backend as well as on the inputs"""
+        variant = f'{engine.name}:{engine.detector.name}'
+        return f'{variant}:tiled' if tiled else variant
+
+    def lookup_cached_result(self, image_hash, planogram, engine, tiled=False):
+        """
+        Return (cache_key, cached analysis or None) for an image hash and
+        compiled planogram. On a cache miss the newest saved audit of the same
+        inputs is used, so any server process reuses results saved by another.
+        """
+        variant = self.result_variant(engine, tiled)
+        cache_key = make_cache_key(image_hash, planogram.metadata_hash, variant=variant)
+        with self.metrics.stage('cache_lookup'):
+            cached = self.result_cache.get(cache_key)
+        if cached is None:
+            cached = self.load_saved_result(image_hash, planogram, variant)
+            if cached is None:
+                return cache_key, None
+            self.result_cache.set(cache_key, cached)
+
+        # Results computed before the model finished loading are refreshed once it is available
+        if not cached['ai_enabled'] and engine.ai_enabled:
+            return cache_key, None
+
+        # The stored upload may have been cleaned up since
+        if cached['image_filename'] and not self.upload_storage.exists(cached['image_filename']):
+            return cache_key, None
+
+        return cache_key, cached
+
+    def load_saved_result(self, image_hash, planogram, variant):
+        """The newest saved audit of these inputs in the result cache format, or None"""
+        ttl = self.config['RESULT_CACHE_TTL']
+        try:
+            with self.metrics.stage('load_result'):
+                audit_id = self.result_store.find_latest(image_hash, planogram.metadata_hash, variant,
+                                                         since=time.time() - ttl if ttl else None)
+                saved = self.result_store.get(audit_id) if audit_id is not None else None
+        except Exception as e:
+            print(f"Error loading saved audit: {str(e)}")
+            return None
+        if saved is None:
+            return None
+        return {**saved['result'], 'audit_id': audit_id,
+                'image_filename': saved['image_filename'], 'metadata_filename': saved['metadata_filename']}
+
+    def run_analysis(self, image, metadata, engine=None, tiled=False, metadata_errors=None):
+        """Run quality analysis, detection and comparison with one engine, decoding the image only once"""
+        engine = engine or self.engine()
+        image = as_decoded_image(image, self.config['MAX_WORKING_RESOLUTION'])
+
+        # Analyze image quality, noting which tier of the quality cascade decided
+        with self.metrics.stage('quality'):
+            quality_issues, quality_tier = engine.assess_quality(image)
+
+        # Per-region quality map; bad regions are also reported as issues with coordinates
+        quality_map = None
+        if tiled:
+            with self.metrics.stage('quality_tiles'):
+                quality_map = engine.analyze_tiles(image, self.config['QUALITY_TILE_GRID'])
+            quality_issues.extend(quality_metrics.region_issues(quality_map))
+
+        # Detect products in image
+        with self.metrics.stage('detection'):
+            detections = engine.detect(image)
+            detected_products = detections.to_regions()
+
+        # Assign products to shelf rows and (row, column) sections
+        with self.metrics.stage('layout'):
+            layout = shelf_layout.build_layout(image, detected_products)
+
+        # Compare metadata with detected products
+        with self.metrics.stage('comparison'):
+            anomalies = engine.compare(metadata, detected_products, image, layout)
+
+        return {
+            'metadata': metadata,
+            'quality_issues': quality_issues,
+            'detected_products': detected_products,
+            'anomalies': anomalies,
+            'quality_map': quality_map,
+            'detection': detections.summary(),
+            'shelf_layout': layout.summary(),
+            'metadata_errors': metadata_errors.summary() if metadata_errors is not None else None,
+            'engine': engine.name,
+            'quality_tier': quality_tier,
+            'ai_enabled': engine.ai_enabled
+        }
+
+    def audit_files(self, image_path, metadata_path, tiled=None, mode=None):
+        """Full pipeline for saved files"""
+        if tiled is None:
+            tiled = self.config['QUALITY_TILED']
+
+        # Parse metadata, unless this planogram was already compiled
+        with self.metrics.stage('parse_metadata'):
+            planogram, _ = self.planogram_store.compile_file(metadata_path)
+
+        return self.run_analysis(image_path, planogram.items(), self.engine(mode), tiled, planogram.errors)
+
+    def submit_audit(self, image_path, metadata_path, tiled, engine, context=None, on_success=None):
+        """Queue audit_files on the job pool; raises JobQueueFull"""
+        args = (image_path, metadata_path, tiled, engine.name)
+        if self.job_manager.executor_kind == 'process' and self.app_module:
+            return self.job_manager.submit(run_audit_job, self.app_module, *args, context=context, on_success=on_success)
+        return self.job_manager.submit(self.audit_files, *args, context=context, on_success=on_success)
+
+    def save_audit(self, analysis, image_hash, planogram, engine, tiled, store_id, image_filename, metadata_filename):
+        """Save a result to the audit history; returns the audit id, or None if it could not be saved"""
+        try:
+            with self.metrics.stage('save_result'):
+                return self.result_store.save(analysis, image_hash, planogram.metadata_hash,
+                                              variant=self.result_variant(engine, tiled), store_id=store_id,
+                                              image_filename=image_filename, metadata_filename=metadata_filename)
+        except Exception as e:
+            print(f"Error saving audit result: {str(e)}")
+            return None
+
+    def cascade_stats(self):
+        """Quality cascade counters of the ViT engine; None when it is not enabled"""
+        engine = self.engines.get(ENGINE_VIT)
+        return engine.cascade_stats() if engine is not None else None
+
+    def model_status(self):
+        return self.model_registry.status() if self.model_registry is not None else None
+
+    def collect_component_metrics(self):
+        """Expose counters the cache, model registry, batcher, job pool, planogram and upload stores already keep"""
+        cache = self.result_cache.stats()
+        jobs = self.job_manager.stats()
+        planograms = self.planogram_store.stats()
+        storage = self.upload_storage.stats()
+        sweep = storage['last_sweep'] or {'files': 0, 'bytes': 0, 'removed_files': 0}
+        collected = [
+            ('audit_cache_hits_total', 'counter', 'Result cache hits by tier',
+             [((('tier', 'memory'),), cache['memory_hits']), ((('tier', 'disk'),), cache['disk_hits'])]),
+            ('audit_cache_misses_total', 'counter', 'Result cache misses', [((), cache['misses'])]),
+            ('audit_jobs_in_flight', 'gauge', 'Background jobs queued or running', [((), jobs['queued_or_running'])]),
+            ('audit_planogram_compiles_total', 'counter', 'Metadata files parsed into planograms', [((), planograms['compiles'])]),
+            ('audit_planogram_hits_total', 'counter', 'Metadata files served from compiled planograms', [((), planograms['hits'])]),
+            ('audit_upload_dedup_hits_total', 'counter', 'Uploads already stored under the same content hash', [((), storage['dedup_hits'])]),
+            ('audit_upload_files', 'gauge', 'Stored uploads after the last sweep', [((), sweep['files'])]),
+            ('audit_upload_bytes', 'gauge', 'Stored upload bytes after the last sweep', [((), sweep['bytes'])]),
+            ('audit_upload_swept_files', 'gauge', 'Files removed by the last sweep', [((), sweep['removed_files'])])
+        ]
+        cascade = self.cascade_stats()
+        if cascade is not None:
+            collected += [
+                ('audit_quality_decisions_total', 'counter', 'Quality verdicts by the cascade tier that decided',
+                 [((('tier', tier),), count) for tier, count in cascade['decided_by'].items()]),
+                ('audit_quality_model_unavailable_total', 'counter', 'Ambiguous images assessed without the model',
+                 [((), cascade['model_unavailable'])])
+            ]
+        if self.model_registry is not None:
+            model = self.model_registry.status()
+            batching = self.inference_batcher.stats()
+            collected += [
+                ('audit_model_loads_total', 'counter', 'Successful model loads', [((), model['load_count'])]),
+                ('audit_model_ready', 'gauge', 'Whether the AI model is loaded',
+                 [((('backend', model['backend']), ('state', model['state'])), int(model['ready']))]),
+                ('audit_model_load_seconds', 'gauge', 'Duration of the last model load', [((), model['load_seconds'] or 0)]),
+                ('audit_inference_batches_total', 'counter', 'Batched forward passes', [((), batching['batches'])]),
+                ('audit_inference_images_total', 'counter', 'Images run through the batcher', [((), batching['images'])]),
+                ('audit_inference_errors_total', 'counter', 'Failed batched forward passes', [((), batching['errors'])]),
+                ('audit_inference_pending', 'gauge', 'Images waiting for the batcher', [((), batching['pending'])])
+            ]
+        return collected
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""
+Shelf Vision Audit Tool - Inference Backend Benchmark
+
+Compares latency, memory and confidence parity of the PyTorch eager,
+dynamically quantized int8 and ONNX Runtime backends on the same inputs.
+Prints a JSON report.
+"""
+
+import argparse
+import gc
+import json
+import os
+import statistics
+
+import torch
+from PIL import Image
+
+from inference_backends import BACKENDS, BACKEND_ONNX, BACKEND_TORCH, TorchBackend, create_backend, parity_check, time_backend
+from model_registry import DEFAULT_MODEL_NAME, parity_images
+
+
+def rss_mb():
+    """Current resident set size in MB (Linux), or None"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return None
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))]
+
+
+def load_inputs(image_processor, image_paths, batch_size):
+    """Preprocess the given images, or the synthetic shelves of the registry's parity check"""
+    if image_paths:
+        images = [Image.open(path).convert('RGB') for path in image_paths]
+    else:
+        images = parity_images()
+    images = (images * batch_size)[:batch_size]
+    return image_processor(images=images, return_tensors="pt")['pixel_values']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark CPU inference backends')
+    parser.add_argument('--model', default=os.environ.get('MODEL_NAME', DEFAULT_MODEL_NAME))
+    parser.add_argument('--backends', default=','.join(BACKENDS), help='Comma-separated backends to compare')
+    parser.add_argument('--batch-sizes', default='1,8')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--images', nargs='*', help='Sample images for the parity check (default: synthetic shelves)')
+    parser.add_argument('--onnx-path', default=os.path.join('model_cache', 'benchmark.onnx'))
+    parser.add_argument('--tolerance', type=float, default=0.02)
+    args = parser.parse_args()
+
+    from transformers import AutoImageProcessor, AutoModelForImageClassification
+
+    image_processor = AutoImageProcessor.from_pretrained(args.model)
+    model = AutoModelForImageClassification.from_pretrained(args.model)
+    model.eval()
+
+    reference = TorchBackend(model)
+    batch_sizes = [int(size) for size in args.batch_sizes.split(',')]
+    report = {'model': args.model, 'torch_threads': torch.get_num_threads(), 'backends': []}
+
+    for name in args.backends.split(','):
+        gc.collect()
+        rss_before = rss_mb()
+        try:
+            backend = reference if name == BACKEND_TORCH else create_backend(name, model, onnx_path=args.onnx_path)
+        except Exception as e:
+            report['backends'].append({'backend': name, 'error': str(e)})
+            continue
+        rss_after = rss_mb()
+
+        result = {
+            'backend': name,
+            # Extra resident memory for this backend on top of the fp32 model
+            'added_rss_mb': round(rss_after - rss_before, 1) if rss_before is not None else None,
+            'latency_ms': {}
+        }
+        if name == BACKEND_ONNX and os.path.exists(args.onnx_path):
+            result['onnx_file_mb'] = round(os.path.getsize(args.onnx_path) / (1024 * 1024), 1)
+
+        for batch_size in batch_sizes:
+            inputs = load_inputs(image_processor, args.images, batch_size)
+            samples = time_backend(backend, inputs, iterations=args.iterations)
+            result['latency_ms'][str(batch_size)] = {
+                'p50': round(percentile(samples, 50), 2),
+                'p95': round(percentile(samples, 95), 2),
+                'mean': round(statistics.mean(samples), 2),
+                'per_image_p50': round(percentile(samples, 50) / batch_size, 2)
+            }
+
+        result['parity'] = parity_check(reference, backend, load_inputs(image_processor, args.images, max(batch_sizes)),
+                                        tolerance=args.tolerance)
+        report['backends'].append(result)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
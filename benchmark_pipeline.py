@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+"""
+Shelf Vision Audit Tool - Pipeline Benchmark
+
+Generates synthetic shelf images at several resolutions and product densities
+(with matching metadata files), then times each analysis stage and the full
+/api/analyze route for every app variant. Prints a JSON report with
+p50/p95/p99 latencies and memory peaks; pass --baseline to compare against a
+previous report and fail on regressions.
+"""
+
+import argparse
+import gc
+import importlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from synthetic_shelf import SHELF_ROWS, generate_shelf
+
+VARIANTS = ('app', 'app_simple', 'app_minimal')
+
+
+def write_case(directory, width, height, products_per_row):
+    img, lines = generate_shelf(width, height, products_per_row)
+    stem = os.path.join(directory, f'shelf_{width}x{height}_{products_per_row}')
+    img.save(f'{stem}.jpg', quality=90)
+    with open(f'{stem}.txt', 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return f'{stem}.jpg', f'{stem}.txt'
+
+
+def summarize(samples_ms, peak_bytes=None):
+    ordered = sorted(samples_ms)
+
+    def percentile(p):
+        return round(ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))], 3)
+
+    summary = {'p50': percentile(50), 'p95': percentile(95), 'p99': percentile(99),
+               'mean': round(statistics.mean(ordered), 3), 'samples': len(ordered)}
+    if peak_bytes is not None:
+        summary['peak_mb'] = round(peak_bytes / (1024 * 1024), 2)
+    return summary
+
+
+def traced_peak(fn):
+    """Peak Python/NumPy allocation of one call (timed runs are done without tracing)"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def process_peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024.0, 1)
+    except OSError:
+        pass
+    return None
+
+
+def benchmark_stages(module, image_path, metadata_path, iterations):
+    """Time each stage the way the routes run them: one DecodedImage shared by all stages"""
+    from image_pipeline import DecodedImage
+
+    timings = {'parse_metadata_file': [], 'analyze_image_quality': [],
+               'detect_products_in_image': [], 'compare_metadata_with_image': []}
+    state = {}
+
+    def run_once(record):
+        started = time.perf_counter()
+        metadata = module.parse_metadata_file(metadata_path)
+        parsed = time.perf_counter()
+        image = DecodedImage.from_path(image_path)
+        module.analyze_image_quality(image)
+        analyzed = time.perf_counter()
+        detected_products = module.detect_products_in_image(image)
+        detected = time.perf_counter()
+        module.compare_metadata_with_image(metadata, detected_products, image)
+        compared = time.perf_counter()
+        state['detected'] = len(detected_products)
+        if record:
+            timings['parse_metadata_file'].append((parsed - started) * 1000.0)
+            timings['analyze_image_quality'].append((analyzed - parsed) * 1000.0)
+            timings['detect_products_in_image'].append((detected - analyzed) * 1000.0)
+            timings['compare_metadata_with_image'].append((compared - detected) * 1000.0)
+
+    run_once(record=False)  # warm-up
+    for _ in range(iterations):
+        run_once(record=True)
+
+    # One traced pass per stage for memory peaks
+    metadata = module.parse_metadata_file(metadata_path)
+    image = DecodedImage.from_path(image_path)
+    peaks = {
+        'parse_metadata_file': traced_peak(lambda: module.parse_metadata_file(metadata_path)),
+        'analyze_image_quality': traced_peak(lambda: module.analyze_image_quality(image)),
+    }
+    peaks['detect_products_in_image'] = traced_peak(lambda: module.detect_products_in_image(image))
+    detected_products = module.detect_products_in_image(image)
+    peaks['compare_metadata_with_image'] = traced_peak(
+        lambda: module.compare_metadata_with_image(metadata, detected_products, image))
+
+    return {name: summarize(samples, peaks[name]) for name, samples in timings.items()}, state['detected']
+
+
+def benchmark_route(module, image_path, metadata_path, iterations):
+    """Time POST /api/analyze through Flask's test client"""
+    client = module.app.test_client()
+    with open(image_path, 'rb') as f:
+        image_bytes = f.read()
+    with open(metadata_path, 'rb') as f:
+        metadata_bytes = f.read()
+
+    samples = []
+    for i in range(iterations + 1):
+        # Bytes after the JPEG end marker are ignored by decoders but change the
+        # content hash, so the result cache can't short-circuit the measurement
+        payload = image_bytes + f'bench{i}'.encode('ascii')
+        started = time.perf_counter()
+        response = client.post('/api/analyze', data={
+            'image': (io.BytesIO(payload), 'shelf.jpg'),
+            'metadata': (io.BytesIO(metadata_bytes), 'shelf.txt')
+        }, content_type='multipart/form-data')
+        elapsed = (time.perf_counter() - started) * 1000.0
+        if response.status_code != 200:
+            raise RuntimeError(f'/api/analyze returned {response.status_code}: {response.get_data(as_text=True)[:200]}')
+        if i > 0:
+            samples.append(elapsed)
+    return summarize(samples)
+
+
+def load_variant(name, upload_dir, db_path):
+    # The app opens its audit history, job and planogram database on import; keep benchmark runs out of instance/
+    os.environ['RESULT_DB_PATH'] = db_path
+    module = importlib.import_module(name)
+    # Keep benchmark uploads out of app/static/uploads
+    module.app.config['UPLOAD_FOLDER'] = upload_dir
+    if hasattr(module, 'upload_storage'):
+        module.upload_storage.folder = upload_dir
+    if hasattr(module, 'model_registry'):
+        module.model_registry.load()
+    return module
+
+
+def compare_with_baseline(report, baseline, threshold):
+    """Return p50 regressions larger than threshold (e.g. 1.2 = 20% slower)"""
+    def index(r):
+        entries = {}
+        for case in r['cases']:
+            key = (case['variant'], case['resolution'], case['products'])
+            for stage, summary in case.get('stages', {}).items():
+                entries[key + (stage,)] = summary['p50']
+            if 'route' in case:
+                entries[key + ('route',)] = case['route']['p50']
+        return entries
+
+    current, previous = index(report), index(baseline)
+    regressions = []
+    for key, p50 in current.items():
+        # Ignore sub-millisecond stages where noise dominates
+        if key in previous and previous[key] >= 1.0 and p50 > previous[key] * threshold:
+            regressions.append({'variant': key[0], 'resolution': key[1], 'products': key[2], 'stage': key[3],
+                                'baseline_p50': previous[key], 'p50': p50, 'ratio': round(p50 / previous[key], 2)})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the audit pipeline')
+    parser.add_argument('--variants', default=','.join(VARIANTS))
+    parser.add_argument('--resolutions', default='800x600,1920x1440,4000x3000,8000x6000')
+    parser.add_argument('--densities', default='5,20,50', help='Products per shelf row (5 rows per image)')
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--skip-route', action='store_true', help='Only time the individual stages')
+    parser.add_argument('--output', help='Write the JSON report here (default: stdout)')
+    parser.add_argument('--baseline', help='Previous report to compare against')
+    parser.add_argument('--threshold', type=float, default=1.2, help='p50 ratio counted as a regression')
+    args = parser.parse_args()
+
+    # The benchmark is single-threaded, so batching would only add its wait window
+    os.environ.setdefault('INFERENCE_BATCHING', 'False')
+    os.environ.setdefault('MODEL_LOAD_MODE', 'startup')
+
+    resolutions = [tuple(int(v) for v in r.split('x')) for r in args.resolutions.split(',')]
+    densities = [int(d) for d in args.densities.split(',')]
+
+    report = {
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count()},
+        'iterations': args.iterations,
+        'cases': []
+    }
+
+    with tempfile.TemporaryDirectory() as data_dir, tempfile.TemporaryDirectory() as upload_dir:
+        cases = [(w, h, d) + write_case(data_dir, w, h, d) for w, h in resolutions for d in densities]
+
+        for variant in args.variants.split(','):
+            try:
+                module = load_variant(variant, upload_dir, os.path.join(data_dir, f'{variant}.db'))
+            except Exception as e:
+                report['cases'].append({'variant': variant, 'error': f'Could not load variant: {str(e)}'})
+                continue
+
+            for width, height, density, image_path, metadata_path in cases:
+                case = {'variant': variant, 'resolution': f'{width}x{height}', 'products': density * SHELF_ROWS}
+                try:
+                    case['stages'], case['detected'] = benchmark_stages(module, image_path, metadata_path, args.iterations)
+                    if not args.skip_route:
+                        case['route'] = benchmark_route(module, image_path, metadata_path, args.iterations)
+                except Exception as e:
+                    case['error'] = str(e)
+                report['cases'].append(case)
+                print(f"{variant} {case['resolution']} {case['products']} products done", file=sys.stderr)
+
+    report['process_peak_rss_mb'] = process_peak_rss_mb()
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['regressions'] = compare_with_baseline(report, json.load(f), args.threshold)
+        exit_code = 1 if report['regressions'] else 0
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""
+Bulk auditing of many image/metadata pairs across a process pool
+
+Each worker imports the app variant it was created for (app, app_simple or
+app_minimal) and audits with one of its engines; torch is only imported and
+the model only loaded when that engine uses it.
+"""
+
+import importlib
+import json
+import multiprocessing
+import os
+import tarfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import lazy_modules
+
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+METADATA_EXTENSIONS = {'txt'}
+
+DEFAULT_APP_MODULE = 'app'
+
+# Set in each pool worker by _init_worker
+_audit = None
+_mode = None
+
+# Warm pools for the web endpoint, by (app module, mode)
+_shared_pools = {}
+_shared_pool_lock = threading.Lock()
+
+
+def default_workers():
+    return max(1, os.cpu_count() or 1)
+
+
+def _extension(filename):
+    return filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+
+
+def find_pairs(directory):
+    """
+    Match images with metadata files that share the same name, e.g.
+    aisle4/shelf_07.jpg and aisle4/shelf_07.txt. Returns (pairs, unmatched_images).
+    """
+    images = {}
+    metadata = {}
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if name.startswith('.'):
+                continue
+            path = os.path.join(root, name)
+            stem = os.path.relpath(path, directory).rsplit('.', 1)[0]
+            ext = _extension(name)
+            if ext in IMAGE_EXTENSIONS:
+                images[stem] = path
+            elif ext in METADATA_EXTENSIONS:
+                metadata[stem] = path
+
+    pairs = [(images[stem], metadata[stem]) for stem in sorted(images) if stem in metadata]
+    unmatched = [images[stem] for stem in sorted(images) if stem not in metadata]
+    return pairs, unmatched
+
+
+def _is_within(directory, path):
+    directory = os.path.realpath(directory)
+    return os.path.commonpath([directory, os.path.realpath(path)]) == directory
+
+
+def extract_archive(archive_path, destination):
+    """Extract a zip or tar archive, refusing members that would escape the destination"""
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as archive:
+            members = [m for m in archive.infolist()
+                       if not m.is_dir() and _is_within(destination, os.path.join(destination, m.filename))]
+            archive.extractall(destination, members=members)
+    elif tarfile.is_tarfile(archive_path):
+        with tarfile.open(archive_path) as archive:
+            members = [m for m in archive.getmembers()
+                       if m.isfile() and _is_within(destination, os.path.join(destination, m.name))]
+            archive.extractall(destination, members=members)
+    else:
+        raise ValueError('Archive must be a zip or tar file')
+
+
+def _init_worker(torch_threads, app_module, mode):
+    """Build the app once per worker process, loading the model only if the engine uses it"""
+    global _audit, _mode
+
+    # Each worker runs one image at a time, so batching would only add wait time.
+    # The model is loaded below, and only for an engine that needs it
+    os.environ['MODEL_LOAD_MODE'] = 'lazy'
+    os.environ['INFERENCE_BATCHING'] = 'False'
+
+    audit = importlib.import_module(app_module).app.extensions['audit']
+    engine = audit.engine(mode)
+    if engine.uses_model:
+        # Resident before the first image arrives
+        torch = lazy_modules.torch()
+        torch.set_num_threads(torch_threads)
+        audit.model_registry.load()
+    _audit, _mode = audit, engine.name
+
+
+def _audit_pair(image_path, metadata_path):
+    started = time.perf_counter()
+    analysis = _audit.audit_files(image_path, metadata_path, mode=_mode)
+    return {
+        'status': 'ok',
+        'elapsed_ms': round((time.perf_counter() - started) * 1000.0, 1),
+        'metadata_count': len(analysis['metadata']),
+        'metadata_errors': analysis.get('metadata_errors'),
+        'quality_issues': analysis['quality_issues'],
+        'detected_products': analysis['detected_products'],
+        'anomalies': analysis['anomalies'],
+        'engine': analysis.get('engine'),
+        'ai_enabled': analysis['ai_enabled']
+    }
+
+
+def create_pool(workers=None, app_module=DEFAULT_APP_MODULE, mode=None):
+    """
+    Process pool whose workers each build the app_module's app once and audit
+    with its engine for mode (None for the default engine)
+    """
+    workers = workers or default_workers()
+    # Split the cores between workers instead of letting every worker use all of them
+    torch_threads = max(1, default_workers() // workers)
+    # spawn: the parent may be a threaded web server, which is unsafe to fork
+    return ProcessPoolExecutor(max_workers=workers,
+                               mp_context=multiprocessing.get_context('spawn'),
+                               initializer=_init_worker,
+                               initargs=(torch_threads, app_module or DEFAULT_APP_MODULE, mode))
+
+
+def get_shared_pool(app_module=DEFAULT_APP_MODULE, mode=None):
+    """Long-lived pool for the web endpoint so workers stay warm between requests"""
+    key = (app_module or DEFAULT_APP_MODULE, mode)
+    with _shared_pool_lock:
+        if key not in _shared_pools:
+            _shared_pools[key] = create_pool(int(os.environ.get('BULK_WORKERS', 0)) or None, *key)
+        return _shared_pools[key]
+
+
+def run_bulk(pairs, pool, base_dir=None, unmatched=()):
+    """
+    Audit the pairs on the pool and yield one record per pair as soon as it
+    finishes, followed by a summary record with the throughput.
+    """
+    def relative(path):
+        return os.path.relpath(path, base_dir) if base_dir else path
+
+    started = time.perf_counter()
+    first_result = None
+    audited = errors = 0
+
+    for image_path in unmatched:
+        yield {'type': 'result', 'image': relative(image_path), 'metadata': None,
+               'status': 'skipped', 'error': 'No metadata file with the same name'}
+
+    futures = {pool.submit(_audit_pair, image_path, metadata_path): (image_path, metadata_path)
+               for image_path, metadata_path in pairs}
+
+    for future in as_completed(futures):
+        image_path, metadata_path = futures[future]
+        if first_result is None:
+            first_result = time.perf_counter() - started
+        record = {'type': 'result', 'image': relative(image_path), 'metadata': relative(metadata_path)}
+        try:
+            record.update(future.result())
+            audited += 1
+        except Exception as e:
+            record.update({'status': 'error', 'error': str(e)})
+            errors += 1
+        yield record
+
+    elapsed = time.perf_counter() - started
+    yield {
+        'type': 'summary',
+        'pairs': len(pairs),
+        'audited': audited,
+        'errors': errors,
+        'skipped': len(unmatched),
+        'elapsed_s': round(elapsed, 3),
+        # Includes worker startup (model load); compare with first_result_s for steady-state rate
+        'first_result_s': round(first_result, 3) if first_result is not None else None,
+        'images_per_sec': round(audited / elapsed, 3) if elapsed > 0 else None
+    }
+
+
+def to_json_lines(records):
+    for record in records:
+        yield json.dumps(record) + '\n'
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""
+Shelf Vision Audit Tool - Import Budget Check
+
+Imports each app variant and CLI module in a fresh interpreter and checks
+that it stays within an import-time budget without loading torch,
+transformers, cv2 or onnxruntime. For the apps it then serves the health
+check, the index page and metadata-only requests through the test client,
+which must not load them either. Prints a JSON report and exits with 1 when
+anything is over budget.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from lazy_modules import HEAVY_MODULES
+
+# Requests that must not load a heavy module; every variant serves the same routes (app_factory.py)
+APP_REQUESTS = [('GET', '/health'), ('GET', '/ready'), ('GET', '/'), ('POST', '/api/planograms'),
+                ('GET', '/api/planograms'), ('GET', '/api/audits'), ('GET', '/api/stats/inference'), ('GET', '/metrics')]
+
+# Module -> requests to probe
+TARGETS = {
+    'app': APP_REQUESTS,
+    'app_simple': APP_REQUESTS,
+    'app_minimal': APP_REQUESTS,
+    'bulk_audit': [],
+    'metadata_parser': [],
+    'model_cache': []
+}
+
+PROBE = r'''
+import io, json, sys, time
+HEAVY = {heavy!r}
+started = time.perf_counter()
+module = __import__({module!r})
+result = {{'import_seconds': time.perf_counter() - started,
+           'loaded_on_import': [name for name in HEAVY if name in sys.modules], 'requests': []}}
+app = getattr(module, 'app', None)
+if app is not None:
+    client = app.test_client()
+    with open('sample_metadata.txt', 'rb') as f:
+        metadata = f.read()
+    for method, path in {requests!r}:
+        if method == 'POST':
+            response = client.post(path, data={{'metadata': (io.BytesIO(metadata), 'metadata.txt')}},
+                                   content_type='multipart/form-data')
+        else:
+            response = client.get(path)
+        result['requests'].append({{'request': f'{{method}} {{path}}', 'status': response.status_code,
+                                   'loaded': [name for name in HEAVY if name in sys.modules]}})
+print(json.dumps(result))
+'''
+
+
+def probe(module, requests, env):
+    code = PROBE.format(heavy=HEAVY_MODULES, module=module, requests=requests)
+    completed = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+    if completed.returncode != 0:
+        raise RuntimeError(f'Importing {module} failed: {completed.stderr.strip()[-500:]}')
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check import time and lazy heavy imports')
+    parser.add_argument('--modules', default=','.join(TARGETS))
+    parser.add_argument('--budget', type=float, default=1.5, help='Seconds allowed per module import')
+    parser.add_argument('--repeat', type=int, default=3, help='Imports per module; the fastest one counts')
+    args = parser.parse_args()
+
+    report = {'budget_seconds': args.budget, 'modules': {}, 'failures': []}
+    with tempfile.TemporaryDirectory() as scratch:
+        # The model must not be loaded just because the app was imported
+        env = dict(os.environ, MODEL_LOAD_MODE='lazy', RESULT_DB_PATH=os.path.join(scratch, 'audits.db'),
+                   PYTHONDONTWRITEBYTECODE='1')
+        for module in args.modules.split(','):
+            runs = [probe(module, TARGETS.get(module, []), env) for _ in range(max(1, args.repeat))]
+            result = min(runs, key=lambda run: run['import_seconds'])
+            result['import_seconds'] = round(result['import_seconds'], 3)
+            report['modules'][module] = result
+
+            if result['import_seconds'] > args.budget:
+                report['failures'].append(f"{module}: import took {result['import_seconds']}s (budget {args.budget}s)")
+            if result['loaded_on_import']:
+                report['failures'].append(f"{module}: importing loaded {', '.join(result['loaded_on_import'])}")
+            for request in result['requests']:
+                if request['loaded']:
+                    report['failures'].append(f"{module}: {request['request']} loaded {', '.join(request['loaded'])}")
+
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if report['failures'] else 0)
+
+
+if __name__ == '__main__':
+    main()
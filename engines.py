@@ -0,0 +1,362 @@
+"""
+Analysis engines
+
+An engine is the part of an audit that differs between the app variants:
+
+- quality analyzer: assess_quality(image) -> (issues, deciding tier), and analyze_tiles(image, grid) for the quality map
+- detector:         detect(image) -> Detections, wrapping the engine's product detector
+- comparator:       compare(metadata, detected_products, image, layout) -> anomalies
+
+Registered engines (ENGINE_CLASSES) and their detectors:
+
+- mock:   header-only checks (resolution and file size) and the fixed mock detections;
+          no OpenCV or model
+- opencv: Laplacian blur and brightness checks on the downscaled grayscale view;
+          the configured DETECTOR_BACKEND
+- vit:    header and NumPy checks first; the ViT confidence pass, batched across requests,
+          only for images they leave ambiguous (the quality cascade); the configured DETECTOR_BACKEND
+
+Routes, upload handling, caching and history are shared (app_factory.py),
+so one process can serve every engine and pick one per request.
+"""
+
+import os
+import threading
+
+import numpy as np
+
+import lazy_modules
+import planogram_matching
+import quality_metrics
+import shelf_layout
+from image_pipeline import as_decoded_image
+from product_detection import DETECTOR_MOCK, Detections
+
+ENGINE_MOCK = 'mock'
+ENGINE_OPENCV = 'opencv'
+ENGINE_VIT = 'vit'
+ENGINES = (ENGINE_MOCK, ENGINE_OPENCV, ENGINE_VIT)
+
+# Quality cascade tiers, cheapest first; results record the one that decided
+TIER_HEADER = 'header'  # resolution and file size, without decoding pixels
+TIER_NUMPY = 'numpy'    # signals from the downscaled view
+TIER_VIT = 'vit'        # the image model's confidence
+TIERS = (TIER_HEADER, TIER_NUMPY, TIER_VIT)
+
+
+class Engine:
+    """Base class: subclasses implement _assess_quality(image) -> (issues, tier); detection and comparison are shared"""
+
+    name = None
+    uses_model = False  # Whether the quality analyzer needs the ViT (and so torch)
+    detector_backend = None  # Detector the engine always runs; None for the configured DETECTOR_BACKEND
+
+    def __init__(self, detector, metrics):
+        self.detector = detector
+        self.metrics = metrics
+
+    @property
+    def ai_enabled(self):
+        """Whether results from this engine include the model's opinion"""
+        return False
+
+    def assess_quality(self, image):
+        """
+        Quality issues for the image and the tier that decided them; an error
+        is reported as an issue (with tier None) instead of failing the audit
+        """
+        try:
+            return self._assess_quality(as_decoded_image(image))
+        except Exception as e:
+            self.metrics.inc('audit_errors_total', (('stage', 'quality'),))
+            return [{
+                'type': 'error',
+                'severity': 'high',
+                'description': f'Error analyzing image: {str(e)}'
+            }], None
+
+    def analyze_quality(self, image):
+        return self.assess_quality(image)[0]
+
+    def _assess_quality(self, image):
+        raise NotImplementedError
+
+    def analyze_tiles(self, image, grid):
+        """Tiled quality analysis: heatmap of bad tiles and boxes around bad regions"""
+        return quality_metrics.build_quality_map(as_decoded_image(image), grid)
+
+    def detect(self, image):
+        """Run the detector; returns a Detections object with boxes, scores and latency"""
+        try:
+            detections = self.detector.detect(image)
+        except Exception as e:
+            # e.g. the detection model could not be downloaded; report no products rather than failing the audit
+            print(f"Detection error: {str(e)}")
+            self.metrics.inc('audit_errors_total', (('stage', 'detection'),))
+            return Detections([], [], self.detector.name)
+        self.metrics.observe('audit_detection_seconds', detections.latency_ms / 1000.0, (('backend', detections.backend),))
+        return detections
+
+    def detect_products(self, image):
+        return self.detect(image).to_regions()
+
+    def compare(self, metadata, detected_products, image, layout=None):
+        """Compare metadata with detected products to find anomalies"""
+        anomalies = []
+
+        # Shelf rows and (row, column) slots, unless the caller already built them
+        if layout is None:
+            layout = shelf_layout.build_layout(image, detected_products)
+
+        # Check for count mismatch
+        metadata_product_count = len(metadata)
+        detected_product_count = len(detected_products)
+        if metadata_product_count != detected_product_count:
+            anomalies.append({
+                'type': 'count_mismatch',
+                'severity': 'high',
+                'description': f'Metadata has {metadata_product_count} products, but {detected_product_count} were detected in the image',
+                'metadata_count': metadata_product_count,
+                'detected_count': detected_product_count
+            })
+
+        # Optimal assignment of metadata sections (A1, B2, ...) to detected products per shelf row
+        anomalies.extend(planogram_matching.assignment_anomalies(metadata, detected_products, layout))
+
+        return anomalies
+
+
+class MockEngine(Engine):
+    """Resolution and file size from the image header; never decodes pixels for the quality check"""
+
+    name = ENGINE_MOCK
+    detector_backend = DETECTOR_MOCK
+
+    def _assess_quality(self, image):
+        return self._header_issues(image), TIER_HEADER
+
+    def _header_issues(self, image):
+        issues = []
+        width, height = image.size
+
+        # Check for low resolution
+        if width < 800 or height < 600:
+            issues.append({
+                'type': 'resolution',
+                'severity': 'medium',
+                'description': f'Low resolution image ({width}x{height})'
+            })
+
+        # Check file size
+        file_size = image.file_size / (1024 * 1024)  # Size in MB
+        if file_size < 0.1:
+            issues.append({
+                'type': 'file_size',
+                'severity': 'low',
+                'description': f'Small file size ({file_size:.2f} MB)'
+            })
+
+        return issues
+
+
+class OpenCVEngine(Engine):
+    """Blur and lighting checks with OpenCV on the shared grayscale view"""
+
+    name = ENGINE_OPENCV
+
+    def _assess_quality(self, image):
+        issues = []
+
+        # Check for blurriness on the shared grayscale view, capped at the working resolution
+        gray = image.working_gray
+        cv2 = lazy_modules.cv2()
+        laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
+        if laplacian_var < 100:  # Threshold for blurriness
+            issues.append({
+                'type': 'blur',
+                'severity': 'high' if laplacian_var < 50 else 'medium',
+                'description': 'Image appears to be blurry'
+            })
+
+        # Check for poor lighting
+        brightness = np.mean(gray)
+        if brightness < 50:
+            issues.append({
+                'type': 'lighting',
+                'severity': 'medium',
+                'description': 'Image appears to be too dark'
+            })
+        elif brightness > 200:
+            issues.append({
+                'type': 'lighting',
+                'severity': 'medium',
+                'description': 'Image appears to be too bright'
+            })
+
+        # Check for low resolution
+        width, height = image.size
+        if width < 800 or height < 600:
+            issues.append({
+                'type': 'resolution',
+                'severity': 'medium',
+                'description': f'Low resolution image ({width}x{height})'
+            })
+
+        return issues, TIER_NUMPY
+
+
+class ViTEngine(MockEngine):
+    """
+    Header checks, the NumPy quality signals (blur, exposure, glare, noise,
+    tilt) and the ViT confidence pass, submitted to the shared batcher.
+
+    With the cascade on, the model only sees ambiguous images: a serious
+    header issue (low resolution) or a clear NumPy verdict decides without
+    it, and signals within cascade_margin of their limits count as ambiguous.
+    """
+
+    name = ENGINE_VIT
+    uses_model = True
+    detector_backend = None
+
+    def __init__(self, detector, metrics, model_registry, inference_batcher=None, block=True,
+                 cascade=True, cascade_margin=quality_metrics.BORDERLINE_MARGIN, ai_threshold=0.7, tile_ai=True):
+        super().__init__(detector, metrics)
+        self.model_registry = model_registry
+        self.inference_batcher = inference_batcher
+        self.block = block
+        self.cascade = cascade
+        self.cascade_margin = cascade_margin
+        self.ai_threshold = ai_threshold
+        self.tile_ai = tile_ai
+        self._lock = threading.Lock()
+        self._decided = dict.fromkeys(TIERS, 0)
+        self._model_unavailable = 0
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # Counters start over in each worker
+        self._lock = threading.Lock()
+        self._decided = dict.fromkeys(TIERS, 0)
+        self._model_unavailable = 0
+
+    @property
+    def ai_enabled(self):
+        return self.model_registry.is_ready
+
+    def _assess_quality(self, image):
+        # Tier 1: resolution and file size from the header
+        issues = self._header_issues(image)
+        tier = TIER_HEADER if self.cascade and quality_metrics.has_serious_issue(issues) else None
+
+        # Tier 2: blur, exposure, glare, noise and tilt from one pass over a downscaled view.
+        # Still computed when the header decided, since these issues are reported either way
+        with self.metrics.stage('quality_metrics'):
+            signals = quality_metrics.compute_metrics(image)
+        issues.extend(quality_metrics.describe_issues(signals))
+        if tier is None and self.cascade and quality_metrics.cascade_verdict(signals, issues, margin=self.cascade_margin):
+            tier = TIER_NUMPY
+
+        # Tier 3: the image model, for ambiguous images (every image with the cascade off).
+        # While a background load is still running we skip the AI pass instead of stalling the request.
+        if tier is None:
+            ai_issue, ran = self._ai_quality(image)
+            if ai_issue is not None:
+                issues.append(ai_issue)
+            if not ran:
+                # Ambiguous, but the NumPy verdict is all there is
+                with self._lock:
+                    self._model_unavailable += 1
+                return issues, TIER_NUMPY
+            tier = TIER_VIT
+
+        with self._lock:
+            self._decided[tier] += 1
+        return issues, tier
+
+    def _ai_quality(self, image):
+        """(ai_quality issue or None, whether the model ran)"""
+        ai_models = self.model_registry.get(block=self.block)
+        if not ai_models:
+            return None, False
+        image_processor, inference_backend = ai_models
+        try:
+            # Preprocess the RGB view once, then run the model batched with concurrent requests
+            # For demonstration, we'll use the model's confidence as a quality indicator
+            # In a real app, you'd use a model specifically trained for image quality assessment
+            with self.metrics.stage('preprocess'):
+                pixel_values = image.model_inputs(image_processor)
+            with self.metrics.stage('inference'):
+                if self.inference_batcher is not None:
+                    confidence = self.inference_batcher.submit(pixel_values)
+                else:
+                    confidence = inference_backend.predict_confidences(pixel_values)[0]
+        except Exception as e:
+            # Fallback to basic analysis only
+            print(f"AI analysis error: {str(e)}")
+            return None, False
+
+        if confidence < self.ai_threshold:
+            return {
+                'type': 'ai_quality',
+                'severity': 'medium',
+                'description': f'AI detected potential image quality issues (confidence: {confidence:.2f})'
+            }, True
+        return None, True
+
+    def cascade_stats(self):
+        """Images decided per tier and the share that never reached the model"""
+        with self._lock:
+            decided = dict(self._decided)
+            model_unavailable = self._model_unavailable
+        assessed = sum(decided.values()) + model_unavailable
+        avoided = decided[TIER_HEADER] + decided[TIER_NUMPY]
+        return {
+            'enabled': self.cascade,
+            'margin': self.cascade_margin,
+            'ai_threshold': self.ai_threshold,
+            'assessed': assessed,
+            'decided_by': decided,
+            'model_unavailable': model_unavailable,
+            'inferences_avoided': avoided,
+            'avoided_ratio': round(avoided / assessed, 3) if assessed else None
+        }
+
+    def analyze_tiles(self, image, grid):
+        image = as_decoded_image(image)
+        ai_confidences = None
+
+        ai_models = self.model_registry.get(block=self.block) if self.tile_ai else None
+        if ai_models:
+            image_processor, inference_backend = ai_models
+            try:
+                # All tiles go through the model as a single batch
+                with self.metrics.stage('tile_inference'):
+                    pixel_values = image_processor(images=quality_metrics.tile_crops(image, grid), return_tensors="pt")['pixel_values']
+                    ai_confidences = inference_backend.predict_confidences(pixel_values)
+            except Exception as e:
+                print(f"AI tile analysis error: {str(e)}")
+
+        return quality_metrics.build_quality_map(image, grid, thresholds={'ai_confidence': self.ai_threshold},
+                                                 ai_confidences=ai_confidences)
+
+
+ENGINE_CLASSES = {ENGINE_MOCK: MockEngine, ENGINE_OPENCV: OpenCVEngine, ENGINE_VIT: ViTEngine}
+
+
+def engine_class(name):
+    """The registered engine class for a name; raises ValueError for unknown ones"""
+    if name not in ENGINE_CLASSES:
+        raise ValueError(f'Unknown engine {name!r}; expected one of {", ".join(ENGINES)}')
+    return ENGINE_CLASSES[name]
+
+
+def engine_detector(name, configured):
+    """Detector backend the named engine runs: its own, else the configured one"""
+    return engine_class(name).detector_backend or configured
+
+
+def create_engine(name, detector, metrics, **options):
+    """Build the named engine around a product detector; options go to its constructor"""
+    return engine_class(name)(detector, metrics, **options)
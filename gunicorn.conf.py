@@ -0,0 +1,48 @@
+"""
+Gunicorn settings for production serving: gunicorn -c gunicorn.conf.py wsgi:app
+
+The app and its model are loaded once in the master (preload_app) and shared
+copy-on-write with the forked workers. Workers are recycled after
+WEB_MAX_REQUESTS requests; a replacement is forked from the already loaded
+master, so recycling doesn't reload the model.
+"""
+
+import os
+
+import serving
+
+variant = os.environ.get('APP_VARIANT', 'full')
+
+bind = os.environ.get('BIND', f"0.0.0.0:{os.environ.get('PORT', serving.DEFAULT_PORTS.get(variant, 5002))}")
+workers = int(os.environ.get('WEB_WORKERS', 0)) or serving.default_workers(variant)
+# Threads let one worker batch concurrent ViT calls and keep serving while uploads stream in
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 0)) or serving.default_threads(variant)
+preload_app = True
+
+# Recycling bounds slow growth from fragmentation or leaks; the jitter keeps workers from restarting together
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('WEB_MAX_REQUESTS_JITTER', max(1, max_requests // 10)))
+timeout = int(os.environ.get('WEB_TIMEOUT', 120))  # Large images on a busy worker can take a while
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+# Heartbeat files in memory, so a slow disk doesn't get workers killed
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+accesslog = os.environ.get('WEB_ACCESS_LOG', '-')
+
+
+def pre_fork(server, worker):
+    # Freeze objects created since the preload too
+    serving.freeze_heap()
+
+
+def post_fork(server, worker):
+    serving.configure_worker(server.cfg.workers)
+
+
+def post_worker_init(worker):
+    # Runs before the worker accepts connections
+    seconds = serving.warmup()
+    memory = serving.worker_memory()
+    worker.log.info(f'Worker {worker.pid} warmed up in {seconds:.2f}s, memory {memory}')
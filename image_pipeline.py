@@ -0,0 +1,177 @@
+"""
+Per-request decoded image shared by the quality, detection and comparison stages
+"""
+
+import io
+import os
+import threading
+
+import numpy as np
+from PIL import Image
+
+# Longest side used by the CV stages; larger photos are decoded at reduced size
+DEFAULT_MAX_WORKING_SIDE = int(os.environ.get('MAX_WORKING_RESOLUTION', 1600))
+
+# The ViT processor resizes to 224x224; decoding at about twice that keeps its
+# resampling close to the full-resolution result
+MODEL_INPUT_SIDE = 448
+
+
+class DecodedImage:
+    """
+    Decode an image at most once and derive the views each stage needs on
+    first use: RGB/BGR/grayscale arrays, thumbnails and the model input tensor.
+
+    Stages that don't need full resolution should use the thumbnail and
+    working_* views. For JPEGs these are decoded with PIL's draft mode (DCT
+    scaling), so a large photo is never decoded at full size unless a
+    full-resolution view is requested. Thumbnails no larger than the working
+    view are shrunk from it, so the pixels are decoded once per request.
+    """
+
+    def __init__(self, path=None, data=None, max_working_side=None):
+        if path is None and data is None:
+            raise ValueError('DecodedImage needs a path or the image bytes')
+        self.path = path
+        self.data = data
+        self.max_working_side = max_working_side or DEFAULT_MAX_WORKING_SIDE
+        self._views = {}
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_path(cls, path, max_working_side=None):
+        return cls(path=path, max_working_side=max_working_side)
+
+    @classmethod
+    def from_bytes(cls, data, path=None, max_working_side=None):
+        return cls(path=path, data=data, max_working_side=max_working_side)
+
+    def _cached(self, name, build):
+        # Views are built once; the lock keeps two stages from decoding concurrently
+        view = self._views.get(name)
+        if view is None:
+            with self._lock:
+                view = self._views.get(name)
+                if view is None:
+                    view = build()
+                    self._views[name] = view
+        return view
+
+    def _open(self):
+        return Image.open(io.BytesIO(self.data) if self.data is not None else self.path)
+
+    @property
+    def file_size(self):
+        """Encoded size in bytes"""
+        if self.data is not None:
+            return len(self.data)
+        return self._cached('file_size', lambda: os.path.getsize(self.path))
+
+    @property
+    def pil(self):
+        """Fully decoded PIL image in its original mode"""
+        def build():
+            img = self._open()
+            img.load()
+            return img
+        return self._cached('pil', build)
+
+    @property
+    def size(self):
+        """(width, height), read from the header when the image isn't decoded yet"""
+        if 'pil' in self._views:
+            return self._views['pil'].size
+
+        def build():
+            with self._open() as img:
+                return img.size
+        return self._cached('size', build)
+
+    @property
+    def rgb(self):
+        """PIL image converted to RGB"""
+        return self._cached('rgb', lambda: self.pil if self.pil.mode == 'RGB' else self.pil.convert('RGB'))
+
+    @property
+    def rgb_array(self):
+        """H x W x 3 uint8 array in RGB order"""
+        return self._cached('rgb_array', lambda: np.asarray(self.rgb))
+
+    @property
+    def bgr_array(self):
+        """H x W x 3 uint8 array in BGR order, as OpenCV expects"""
+        return self._cached('bgr_array', lambda: np.ascontiguousarray(self.rgb_array[:, :, ::-1]))
+
+    @property
+    def gray(self):
+        """H x W uint8 luminance array"""
+        return self._cached('gray', lambda: np.asarray(self.rgb.convert('L')))
+
+    @staticmethod
+    def _view_side(name):
+        if name.startswith('thumbnail_'):
+            return int(name[len('thumbnail_'):])
+        return None
+
+    def thumbnail(self, max_side):
+        """RGB PIL image whose longest side is at most max_side"""
+        def build():
+            # Prefer shrinking an existing larger view over decoding again
+            larger = sorted(side for side in (self._view_side(name) for name in self._views)
+                            if side is not None and side >= max_side)
+            if larger:
+                img = self._views[f'thumbnail_{larger[0]}'].copy()
+            elif 'pil' in self._views:
+                img = self._views['pil'].copy()
+            elif max_side < self.max_working_side:
+                # Later stages need the working view anyway; decode that once and shrink it
+                img = self.working.copy()
+            else:
+                img = self._open()
+                width, height = img.size
+                if max(width, height) > max_side:
+                    # Not decoded yet: ask the JPEG decoder for the smallest DCT scale
+                    # (1/2, 1/4, 1/8) that still covers the target size. No-op for PNG.
+                    ratio = max_side / max(width, height)
+                    img.draft('RGB', (max(1, int(width * ratio)), max(1, int(height * ratio))))
+            if max(img.size) > max_side:
+                img.thumbnail((max_side, max_side), reducing_gap=None)
+            else:
+                img.load()
+            return img if img.mode == 'RGB' else img.convert('RGB')
+        return self._cached(f'thumbnail_{max_side}', build)
+
+    @property
+    def working(self):
+        """RGB image capped at max_working_side for the CV stages"""
+        return self.thumbnail(self.max_working_side)
+
+    @property
+    def working_scale(self):
+        """(sx, sy) factors that map working coordinates back to the original image"""
+        width, height = self.size
+        working_width, working_height = self.working.size
+        return width / working_width, height / working_height
+
+    @property
+    def working_rgb_array(self):
+        return self._cached('working_rgb_array', lambda: np.asarray(self.working))
+
+    @property
+    def working_bgr_array(self):
+        return self._cached('working_bgr_array', lambda: np.ascontiguousarray(self.working_rgb_array[:, :, ::-1]))
+
+    @property
+    def working_gray(self):
+        return self._cached('working_gray', lambda: np.asarray(self.working.convert('L')))
+
+    def model_inputs(self, image_processor):
+        """Preprocessed pixel_values tensor (1 x C x H x W) for the image model"""
+        return self._cached('model_inputs', lambda: image_processor(images=self.thumbnail(MODEL_INPUT_SIDE), return_tensors="pt")['pixel_values'])
+
+
+def as_decoded_image(image, max_working_side=None):
+    """Accept either a file path or an existing DecodedImage"""
+    if isinstance(image, DecodedImage):
+        return image
+    return DecodedImage.from_path(image, max_working_side=max_working_side)
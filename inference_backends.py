@@ -0,0 +1,157 @@
+"""
+CPU inference backends for the image quality model
+
+- torch:     the PyTorch eager model as loaded (fp32)
+- quantized: PyTorch dynamic int8 quantization of the Linear layers
+- onnx:      the model exported to ONNX and run with ONNX Runtime
+"""
+
+import os
+import time
+
+import numpy as np
+
+import lazy_modules
+
+BACKEND_TORCH = 'torch'
+BACKEND_QUANTIZED = 'quantized'
+BACKEND_ONNX = 'onnx'
+BACKENDS = (BACKEND_TORCH, BACKEND_QUANTIZED, BACKEND_ONNX)
+
+
+def softmax_max(logits):
+    """Top softmax probability per row of a logits array"""
+    logits = logits - logits.max(axis=1, keepdims=True)
+    probabilities = np.exp(logits)
+    probabilities /= probabilities.sum(axis=1, keepdims=True)
+    return probabilities.max(axis=1)
+
+
+class TorchBackend:
+    """PyTorch eager inference"""
+
+    name = BACKEND_TORCH
+
+    def __init__(self, model):
+        self.model = model
+
+    def logits(self, pixel_values):
+        with lazy_modules.torch().no_grad():
+            return self.model(pixel_values=pixel_values).logits.numpy()
+
+    def predict_confidences(self, pixel_values):
+        """Top softmax confidence for each image in an N x C x H x W batch"""
+        return softmax_max(self.logits(pixel_values)).tolist()
+
+
+class QuantizedTorchBackend(TorchBackend):
+    """Dynamic int8 quantization: weights stored as int8, activations quantized on the fly"""
+
+    name = BACKEND_QUANTIZED
+
+    def __init__(self, model):
+        torch = lazy_modules.torch()
+        super().__init__(torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8))
+
+
+class OnnxBackend:
+    """ONNX Runtime CPU session over an exported copy of the model"""
+
+    name = BACKEND_ONNX
+
+    def __init__(self, model, onnx_path, threads=0):
+        if not os.path.exists(onnx_path):
+            export_onnx(model, onnx_path)
+        self.onnx_path = onnx_path
+        self.threads = threads
+        self.reopen()
+
+    def reopen(self):
+        """Create the session; also used to replace one inherited across fork()"""
+        onnxruntime = lazy_modules.onnxruntime()
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.threads:
+            options.intra_op_num_threads = self.threads
+        self.session = onnxruntime.InferenceSession(self.onnx_path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def logits(self, pixel_values):
+        if not isinstance(pixel_values, np.ndarray):
+            pixel_values = pixel_values.numpy()
+        return self.session.run(None, {self.input_name: pixel_values.astype(np.float32, copy=False)})[0]
+
+    def predict_confidences(self, pixel_values):
+        return softmax_max(self.logits(pixel_values)).tolist()
+
+
+def torch_version(torch):
+    """(major, minor) of the installed torch, e.g. (2, 5) for '2.5.1+cpu'"""
+    parts = []
+    for part in torch.__version__.split('+')[0].split('.')[:2]:
+        digits = ''.join(char for char in part if char.isdigit())
+        parts.append(int(digits or 0))
+    return tuple(parts)
+
+
+def export_onnx(model, onnx_path, image_size=224):
+    """Export the model with a dynamic batch dimension"""
+    torch = lazy_modules.torch()
+    os.makedirs(os.path.dirname(os.path.abspath(onnx_path)), exist_ok=True)
+    dummy = torch.zeros(1, 3, image_size, image_size)
+    tmp_path = f'{onnx_path}.partial'
+    options = {}
+    if torch_version(torch) >= (2, 5):
+        # The dynamo exporter became the default later; older releases don't take the argument
+        options['dynamo'] = False
+    with torch.no_grad():
+        torch.onnx.export(model, (dummy,), tmp_path,
+                          input_names=['pixel_values'],
+                          output_names=['logits'],
+                          dynamic_axes={'pixel_values': {0: 'batch'}, 'logits': {0: 'batch'}},
+                          opset_version=17,
+                          **options)
+    os.replace(tmp_path, onnx_path)
+
+
+def create_backend(name, model, onnx_path=None):
+    """Build the named backend around a loaded PyTorch model"""
+    if name == BACKEND_TORCH:
+        return TorchBackend(model)
+    if name == BACKEND_QUANTIZED:
+        return QuantizedTorchBackend(model)
+    if name == BACKEND_ONNX:
+        return OnnxBackend(model, onnx_path or os.path.join('model_cache', 'model.onnx'))
+    raise ValueError(f'Unknown inference backend {name!r}; expected one of {", ".join(BACKENDS)}')
+
+
+def parity_check(reference, candidate, pixel_values, tolerance=0.02):
+    """
+    Compare a candidate backend's confidences with the reference backend on
+    the same inputs. Passes when every confidence is within tolerance and the
+    predicted class agrees for every image.
+    """
+    reference_logits = reference.logits(pixel_values)
+    candidate_logits = candidate.logits(pixel_values)
+    differences = np.abs(softmax_max(reference_logits) - softmax_max(candidate_logits))
+    agreement = float(np.mean(reference_logits.argmax(axis=1) == candidate_logits.argmax(axis=1)))
+    return {
+        'backend': candidate.name,
+        'images': int(differences.shape[0]),
+        'max_abs_diff': float(differences.max()),
+        'mean_abs_diff': float(differences.mean()),
+        'top1_agreement': agreement,
+        'passed': bool(differences.max() <= tolerance and agreement == 1.0)
+    }
+
+
+def time_backend(backend, pixel_values, iterations=20, warmup=3):
+    """Latency samples in milliseconds for one batch"""
+    for _ in range(warmup):
+        backend.predict_confidences(pixel_values)
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        backend.predict_confidences(pixel_values)
+        samples.append((time.perf_counter() - started) * 1000.0)
+    return samples
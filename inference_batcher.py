@@ -0,0 +1,127 @@
+"""
+Request-coalescing scheduler for the AI image quality model
+"""
+
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import lazy_modules
+
+
+class InferenceBatcher:
+    """
+    Collect images submitted from concurrent requests and run them through the
+    model as a single batch. A batch is dispatched once it reaches max_batch_size
+    or when the oldest pending image has waited max_wait_ms.
+    """
+
+    def __init__(self, get_models, max_batch_size=8, max_wait_ms=10, timeout=30.0, sample_size=1000):
+        self.get_models = get_models
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = {}
+        self._queue_waits = deque(maxlen=sample_size)
+        self._batches = 0
+        self._items = 0
+        self._errors = 0
+
+    def _ensure_worker(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._worker, name='inference-batcher', daemon=True)
+                self._thread.start()
+
+    def submit(self, pixel_values):
+        """Queue a preprocessed 1 x C x H x W tensor and block until its confidence is available"""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((pixel_values, future, time.perf_counter()))
+        return future.result(timeout=self.timeout)
+
+    def _collect_batch(self):
+        """Wait for the first item, then keep collecting until the batch is full or the window closes"""
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                # Still drain whatever is already waiting without blocking
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except queue.Empty:
+                    break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _worker(self):
+        while True:
+            batch = self._collect_batch()
+            started = time.perf_counter()
+            with self._stats_lock:
+                for _, _, queued_at in batch:
+                    self._queue_waits.append(started - queued_at)
+
+            try:
+                models = self.get_models()
+                if not models:
+                    raise RuntimeError('AI models are not available')
+                _, backend = models
+                confidences = backend.predict_confidences(lazy_modules.torch().cat([item[0] for item in batch]))
+            except Exception as e:
+                with self._stats_lock:
+                    self._errors += 1
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future, _), confidence in zip(batch, confidences):
+                future.set_result(confidence)
+
+            with self._stats_lock:
+                self._batches += 1
+                self._items += len(batch)
+                self._batch_sizes[len(batch)] = self._batch_sizes.get(len(batch), 0) + 1
+
+    def stats(self):
+        """Batch size distribution and queue wait percentiles (milliseconds)"""
+        with self._stats_lock:
+            waits = sorted(self._queue_waits)
+            batch_sizes = dict(sorted(self._batch_sizes.items()))
+            batches, items, errors = self._batches, self._items, self._errors
+
+        def percentile(p):
+            if not waits:
+                return None
+            index = min(len(waits) - 1, int(round(p / 100.0 * (len(waits) - 1))))
+            return round(waits[index] * 1000.0, 3)
+
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000.0,
+            'pending': self._queue.qsize(),
+            'batches': batches,
+            'images': items,
+            'errors': errors,
+            'mean_batch_size': round(items / batches, 3) if batches else None,
+            'batch_size_distribution': batch_sizes,
+            'queue_wait_ms': {
+                'p50': percentile(50),
+                'p95': percentile(95),
+                'p99': percentile(99),
+                'max': round(waits[-1] * 1000.0, 3) if waits else None
+            }
+        }
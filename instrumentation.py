@@ -0,0 +1,187 @@
+"""
+Lightweight request/stage instrumentation with a Prometheus text endpoint
+"""
+
+import bisect
+import threading
+import time
+from contextlib import nullcontext
+
+from flask import g, has_request_context, request
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Shared no-op returned when instrumentation is disabled
+_NULL_TIMER = nullcontext()
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+class _Histogram:
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self, buckets):
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+
+class _StageTimer:
+    """Times a block into the stage histogram and the current request's Server-Timing"""
+
+    __slots__ = ('metrics', 'stage', 'started')
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.started
+        self.metrics.observe('audit_stage_seconds', elapsed, (('stage', self.stage),))
+        if exc_type is not None:
+            self.metrics.inc('audit_errors_total', (('stage', self.stage),))
+        if has_request_context():
+            timings = g.setdefault('server_timings', [])
+            timings.append((self.stage, elapsed))
+        return False
+
+
+class Metrics:
+    """Counters, gauges and histograms kept in process memory"""
+
+    HELP = {
+        'audit_stage_seconds': 'Time spent in each audit stage',
+        'audit_request_seconds': 'HTTP request latency by endpoint',
+        'audit_errors_total': 'Errors by stage',
+        'audit_requests_in_flight': 'Requests currently being handled',
+        'audit_detection_seconds': 'Product detector latency per image by backend',
+    }
+
+    def __init__(self, enabled=True, buckets=DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._collectors = []
+
+    def stage(self, name):
+        """Context manager timing one stage; a shared no-op when disabled"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _StageTimer(self, name)
+
+    def inc(self, name, labels=(), value=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            key = (name, labels)
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def gauge_add(self, name, value, labels=()):
+        if not self.enabled:
+            return
+        with self._lock:
+            key = (name, labels)
+            self._gauges[key] = self._gauges.get(key, 0) + value
+
+    def observe(self, name, value, labels=()):
+        if not self.enabled:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            key = (name, labels)
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(self.buckets)
+            histogram.counts[index] += 1
+            histogram.total += value
+            histogram.count += 1
+
+    def register_collector(self, collector):
+        """
+        collector() returns [(name, type, help, [(labels, value), ...]), ...] and is
+        only called on scrape, so values already tracked elsewhere cost nothing per request
+        """
+        self._collectors.append(collector)
+
+    def render(self):
+        """Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            histograms = {key: (list(h.counts), h.total, h.count) for key, h in self._histograms.items()}
+
+        def header(name, metric_type, help_text=None):
+            lines.append(f'# HELP {name} {help_text or self.HELP.get(name, name)}')
+            lines.append(f'# TYPE {name} {metric_type}')
+
+        for metric_type, values in (('counter', counters), ('gauge', gauges)):
+            for name in sorted({key[0] for key in values}):
+                header(name, metric_type)
+                for (metric, labels), value in sorted(values.items()):
+                    if metric == name:
+                        lines.append(f'{name}{_format_labels(labels)} {value}')
+
+        for name in sorted({key[0] for key in histograms}):
+            header(name, 'histogram')
+            for (metric, labels), (counts, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += bucket_count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{name}_bucket{_format_labels(labels + (("le", le),))} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {total}')
+                lines.append(f'{name}_count{_format_labels(labels)} {count}')
+
+        for collector in self._collectors:
+            try:
+                for name, metric_type, help_text, samples in collector():
+                    header(name, metric_type, help_text)
+                    for labels, value in samples:
+                        lines.append(f'{name}{_format_labels(labels)} {value}')
+            except Exception as e:
+                print(f"Metrics collector error: {str(e)}")
+
+        return '\n'.join(lines) + '\n'
+
+
+def init_app(app, metrics):
+    """Track request latency, in-flight requests and the Server-Timing header for a Flask app"""
+    if not metrics.enabled:
+        return
+
+    @app.before_request
+    def _start_request():
+        g.request_started = time.perf_counter()
+        metrics.gauge_add('audit_requests_in_flight', 1)
+
+    @app.after_request
+    def _finish_request(response):
+        started = g.pop('request_started', None)
+        if started is not None:
+            elapsed = time.perf_counter() - started
+            metrics.observe('audit_request_seconds', elapsed, (('endpoint', request.endpoint or 'unknown'),))
+            timings = g.get('server_timings', [])
+            entries = [f'{stage};dur={seconds * 1000.0:.1f}' for stage, seconds in timings]
+            entries.append(f'total;dur={elapsed * 1000.0:.1f}')
+            response.headers['Server-Timing'] = ', '.join(entries)
+        return response
+
+    @app.teardown_request
+    def _teardown_request(exc):
+        metrics.gauge_add('audit_requests_in_flight', -1)
+        if exc is not None:
+            metrics.inc('audit_errors_total', (('stage', 'request'),))
@@ -0,0 +1,296 @@
+"""
+Background job execution for long-running analyses
+
+Jobs run on this process's pool. With a JobStore every state change is also
+written to SQLite, so any server process can answer a status poll, and a job
+whose process exited before finishing (a recycled or crashed worker) is
+reported as failed instead of disappearing.
+"""
+
+import json
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from sqlite_db import SQLiteDatabase
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    pid INTEGER NOT NULL,
+    context TEXT NOT NULL,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished_at);
+"""
+
+
+class JobQueueFull(Exception):
+    """Raised when the pool already has as many jobs as it may hold"""
+
+
+class JobFailed(Exception):
+    """A job's error, with the time it started running (pickles across process pools)"""
+
+    def __init__(self, message, started_at):
+        super().__init__(message, started_at)
+        self.message = message
+        self.started_at = started_at
+
+    def __str__(self):
+        return self.message
+
+
+def _timed_call(fn, args, on_start=None):
+    """
+    Runs in the pool worker: record when execution begins, then call
+    fn(*args). Returns (started_at, result). Module-level so process pools
+    can pickle it; on_start is only passed for thread pools.
+    """
+    started_at = time.time()
+    if on_start is not None:
+        on_start(started_at)
+    try:
+        return started_at, fn(*args)
+    except Exception as e:
+        raise JobFailed(str(e), started_at) from e
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Exists, but belongs to someone else
+        return True
+    return True
+
+
+class JobStore(SQLiteDatabase):
+    """Job records shared by every process using the same database file"""
+
+    def __init__(self, path):
+        super().__init__(path, SCHEMA)
+
+    def save(self, job):
+        """Insert or update a job record"""
+        connection = self._connection()
+        with self._write_lock, connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO jobs (id, status, created_at, started_at, finished_at, pid, context, result, error) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (job['id'], job['status'], job['created_at'], job['started_at'], job['finished_at'], job['pid'],
+                 json.dumps(job['context']), json.dumps(job['result']) if job['result'] is not None else None, job['error']))
+
+    def get(self, job_id):
+        """The job as saved, or None"""
+        row = self._connection().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['context'] = json.loads(job['context'])
+        job['result'] = json.loads(job['result']) if job['result'] is not None else None
+        return job
+
+    def purge(self, finished_before):
+        connection = self._connection()
+        with self._write_lock, connection:
+            connection.execute('DELETE FROM jobs WHERE finished_at < ?', (finished_before,))
+
+
+class JobManager:
+    """
+    Run jobs on a pool of worker threads or processes. At most
+    workers + max_queue jobs may be pending or running at once; further
+    submissions are rejected so callers can apply backpressure. Jobs are
+    also recorded in store (a JobStore), when given.
+    """
+
+    def __init__(self, workers=2, max_queue=32, executor='thread', result_ttl=3600, store=None):
+        self.workers = max(1, int(workers))
+        self.max_queue = max(0, int(max_queue))
+        self.executor_kind = executor
+        self.result_ttl = result_ttl
+        self.store = store
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(self.workers + self.max_queue)
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Created on first use so importing the app (e.g. in a pool child) doesn't start a pool
+        with self._lock:
+            if self._executor is None:
+                if self.executor_kind == 'process':
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                         mp_context=multiprocessing.get_context('spawn'))
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='job-worker')
+            return self._executor
+
+    def _new_job(self, context):
+        job = {
+            'id': uuid.uuid4().hex,
+            'status': STATUS_QUEUED,
+            'created_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+            'result': None,
+            'error': None,
+            'context': context or {},
+            'pid': os.getpid()
+        }
+        with self._lock:
+            self._purge_expired()
+            self._jobs[job['id']] = job
+        if self.store is not None:
+            # Also drops expired jobs of other processes, including ones that have exited
+            try:
+                self.store.purge(job['created_at'] - self.result_ttl)
+            except Exception as e:
+                print(f"Error purging jobs: {str(e)}")
+        return job
+
+    def _save(self, job):
+        if self.store is None:
+            return
+        try:
+            self.store.save(job)
+        except Exception as e:
+            print(f"Error saving job {job['id']}: {str(e)}")
+
+    def submit(self, fn, *args, context=None, on_success=None):
+        """
+        Queue fn(*args) and return the job id. on_success(result) runs in this
+        process once the job finishes, which also works for process pools.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise JobQueueFull(f'{self.workers + self.max_queue} jobs already queued or running')
+
+        job = self._new_job(context)
+        try:
+            if self.executor_kind == 'process':
+                # The child can't reach the job; it reports its start time with the result
+                future = self._get_executor().submit(_timed_call, fn, args)
+            else:
+                future = self._get_executor().submit(_timed_call, fn, args, lambda started_at: self._mark_started(job, started_at))
+        except Exception:
+            self._slots.release()
+            with self._lock:
+                self._jobs.pop(job['id'], None)
+            raise
+        job['future'] = future
+        self._save(job)
+
+        def _done(finished):
+            self._slots.release()
+            job['finished_at'] = time.time()
+            error = finished.exception()
+            if error is not None:
+                if isinstance(error, JobFailed):
+                    job['started_at'] = error.started_at
+                print(f"Job {job['id']} failed: {str(error)}")
+                job['error'] = str(error)
+                job['status'] = STATUS_FAILED
+                self._save(job)
+                return
+            job['started_at'], job['result'] = finished.result()
+            if on_success is not None:
+                try:
+                    on_success(job['result'])
+                except Exception as e:
+                    print(f"Job {job['id']} callback error: {str(e)}")
+            job['status'] = STATUS_DONE
+            self._save(job)
+
+        future.add_done_callback(_done)
+        return job['id']
+
+    def _mark_started(self, job, started_at):
+        job['started_at'] = started_at
+        job['status'] = STATUS_RUNNING
+        self._save(job)
+
+    def add_result(self, result, context=None):
+        """Record a job that is already complete, e.g. served from a cache"""
+        job = self._new_job(context)
+        job['started_at'] = job['finished_at'] = job['created_at']
+        job['result'] = result
+        job['status'] = STATUS_DONE
+        self._save(job)
+        return job['id']
+
+    def get(self, job_id):
+        """Return a snapshot of the job or None if it is unknown or expired"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return self._get_stored(job_id)
+
+        # Process pools only report the start time when the job finishes
+        status = job['status']
+        future = job.get('future')
+        if status == STATUS_QUEUED and future is not None and future.running():
+            status = STATUS_RUNNING
+
+        return {
+            'id': job['id'],
+            'status': status,
+            'created_at': job['created_at'],
+            'started_at': job['started_at'],
+            'finished_at': job['finished_at'],
+            'result': job['result'],
+            'error': job['error'],
+            'context': job['context']
+        }
+
+    def _get_stored(self, job_id):
+        """A job submitted to another process, from the store"""
+        if self.store is None:
+            return None
+        try:
+            job = self.store.get(job_id)
+        except Exception as e:
+            print(f"Error reading job {job_id}: {str(e)}")
+            return None
+        if job is None or (job['finished_at'] is not None and time.time() - job['finished_at'] > self.result_ttl):
+            return None
+
+        if job['status'] in (STATUS_QUEUED, STATUS_RUNNING) and not _process_alive(job['pid']):
+            job['status'] = STATUS_FAILED
+            job['error'] = 'The server process running this job exited before it finished'
+        del job['pid']
+        return job
+
+    def _purge_expired(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job['finished_at'] is not None and now - job['finished_at'] > self.result_ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def stats(self):
+        with self._lock:
+            statuses = [job['status'] for job in self._jobs.values()]
+        return {
+            'workers': self.workers,
+            'executor': self.executor_kind,
+            'max_queue': self.max_queue,
+            'queued_or_running': statuses.count(STATUS_QUEUED) + statuses.count(STATUS_RUNNING),
+            'done': statuses.count(STATUS_DONE),
+            'failed': statuses.count(STATUS_FAILED)
+        }
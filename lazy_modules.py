@@ -0,0 +1,58 @@
+"""
+Heavy dependencies imported on first use
+
+Importing torch takes seconds and a few hundred MB, transformers adds more
+on top, and cv2 is not free either. The health checks, the index page and
+metadata validation need none of them, so modules ask for them here where
+they are used instead of importing them at the top:
+
+    torch = lazy_modules.torch()
+
+Python's own module cache makes every call after the first a dictionary
+lookup. import_report() shows which were loaded and what the first import
+cost.
+"""
+
+import importlib
+import sys
+import time
+
+HEAVY_MODULES = ('torch', 'transformers', 'cv2', 'onnxruntime')
+
+_import_seconds = {}
+
+
+def load(name):
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    started = time.perf_counter()
+    module = importlib.import_module(name)
+    _import_seconds.setdefault(name, round(time.perf_counter() - started, 3))
+    return module
+
+
+def torch():
+    return load('torch')
+
+
+def transformers():
+    return load('transformers')
+
+
+def cv2():
+    return load('cv2')
+
+
+def onnxruntime():
+    return load('onnxruntime')
+
+
+def loaded_heavy_modules():
+    return [name for name in HEAVY_MODULES if name in sys.modules]
+
+
+def import_report():
+    """Which heavy modules are loaded, and the seconds their first import through this module took"""
+    return {name: {'loaded': name in sys.modules, 'import_seconds': _import_seconds.get(name)}
+            for name in HEAVY_MODULES}
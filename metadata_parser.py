@@ -0,0 +1,179 @@
+"""
+Streaming metadata (planogram) parser
+
+Rows are read one line at a time and yielded as they are parsed, so a
+multi-MB planogram never has to be held in memory as text. Three layouts
+are accepted and detected from the first data line:
+
+- tsv:        SKU<TAB>price<TAB>section[<TAB>extra...]
+- csv:        SKU,price,section[,extra...] (quoted fields allowed)
+- whitespace: SKU price section [extra...] (the original format)
+
+Prices become integer cents here, once, so later stages never parse price
+strings again; the price as written (with its currency) is kept for display.
+
+Files are decoded as UTF-8, with or without the byte order mark Excel
+writes. Rows that cannot be used are not dropped silently. Each one is
+recorded with its line number and the reason.
+"""
+
+import csv
+import io
+import re
+
+from shelf_layout import parse_section
+
+FORMAT_TSV = 'tsv'
+FORMAT_CSV = 'csv'
+FORMAT_WHITESPACE = 'whitespace'
+
+# Optional currency prefix/suffix, whole units (optionally with , thousands separators) and
+# optional 1-2 decimals: $19.99, 19,99 EUR, $1,299.99, 7
+PRICE_PATTERN = re.compile(r'^([^\d\s.,\-]{0,3}\s*)(\d{1,3}(?:,\d{3})+|\d+)(?:([.,])(\d{1,2}))?(\s*[^\d\s.,\-]{0,3})$')
+
+# Distinct sections remembered while parsing one file; a planogram has far fewer slots than this
+SECTION_MEMO_SIZE = 65536
+
+HEADER_FIRST_FIELDS = {'sku', 'item', 'product', 'product_id'}
+
+# Bad rows kept with their text; further ones are only counted
+MAX_REPORTED_ERRORS = 100
+
+
+def parse_price_cents(text):
+    """'$19.99' -> 1999, '7' -> 700; None when the text is not a price"""
+    match = PRICE_PATTERN.match(text.strip())
+    if not match:
+        return None
+    whole, fraction = match.group(2), match.group(4)
+    return int(whole.replace(',', '')) * 100 + int((fraction or '').ljust(2, '0'))
+
+
+def format_price(cents, like=None):
+    """
+    1999 -> '19.99'. With like, a price as written in the metadata, the
+    result uses its currency and decimal separator: (1999, '5,00 EUR') -> '19,99 EUR'
+    """
+    match = PRICE_PATTERN.match(like.strip()) if like else None
+    if match is None:
+        return f'{cents // 100}.{cents % 100:02d}'
+    prefix, _, separator, _, suffix = match.groups()
+    return f'{prefix}{cents // 100}{separator or "."}{cents % 100:02d}{suffix}'
+
+
+class MetadataErrors:
+    """Rows that could not be parsed, by line number"""
+
+    def __init__(self, limit=MAX_REPORTED_ERRORS):
+        self.limit = limit
+        self.rows = []
+        self.count = 0
+
+    def add(self, line, message, text):
+        self.count += 1
+        if len(self.rows) < self.limit:
+            self.rows.append({'line': line, 'error': message, 'text': text[:200]})
+
+    def __len__(self):
+        return self.count
+
+    def summary(self):
+        return {'count': self.count, 'rows': self.rows, 'truncated': self.count > len(self.rows)}
+
+
+def detect_format(line):
+    if '\t' in line:
+        return FORMAT_TSV
+    if ',' in line and len(next(csv.reader([line]))) >= 3:
+        return FORMAT_CSV
+    return FORMAT_WHITESPACE
+
+
+def _split_rows(lines, layout):
+    """(line number, fields, text) for each line of the given layout"""
+    if layout == FORMAT_CSV:
+        reader = csv.reader(lines)
+        for fields in reader:
+            yield reader.line_num, [field.strip() for field in fields], ','.join(fields)
+        return
+    for number, line in enumerate(lines, start=1):
+        line = line.rstrip('\r\n')
+        if layout == FORMAT_TSV:
+            yield number, [field.strip() for field in line.split('\t')], line
+        else:
+            yield number, line.split(), line
+
+
+def _data_lines(lines):
+    """The lines with the format detected from the first non-blank, non-comment one"""
+    lines = iter(lines)
+    buffered = []
+    for line in lines:
+        buffered.append(line)
+        if line.strip() and not line.lstrip().startswith('#'):
+            return detect_format(line), _chain(buffered, lines)
+    return FORMAT_WHITESPACE, iter(buffered)
+
+
+def _chain(first, rest):
+    yield from first
+    yield from rest
+
+
+def iter_metadata(lines, errors=None, layout=None):
+    """
+    Yield metadata dicts (sku, price as written, price_cents, section,
+    additional_info) from an iterable of text lines. Blank lines and lines starting with '#'
+    are skipped, as is a header row; rows with too few fields, a price that
+    is not a number or an unknown section go to errors (a MetadataErrors).
+    """
+    if layout is None:
+        layout, lines = _data_lines(lines)
+    first = True
+    sections = {}  # section text -> normalized section, or None when invalid
+    for number, fields, text in _split_rows(lines, layout):
+        if not any(fields) or fields[0].startswith('#'):
+            continue
+        if first:
+            first = False
+            if fields[0].lower() in HEADER_FIRST_FIELDS:
+                continue
+
+        if len(fields) < 3 or not all(fields[:3]):
+            if errors is not None:
+                errors.add(number, f'Expected SKU, price and section, found {len([f for f in fields if f])} field(s)', text)
+            continue
+        cents = parse_price_cents(fields[1])
+        if cents is None:
+            if errors is not None:
+                errors.add(number, f'Invalid price {fields[1]!r}', text)
+            continue
+        section = sections.get(fields[2], False)
+        if section is False:
+            section = fields[2].upper() if parse_section(fields[2]) is not None else None
+            if len(sections) < SECTION_MEMO_SIZE:
+                sections[fields[2]] = section
+        if section is None:
+            if errors is not None:
+                errors.add(number, f'Invalid section {fields[2]!r}, expected a row letter and column number like A1', text)
+            continue
+
+        yield {
+            'sku': fields[0],
+            'price': fields[1],
+            'price_cents': cents,
+            'section': section,
+            'additional_info': [field for field in fields[3:] if field]
+        }
+
+
+def iter_metadata_file(path, errors=None):
+    """Stream a metadata file from disk"""
+    with open(path, 'r', encoding='utf-8-sig', errors='replace', newline='') as f:
+        yield from iter_metadata(f, errors)
+
+
+def iter_metadata_bytes(data, errors=None):
+    """Stream metadata held in memory without building a decoded copy of the whole text"""
+    with io.TextIOWrapper(io.BytesIO(data), encoding='utf-8-sig', errors='replace', newline='') as f:
+        yield from iter_metadata(f, errors)
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+"""
+Shelf Vision Audit Tool - Offline Model Cache
+
+Models are downloaded once into a local directory (model_cache/<org>--<name>)
+as safetensors plus a manifest of file sizes and SHA-256 hashes. Loading
+from the cache never touches the network: the weights file is memory-mapped
+and the model's parameters point straight into the mapping, so a restart
+costs a page-cache read instead of a download and a full copy, and processes
+on the same node share the same physical pages.
+
+    python model_cache.py download google/vit-base-patch16-224
+    python model_cache.py verify google/vit-base-patch16-224 --full
+    python model_cache.py load google/vit-base-patch16-224
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import lazy_modules
+
+DEFAULT_CACHE_DIR = 'model_cache'
+MANIFEST_NAME = 'manifest.json'
+
+VERIFY_OFF = 'off'
+VERIFY_QUICK = 'quick'  # Files present with the recorded sizes and readable safetensors headers
+VERIFY_FULL = 'full'    # Also compare SHA-256 hashes
+VERIFY_MODES = (VERIFY_OFF, VERIFY_QUICK, VERIFY_FULL)
+
+
+class ModelCacheError(Exception):
+    """Raised when a cached model is missing, incomplete or fails verification"""
+
+
+def cache_path(cache_dir, model_name):
+    """Cache directory for a hub model id (or a local model directory being cached)"""
+    return os.path.join(cache_dir, model_name.strip('/').replace('/', '--'))
+
+
+def resolve(cache_dir, model_name):
+    """Directory to load model_name from: its cache entry, else model_name itself when that is a local model directory"""
+    directory = cache_path(cache_dir, model_name)
+    if not is_cached(directory) and os.path.isdir(model_name) and is_cached(model_name):
+        return model_name
+    return directory
+
+
+def weight_files(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith('.safetensors'))
+
+
+def is_cached(directory):
+    return os.path.isdir(directory) and os.path.isfile(os.path.join(directory, 'config.json')) and bool(weight_files(directory))
+
+
+def _sha256(path, chunk_size=4 * 1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_manifest(directory, model_name):
+    import transformers
+
+    files = {}
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if name != MANIFEST_NAME and os.path.isfile(path):
+            files[name] = {'bytes': os.path.getsize(path), 'sha256': _sha256(path)}
+    manifest = {'model_name': model_name, 'transformers_version': transformers.__version__,
+                'created_at': time.time(), 'files': files}
+    with open(os.path.join(directory, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def download(model_name, cache_dir=DEFAULT_CACHE_DIR, model_class=None, processor_class=None):
+    """
+    Fetch a model from the Hugging Face Hub (or copy a local model directory)
+    into the cache; needs network access for hub models. The weights are
+    written in the layout of the loaded module, so they can be mapped into it
+    without renaming keys.
+    """
+    from transformers import AutoImageProcessor, AutoModelForImageClassification
+
+    model_class = model_class or AutoModelForImageClassification
+    processor_class = processor_class or AutoImageProcessor
+    directory = cache_path(cache_dir, model_name)
+    tmp_dir = f'{directory}.partial'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    processor_class.from_pretrained(model_name).save_pretrained(tmp_dir)
+    model = model_class.from_pretrained(model_name)
+    model.config.save_pretrained(tmp_dir)
+    save_state_dict(model.state_dict(), os.path.join(tmp_dir, 'model.safetensors'))
+    write_manifest(tmp_dir, model_name)
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_dir, directory)
+    return directory
+
+
+def save_state_dict(state_dict, path):
+    """Write tensors as a safetensors file"""
+    from safetensors.torch import save_file
+
+    save_file({key: tensor.detach().cpu().contiguous() for key, tensor in state_dict.items()}, path,
+              metadata={'format': 'pt'})
+
+
+def check_safetensors(path):
+    """Raise ModelCacheError unless the file's header is readable and every tensor lies within the file"""
+    from safetensors import SafetensorError, safe_open
+
+    try:
+        # Opening validates the header and the tensor offsets against the file size
+        with safe_open(path, framework='pt') as f:
+            f.keys()
+    except (SafetensorError, OSError) as e:
+        raise ModelCacheError(f'{os.path.basename(path)} is truncated or corrupt: {str(e)}')
+
+
+def verify(directory, mode=VERIFY_QUICK):
+    """Check the cached files against the manifest; raises ModelCacheError, returns what was checked"""
+    started = time.perf_counter()
+    if mode == VERIFY_OFF:
+        return {'mode': mode, 'files': 0, 'seconds': 0.0}
+    if not is_cached(directory):
+        raise ModelCacheError(f'No cached model (config.json and *.safetensors) in {directory}')
+
+    manifest_path = os.path.join(directory, MANIFEST_NAME)
+    expected = {}
+    if os.path.isfile(manifest_path):
+        with open(manifest_path) as f:
+            expected = json.load(f)['files']
+    for name, entry in expected.items():
+        path = os.path.join(directory, name)
+        if not os.path.isfile(path):
+            raise ModelCacheError(f'{name} is missing from {directory}')
+        if os.path.getsize(path) != entry['bytes']:
+            raise ModelCacheError(f'{name} is {os.path.getsize(path)} bytes, expected {entry["bytes"]}')
+        if mode == VERIFY_FULL and _sha256(path) != entry['sha256']:
+            raise ModelCacheError(f'{name} does not match its recorded SHA-256')
+
+    for name in weight_files(directory):
+        check_safetensors(os.path.join(directory, name))
+
+    return {'mode': mode, 'files': len(expected) or len(weight_files(directory)),
+            'manifest': bool(expected), 'seconds': round(time.perf_counter() - started, 3)}
+
+
+def mmap_state_dict(path):
+    """
+    Tensors of a safetensors file, backed by a private (copy-on-write)
+    memory map of it that stays open for as long as the tensors are in use
+    """
+    from safetensors import safe_open
+
+    with safe_open(path, framework='pt') as f:
+        return {key: f.get_tensor(key) for key in f.keys()}
+
+
+def load_model(directory, model_class, processor_class, verify_mode=VERIFY_QUICK):
+    """
+    Load a cached model without network access. Returns
+    (processor, model, report) with a per-stage timing report.
+    """
+    started = time.perf_counter()
+    stages = {}
+
+    def mark(stage, since):
+        stages[stage] = round(time.perf_counter() - since, 3)
+        return time.perf_counter()
+
+    step = time.perf_counter()
+    verified = verify(directory, verify_mode)
+    step = mark('verify', step)
+
+    processor = processor_class.from_pretrained(directory, local_files_only=True)
+    step = mark('processor', step)
+
+    state_dict = {}
+    for name in weight_files(directory):
+        state_dict.update(mmap_state_dict(os.path.join(directory, name)))
+    step = mark('mmap_weights', step)
+
+    model = _build_from_state_dict(directory, model_class, state_dict)
+    mmapped = model is not None
+    if model is None:
+        # Checkpoint layout the direct path doesn't handle; still local-only
+        model = model_class.from_pretrained(directory, local_files_only=True)
+    model.eval()
+    mark('build_model', step)
+
+    report = {
+        'source': 'cache',
+        'path': directory,
+        'mmap': mmapped,
+        'weights_mb': round(sum(t.numel() * t.element_size() for t in state_dict.values()) / (1024 * 1024), 1),
+        'verify': verified,
+        'stages': stages,
+        'seconds': round(time.perf_counter() - started, 3)
+    }
+    return processor, model, report
+
+
+def _build_from_state_dict(directory, model_class, state_dict):
+    """Create the model on the meta device and adopt the mapped tensors as its parameters; None if they don't fit"""
+    torch = lazy_modules.torch()
+    from transformers import AutoConfig
+
+    config = AutoConfig.from_pretrained(directory, local_files_only=True)
+    try:
+        with torch.device('meta'):
+            model = model_class.from_config(config)
+        result = model.load_state_dict(state_dict, strict=False, assign=True)
+    except (TypeError, RuntimeError) as e:
+        # assign=True needs torch 2.1+
+        print(f"Error mapping cached weights, loading a copy instead: {str(e)}")
+        return None
+    if result.missing_keys or any(t.is_meta for t in model.state_dict().values()):
+        # e.g. a checkpoint saved in another layout than the module's; from_pretrained renames the keys
+        print(f"Cached weights don't match the model layout, loading a copy instead (missing {result.missing_keys[:3]})")
+        return None
+    for parameter in model.parameters():
+        parameter.requires_grad_(False)
+    return model
+
+
+def main():
+    from transformers import AutoImageProcessor, AutoModelForImageClassification
+    from model_registry import DEFAULT_MODEL_NAME
+
+    parser = argparse.ArgumentParser(description='Manage the offline model cache')
+    parser.add_argument('command', choices=['download', 'verify', 'load'])
+    parser.add_argument('model', nargs='?', default=os.environ.get('MODEL_NAME', DEFAULT_MODEL_NAME))
+    parser.add_argument('--cache-dir', default=os.environ.get('MODEL_CACHE_DIR', DEFAULT_CACHE_DIR))
+    parser.add_argument('--full', action='store_true', help='Verify SHA-256 hashes, not just sizes')
+    args = parser.parse_args()
+
+    directory = resolve(args.cache_dir, args.model)
+    if args.command == 'download':
+        print(f'Saved {args.model} to {download(args.model, args.cache_dir)}')
+        print(json.dumps(verify(directory, VERIFY_FULL)))
+    elif args.command == 'verify':
+        print(json.dumps(verify(directory, VERIFY_FULL if args.full else VERIFY_QUICK)))
+    else:
+        _, _, report = load_model(directory, AutoModelForImageClassification, AutoImageProcessor,
+                                     VERIFY_FULL if args.full else VERIFY_QUICK)
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+"""
+Thread-safe registry for the AI image model used by the audit tool
+"""
+
+import threading
+import time
+
+import lazy_modules
+import model_cache
+from inference_backends import BACKEND_TORCH, TorchBackend, create_backend, parity_check
+from synthetic_shelf import generate_shelf
+
+DEFAULT_MODEL_NAME = "google/vit-base-patch16-224"
+
+# Synthetic shelves the parity check runs on: (width, height, products per row, seed)
+PARITY_SHELVES = ((800, 600, 5, 0), (1024, 768, 8, 1), (640, 960, 3, 2), (1200, 400, 12, 3))
+
+STATE_NOT_LOADED = 'not_loaded'
+STATE_LOADING = 'loading'
+STATE_READY = 'ready'
+STATE_FAILED = 'failed'
+
+
+def parity_images(shelves=PARITY_SHELVES):
+    """
+    Deterministic shelf images for the backend parity check: each synthetic
+    shelf and its top-left quadrant, so products at two scales are compared
+    """
+    images = []
+    for width, height, products_per_row, seed in shelves:
+        img, _ = generate_shelf(width, height, products_per_row, seed)
+        images.append(img)
+        images.append(img.crop((0, 0, width // 2, height // 2)))
+    return images
+
+
+class ModelRegistry:
+    """Load the image processor and model once and share them across threads"""
+
+    def __init__(self, model_name=DEFAULT_MODEL_NAME, retry_interval=60.0,
+                 backend_name=BACKEND_TORCH, onnx_path=None, check_parity=True,
+                 cache_dir=None, offline=False, verify_mode=model_cache.VERIFY_QUICK):
+        self.model_name = model_name
+        self.cache_dir = cache_dir
+        self.offline = offline
+        self.verify_mode = verify_mode
+        self.retry_interval = retry_interval
+        self.backend_name = backend_name
+        self.onnx_path = onnx_path
+        self.check_parity = check_parity
+        self.processor = None
+        self.model = None
+        self.backend = None
+        self.parity = None
+        self.state = STATE_NOT_LOADED
+        self.error = None
+        self.load_seconds = None
+        self.load_count = 0
+        self.warmup_seconds = None
+        self.load_report = None
+        self._failed_at = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def is_ready(self):
+        return self.state == STATE_READY
+
+    def _load_model(self):
+        """
+        Create the processor and model; runs with the registry lock held. A
+        model in the local cache is memory-mapped from it; otherwise it comes
+        from the Hugging Face Hub, unless the registry is offline.
+        """
+        started = time.perf_counter()
+        transformers = lazy_modules.transformers()
+        import_seconds = round(time.perf_counter() - started, 3)
+
+        directory = model_cache.resolve(self.cache_dir or model_cache.DEFAULT_CACHE_DIR, self.model_name)
+        if model_cache.is_cached(directory):
+            try:
+                processor, model, self.load_report = model_cache.load_model(
+                    directory, transformers.AutoModelForImageClassification, transformers.AutoImageProcessor, self.verify_mode)
+                self.load_report['stages'] = {'import': import_seconds, **self.load_report['stages']}
+                if directory == self.model_name:
+                    self.load_report['source'] = 'local'
+                return processor, model
+            except model_cache.ModelCacheError as e:
+                if self.offline:
+                    raise
+                print(f"Error loading cached model, downloading instead: {str(e)}")
+        elif self.offline:
+            raise model_cache.ModelCacheError(
+                f'{self.model_name} is not in the model cache ({directory}); run '
+                f'"python model_cache.py download {self.model_name}" where the network is available')
+
+        step = time.perf_counter()
+        processor = transformers.AutoImageProcessor.from_pretrained(self.model_name)
+        model = transformers.AutoModelForImageClassification.from_pretrained(self.model_name)
+        model.eval()
+        self.load_report = {'source': 'hub', 'path': self.model_name, 'mmap': False,
+                            'stages': {'import': import_seconds, 'from_pretrained': round(time.perf_counter() - step, 3)},
+                            'seconds': round(time.perf_counter() - started, 3)}
+        return processor, model
+
+    def _create_backend(self, model):
+        """Build the configured backend, falling back to PyTorch eager if it fails or drifts"""
+        if self.backend_name == BACKEND_TORCH:
+            return TorchBackend(model)
+
+        try:
+            backend = create_backend(self.backend_name, model, onnx_path=self.onnx_path)
+            if self.check_parity:
+                images = parity_images()
+                if not images:
+                    # An unchecked backend is not served
+                    self.parity = {'backend': backend.name, 'images': 0, 'passed': False}
+                    raise RuntimeError('confidence parity check has no sample images')
+                sample = self.processor(images=images, return_tensors="pt")['pixel_values']
+                self.parity = parity_check(TorchBackend(model), backend, sample)
+                if not self.parity['passed']:
+                    raise RuntimeError(f"confidence parity check failed: {self.parity}")
+            return backend
+        except Exception as e:
+            print(f"Error creating {self.backend_name} inference backend, using PyTorch: {str(e)}")
+            return TorchBackend(model)
+
+    def load(self):
+        """Load the model if needed. Concurrent callers wait for a single load."""
+        if self.state == STATE_READY:
+            return True
+
+        with self._lock:
+            return self._load_locked()
+
+    def _load_locked(self):
+        if self.state == STATE_READY:
+            return True
+
+        # Don't hammer from_pretrained on every request after a failure
+        if self._failed_at is not None and time.monotonic() - self._failed_at < self.retry_interval:
+            self.state = STATE_FAILED
+            return False
+
+        self.state = STATE_LOADING
+        started = time.perf_counter()
+        try:
+            self.processor, model = self._load_model()
+            self.backend = self._create_backend(model)
+            # Keep only the weights the backend runs on (the fp32 copy is dropped for quantized/ONNX)
+            self.model = getattr(self.backend, 'model', None)
+        except Exception as e:
+            print(f"Error loading AI models: {str(e)}")
+            self.processor, self.model, self.backend = None, None, None
+            self.error = str(e)
+            self.state = STATE_FAILED
+            self._failed_at = time.monotonic()
+            return False
+
+        self.load_seconds = time.perf_counter() - started
+        self.load_count += 1
+        self.error = None
+        self._failed_at = None
+        self.state = STATE_READY
+        print(f"Loaded AI model {self.model_name} from {self.load_report['source']} in {self.load_seconds:.2f}s"
+              f"{' (memory-mapped)' if self.load_report['mmap'] else ''}: {self.load_report['stages']}")
+        return True
+
+    def start_background_load(self, blocking=True):
+        """
+        Load the model in a daemon thread so the server can start accepting
+        requests. With blocking=False nothing is started when another thread
+        holds the registry lock, i.e. a load is already under way.
+        """
+        if not self._lock.acquire(blocking=blocking):
+            return self._thread
+        try:
+            if self.state in (STATE_READY, STATE_LOADING):
+                return self._thread
+            # Mark as loading before the thread starts so readiness checks see it at once
+            self.state = STATE_LOADING
+        finally:
+            self._lock.release()
+
+        def _run():
+            with self._lock:
+                self._load_locked()
+
+        self._thread = threading.Thread(target=_run, name='model-loader', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def after_fork(self):
+        """
+        Reset per-process state in a forked worker. PyTorch weights stay
+        shared with the parent; backends holding native thread pools (ONNX
+        Runtime) open a fresh session, since those don't survive fork().
+        """
+        self._lock = threading.Lock()
+        self._thread = None
+        if self.backend is not None and hasattr(self.backend, 'reopen'):
+            try:
+                self.backend.reopen()
+            except Exception as e:
+                print(f"Error reopening {self.backend.name} inference backend: {str(e)}")
+                self.processor, self.model, self.backend = None, None, None
+                self.error = str(e)
+                self.state = STATE_FAILED
+                self._failed_at = time.monotonic()
+
+    def warmup(self, batch_sizes=(1,), image_size=224):
+        """Run a forward pass per batch size so the first requests don't pay for lazy initialization"""
+        if self.state != STATE_READY:
+            return None
+        torch = lazy_modules.torch()
+
+        started = time.perf_counter()
+        for batch_size in batch_sizes:
+            self.backend.predict_confidences(torch.zeros(batch_size, 3, image_size, image_size))
+        self.warmup_seconds = time.perf_counter() - started
+        return self.warmup_seconds
+
+    def _retry_due(self):
+        return self._failed_at is None or time.monotonic() - self._failed_at >= self.retry_interval
+
+    def get(self, block=True):
+        """
+        Return (processor, backend) or None when the model is unavailable.
+        With block=False, callers never wait for a load: one that is needed
+        (including the retry of a failed load) starts on the background loader.
+        """
+        if self.state != STATE_READY:
+            if not block:
+                if self.state != STATE_LOADING and self._retry_due():
+                    self.start_background_load(blocking=False)
+                return None
+            if not self.load():
+                return None
+        return self.processor, self.backend
+
+    def status(self):
+        """Describe the current load state without triggering a load"""
+        return {
+            'model_name': self.model_name,
+            'backend': self.backend.name if self.backend is not None else self.backend_name,
+            'parity': self.parity,
+            'state': self.state,
+            'ready': self.is_ready,
+            'load_seconds': round(self.load_seconds, 3) if self.load_seconds is not None else None,
+            'load_count': self.load_count,
+            'offline': self.offline,
+            'load_report': self.load_report,
+            'warmup_seconds': round(self.warmup_seconds, 3) if self.warmup_seconds is not None else None,
+            'error': self.error
+        }
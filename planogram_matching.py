@@ -0,0 +1,269 @@
+"""
+Optimal assignment of metadata entries to detected products
+
+Each metadata section (A1, B12, ...) gives an expected slot on the shelf.
+Slots and detected boxes are matched per shelf row with a linear sum
+assignment on the horizontal offset in slot widths, so a gap or an extra
+facing does not shift every product after it. What is left over becomes
+missing (metadata without a product) and extra (product without metadata)
+anomalies; matches that sit too far from their slot become misplaced ones.
+A matched product that carries a detected price (read from its price tag
+by OCR or returned by the detector) is checked against the metadata price.
+Anomalies are placed on the shelf with the layout's section and point
+lookups: a misplaced product also gets the box of its expected section, and
+a missing one the section of the product nearest to its empty slot.
+
+Rows are independent, so a planogram with thousands of SKUs is solved as
+one small problem per shelf rather than one big one.
+"""
+
+import numpy as np
+
+from metadata_parser import format_price
+from shelf_layout import parse_section
+
+try:
+    from scipy.optimize import linear_sum_assignment as _scipy_linear_sum_assignment
+except ImportError:
+    _scipy_linear_sum_assignment = None
+
+# Offsets in slot widths: a match must be closer than MAX_MATCH_OFFSET, and is misplaced beyond MISPLACED_OFFSET
+MAX_MATCH_OFFSET = 1.5
+MISPLACED_OFFSET = 0.5
+
+
+def _shortest_augmenting_path(cost):
+    """
+    Jonker-Volgenant style shortest augmenting path for a rows <= cols
+    matrix. One row is added per outer step; the Dijkstra search over
+    columns updates all reduced costs at once, so Python only loops over
+    the columns it actually scans.
+    """
+    n_rows, n_cols = cost.shape
+    u = np.zeros(n_rows)
+    v = np.zeros(n_cols)
+    col4row = np.full(n_rows, -1, dtype=np.int64)
+    row4col = np.full(n_cols, -1, dtype=np.int64)
+
+    for current in range(n_rows):
+        shortest = np.full(n_cols, np.inf)
+        path = np.full(n_cols, -1, dtype=np.int64)
+        remaining = np.ones(n_cols, dtype=bool)
+        scanned_rows = np.zeros(n_rows, dtype=bool)
+        min_value = 0.0
+        row = current
+        sink = -1
+
+        while sink == -1:
+            scanned_rows[row] = True
+            reduced = min_value + cost[row] - u[row] - v
+            better = remaining & (reduced < shortest)
+            path[better] = row
+            shortest[better] = reduced[better]
+
+            candidates = np.where(remaining, shortest, np.inf)
+            column = int(np.argmin(candidates))
+            min_value = candidates[column]
+            if not np.isfinite(min_value):
+                raise ValueError('cost matrix is infeasible')
+            # Among equally short columns, prefer a free one to end the search early
+            if row4col[column] != -1:
+                free = np.nonzero((candidates == min_value) & (row4col == -1))[0]
+                if free.size:
+                    column = int(free[0])
+
+            remaining[column] = False
+            if row4col[column] == -1:
+                sink = column
+            else:
+                row = row4col[column]
+
+        # Update the dual variables
+        u[current] += min_value
+        others = scanned_rows.copy()
+        others[current] = False
+        u[others] += min_value - shortest[col4row[others]]
+        scanned = ~remaining
+        v[scanned] -= min_value - shortest[scanned]
+
+        # Flip the assignments along the path
+        column = sink
+        while True:
+            row = path[column]
+            row4col[column] = row
+            col4row[row], column = column, col4row[row]
+            if row == current:
+                break
+
+    return col4row
+
+
+def linear_sum_assignment(cost):
+    """
+    Minimum cost assignment; returns (row indices, column indices) like
+    scipy.optimize.linear_sum_assignment, which is used when installed.
+    Entries may be np.inf for pairs that must not be matched.
+    """
+    cost = np.asarray(cost, dtype=np.float64)
+    if cost.size == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    if _scipy_linear_sum_assignment is not None:
+        return _scipy_linear_sum_assignment(cost)
+
+    if cost.shape[0] > cost.shape[1]:
+        col4row = _shortest_augmenting_path(cost.T)
+        order = np.argsort(col4row)
+        return col4row[order], order
+    return np.arange(cost.shape[0]), _shortest_augmenting_path(cost)
+
+
+def _row_geometry(layout, products, row):
+    """Left edge, slot pitch, x centres and top/bottom of a detected shelf row"""
+    members = layout.rows[row]
+    centers = np.asarray(layout.row_x_centers[row], dtype=np.float64)
+    widths = np.array([products[i]['width'] for i in members], dtype=np.float64)
+    left = float(min(products[i]['x'] for i in members))
+    if centers.size > 1:
+        pitch = float(np.median(np.diff(centers)))
+    else:
+        pitch = float(widths[0])
+    return left, max(pitch, 1.0), centers, layout.row_bounds[row]
+
+
+def match_metadata(metadata, products, layout, max_offset=MAX_MATCH_OFFSET):
+    """
+    Assign metadata entries to detected products.
+
+    Returns (matches, missing, extra): matches are (metadata index, product
+    index, offset in slot widths), missing are (metadata index, expected
+    slot box or None), extra are product indices. Metadata entries whose
+    section cannot be parsed are left out.
+    """
+    by_row = {}
+    for index, item in enumerate(metadata):
+        slot = parse_section(item['section'])
+        if slot is not None:
+            by_row.setdefault(slot[0], []).append((index, slot[1]))
+
+    matches, missing, extra = [], [], []
+    for row in range(len(layout)):
+        members = layout.rows[row]
+        entries = by_row.pop(row, [])
+        if not entries:
+            extra.extend(members)
+            continue
+
+        left, pitch, centers, (top, bottom) = _row_geometry(layout, products, row)
+        meta_indexes = np.array([index for index, _ in entries], dtype=np.int64)
+        columns = np.array([column for _, column in entries], dtype=np.float64)
+        expected = left + (columns + 0.5) * pitch
+
+        # Offsets of every slot/box pair, plus one "missing" column per entry costing max_offset
+        offsets = np.abs(expected[:, None] - centers[None, :]) / pitch
+        count = len(entries)
+        cost = np.full((count, len(members) + count), np.inf)
+        cost[:, :len(members)] = np.where(offsets < max_offset, offsets, np.inf)
+        cost[np.arange(count), len(members) + np.arange(count)] = max_offset
+
+        assigned = np.zeros(len(members), dtype=bool)
+        for entry, column in zip(*linear_sum_assignment(cost)):
+            if column < len(members):
+                assigned[column] = True
+                matches.append((int(meta_indexes[entry]), members[column], float(offsets[entry, column])))
+            else:
+                box = {'x': int(left + columns[entry] * pitch), 'y': int(top),
+                       'width': int(pitch), 'height': int(bottom - top)}
+                missing.append((int(meta_indexes[entry]), box))
+        extra.extend(member for member, used in zip(members, assigned) if not used)
+
+    # Rows in the metadata that have no shelf row in the photo
+    for entries in by_row.values():
+        missing.extend((index, None) for index, _ in entries)
+
+    missing.sort()
+    return matches, missing, extra
+
+
+def _box(product):
+    return {'x': product['x'], 'y': product['y'], 'width': product['width'], 'height': product['height']}
+
+
+def expected_region(layout, products, section):
+    """Box of the product detected in a section, else of its whole shelf row; None when the photo has no such row"""
+    index = layout.lookup(section)
+    if index is not None:
+        return _box(products[index])
+    slot = parse_section(section)
+    if slot is None or slot[0] >= len(layout):
+        return None
+    return layout.row_region(slot[0])
+
+
+def nearest_section(layout, products, box):
+    """Section of the detected product closest to the centre of a box"""
+    position = layout.locate(box['x'] + box['width'] / 2.0, box['y'] + box['height'] / 2.0)
+    if position is None:
+        return None
+    row, column = position
+    return products[layout.rows[row][column]]['section']
+
+
+def assignment_anomalies(metadata, products, layout, max_offset=MAX_MATCH_OFFSET,
+                         misplaced_offset=MISPLACED_OFFSET):
+    """missing_product, misplaced_product, price_mismatch and extra_product anomalies from the optimal assignment"""
+    matches, missing, extra = match_metadata(metadata, products, layout, max_offset)
+    anomalies = []
+
+    for index, box in missing:
+        item = metadata[index]
+        anomaly = {
+            'type': 'missing_product',
+            'severity': 'high',
+            'description': f'Product {item["sku"]} is expected in section {item["section"]}, but no product was detected there',
+            'metadata_item': item
+        }
+        if box is not None:
+            anomaly['coordinates'] = box
+            anomaly['nearest_section'] = nearest_section(layout, products, box)
+        anomalies.append(anomaly)
+
+    for index, product_index, offset in sorted(matches):
+        item = metadata[index]
+        product = products[product_index]
+
+        # Only products with a price actually read from the shelf are checked
+        detected_cents = product.get('price_cents')
+        if detected_cents is not None and detected_cents != item['price_cents']:
+            anomalies.append({
+                'type': 'price_mismatch',
+                'severity': 'high',
+                'description': f'Product {item["sku"]} price tag does not match metadata price {item["price"]}',
+                'coordinates': _box(product),
+                'metadata_item': item,
+                'detected_price': product.get('price') or format_price(detected_cents, like=item['price'])
+            })
+
+        if offset <= misplaced_offset:
+            continue
+        anomalies.append({
+            'type': 'misplaced_product',
+            'severity': 'medium',
+            'description': f'Product {item["sku"]} is expected in section {item["section"]}, but the closest product is in section {product["section"]} ({offset:.1f} slots away)',
+            'coordinates': _box(product),
+            'expected_coordinates': expected_region(layout, products, item['section']),
+            'metadata_item': item,
+            'detected_section': product['section'],
+            'offset_slots': round(offset, 2)
+        })
+
+    for product_index in extra:
+        product = products[product_index]
+        anomalies.append({
+            'type': 'extra_product',
+            'severity': 'low',
+            'description': f'Product detected in section {product["section"]} is not in the metadata',
+            'coordinates': _box(product),
+            'detected_section': product['section']
+        })
+
+    return anomalies
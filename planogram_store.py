@@ -0,0 +1,300 @@
+"""
+Compiled planograms, parsed once per distinct metadata file
+
+The same store planogram is sent with every photo of its shelf. Each
+distinct file (by SHA-256 of its bytes) is streamed through the parser once
+into columns - SKUs, prices in integer cents and as written, section row/column codes and
+extra fields - with a SKU index and a section index, and reused by every
+later audit. Planograms can also be uploaded under a name (a store or aisle
+id) and referred to by that name or their id instead of sending the file
+again. Uploaded planograms are also kept in SQLite (PlanogramDatabase), so a
+planogram uploaded to one server process can be used through any other; each
+process compiles its own copy on first use.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from metadata_parser import MetadataErrors
+from result_cache import hash_bytes
+from shelf_layout import parse_section
+from sqlite_db import SQLiteDatabase
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS planograms (
+    id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    summary TEXT NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS planogram_names (
+    name TEXT PRIMARY KEY,
+    planogram_id TEXT NOT NULL REFERENCES planograms (id)
+);
+CREATE INDEX IF NOT EXISTS planogram_names_id ON planogram_names (planogram_id);
+"""
+
+
+class Planogram:
+    """One parsed metadata file in columnar form"""
+
+    def __init__(self, planogram_id, items, name=None, errors=None):
+        """items may be any iterable of metadata dicts, e.g. the streaming parser"""
+        self.id = planogram_id
+        self.name = name
+        self.errors = errors if errors is not None else MetadataErrors()
+
+        # Hashed row by row, so the result cache key costs nothing per request
+        digest = hashlib.sha256()
+        self.skus = []
+        self.sections = []
+        self.extras = []
+        self.prices = []
+        price_cents = []
+        slot_rows = []
+        slot_columns = []
+        self.sku_index = {}
+        self.section_index = {}
+        for row, item in enumerate(items):
+            digest.update(json.dumps(item, sort_keys=True, separators=(',', ':')).encode('utf-8'))
+            digest.update(b'\n')
+            self.skus.append(item['sku'])
+            self.sections.append(item['section'])
+            self.extras.append(tuple(item['additional_info']))
+            self.prices.append(item['price'])
+            price_cents.append(item['price_cents'])
+            slot = parse_section(item['section'])
+            slot_rows.append(slot[0])
+            slot_columns.append(slot[1])
+            self.sku_index.setdefault(item['sku'], row)
+            self.section_index.setdefault(item['section'], []).append(row)
+        self.metadata_hash = digest.hexdigest()
+        self.price_cents = np.asarray(price_cents, dtype=np.int64)
+        self.slot_rows = np.asarray(slot_rows, dtype=np.int32)
+        self.slot_columns = np.asarray(slot_columns, dtype=np.int32)
+
+        self._items = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.skus)
+
+    def item(self, row):
+        """Metadata dict for one row, in the format the comparison stage uses"""
+        cents = int(self.price_cents[row])
+        return {
+            'sku': self.skus[row],
+            'price': self.prices[row],
+            'price_cents': cents,
+            'section': self.sections[row],
+            'additional_info': list(self.extras[row])
+        }
+
+    def items(self):
+        """All rows as metadata dicts; built once and shared, so callers must not modify them"""
+        if self._items is None:
+            with self._lock:
+                if self._items is None:
+                    self._items = [self.item(row) for row in range(len(self))]
+        return self._items
+
+    def find_sku(self, sku):
+        """Row of a SKU (its first occurrence), or None"""
+        return self.sku_index.get(sku)
+
+    def rows_in_section(self, section):
+        return self.section_index.get(str(section).upper(), [])
+
+    def summary(self):
+        return {
+            'planogram_id': self.id,
+            'name': self.name,
+            'products': len(self),
+            'sections': len(self.section_index),
+            'shelf_rows': int(self.slot_rows.max()) + 1 if len(self) else 0,
+            'errors': len(self.errors)
+        }
+
+
+class PlanogramDatabase(SQLiteDatabase):
+    """Raw contents and names of uploaded planograms, shared by every process using the database file"""
+
+    def __init__(self, path):
+        super().__init__(path, SCHEMA)
+
+    def save(self, planogram, data):
+        """Store the metadata bytes a planogram was compiled from, and point its name at it"""
+        summary = {key: value for key, value in planogram.summary().items() if key != 'name'}
+        connection = self._connection()
+        with self._write_lock, connection:
+            connection.execute('INSERT OR IGNORE INTO planograms (id, created_at, summary, data) VALUES (?, ?, ?, ?)',
+                               (planogram.id, time.time(), json.dumps(summary), data))
+            if planogram.name:
+                connection.execute('INSERT OR REPLACE INTO planogram_names (name, planogram_id) VALUES (?, ?)',
+                                   (planogram.name, planogram.id))
+
+    def find(self, reference):
+        """(planogram id, name) of a stored planogram by name or id, or None"""
+        connection = self._connection()
+        row = connection.execute('SELECT planogram_id, name FROM planogram_names WHERE name = ?', (reference,)).fetchone()
+        if row is None:
+            row = connection.execute(
+                'SELECT id AS planogram_id, (SELECT MAX(name) FROM planogram_names WHERE planogram_id = id) AS name '
+                'FROM planograms WHERE id = ?', (reference,)).fetchone()
+        return (row['planogram_id'], row['name']) if row is not None else None
+
+    def load(self, planogram_id):
+        """Metadata bytes of a stored planogram, or None"""
+        row = self._connection().execute('SELECT data FROM planograms WHERE id = ?', (planogram_id,)).fetchone()
+        return bytes(row['data']) if row is not None else None
+
+    def summaries(self):
+        rows = self._connection().execute(
+            'SELECT id, summary, (SELECT MAX(name) FROM planogram_names WHERE planogram_id = id) AS name '
+            'FROM planograms ORDER BY created_at DESC').fetchall()
+        return [{**json.loads(row['summary']), 'name': row['name']} for row in rows]
+
+
+class PlanogramStore:
+    """
+    Compiled planograms by content hash, with an LRU limit on unnamed ones.
+    Named planograms stay until they are replaced by a newer upload. With a
+    database, persisted uploads are found there when this process has not
+    compiled them yet.
+    """
+
+    def __init__(self, parse, parse_file, max_entries=64, database=None):
+        self.parse = parse  # (bytes, MetadataErrors) -> iterable of metadata dicts
+        self.parse_file = parse_file  # (path, MetadataErrors) -> iterable of metadata dicts
+        self.max_entries = max_entries
+        self.database = database
+        self._planograms = OrderedDict()
+        self._names = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.compiles = 0
+
+    def get(self, reference):
+        """Planogram by id or name, or None"""
+        stored = None
+        if self.database is not None:
+            # The name may have been uploaded or moved to new contents by another process
+            try:
+                stored = self.database.find(reference)
+            except Exception as e:
+                print(f"Error looking up planogram {reference}: {str(e)}")
+
+        with self._lock:
+            planogram_id = stored[0] if stored is not None else self._names.get(reference, reference)
+            planogram = self._planograms.get(planogram_id)
+            if planogram is not None:
+                self._planograms.move_to_end(planogram_id)
+                if stored is None or stored[1] is None or planogram.name == stored[1]:
+                    return planogram
+        if stored is None:
+            return None
+
+        # Compile the stored contents in this process, or just take over the name
+        try:
+            data = self.database.load(planogram_id)
+        except Exception as e:
+            print(f"Error loading planogram {planogram_id}: {str(e)}")
+            data = None
+        if data is None:
+            return planogram
+        planogram, _ = self._compile(planogram_id, lambda errors: self.parse(data, errors), stored[1])
+        return planogram
+
+    def compile(self, data, planogram_id=None, name=None, persist=False):
+        """
+        Compiled planogram for raw metadata bytes, parsing them only if this
+        content has not been seen. planogram_id may be passed when the SHA-256
+        is already known (uploads are hashed while they stream in). With
+        persist, the contents and name are also saved to the database.
+        Returns (planogram, created).
+        """
+        planogram, created = self._compile(planogram_id or hash_bytes(data), lambda errors: self.parse(data, errors), name)
+        if persist:
+            self._persist(planogram, data)
+        return planogram, created
+
+    def compile_file(self, path, planogram_id=None, name=None, persist=False):
+        """Like compile, but hashes and parses the file in a streaming pass"""
+        if planogram_id is None:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+            planogram_id = digest.hexdigest()
+        planogram, created = self._compile(planogram_id, lambda errors: self.parse_file(path, errors), name)
+        if persist and self.database is not None:
+            with open(path, 'rb') as f:
+                self._persist(planogram, f.read())
+        return planogram, created
+
+    def _persist(self, planogram, data):
+        if self.database is None:
+            return
+        try:
+            self.database.save(planogram, data)
+        except Exception as e:
+            print(f"Error saving planogram {planogram.id}: {str(e)}")
+
+    def _compile(self, planogram_id, parse, name):
+        with self._lock:
+            planogram = self._planograms.get(planogram_id)
+            if planogram is not None:
+                self.hits += 1
+                self._planograms.move_to_end(planogram_id)
+        created = planogram is None
+        if created:
+            errors = MetadataErrors()
+            planogram = Planogram(planogram_id, parse(errors), errors=errors)
+
+        with self._lock:
+            if created:
+                # Another request may have compiled the same content meanwhile
+                planogram = self._planograms.setdefault(planogram_id, planogram)
+                self.compiles += 1
+            if name:
+                previous = self._planograms.get(self._names.get(name))
+                if previous is not None and previous is not planogram:
+                    previous.name = None
+                self._names[name] = planogram_id
+                planogram.name = name
+            self._evict()
+        return planogram, created
+
+    def _evict(self):
+        named = set(self._names.values())
+        for planogram_id in list(self._planograms):
+            if len(self._planograms) <= self.max_entries:
+                break
+            if planogram_id not in named:
+                del self._planograms[planogram_id]
+
+    def summaries(self):
+        """Planograms compiled here, then stored ones no process-local copy exists for"""
+        with self._lock:
+            summaries = [planogram.summary() for planogram in self._planograms.values()]
+        if self.database is not None:
+            known = {summary['planogram_id'] for summary in summaries}
+            try:
+                summaries += [summary for summary in self.database.summaries() if summary['planogram_id'] not in known]
+            except Exception as e:
+                print(f"Error listing planograms: {str(e)}")
+        return summaries
+
+    def stats(self):
+        with self._lock:
+            return {
+                'planograms': len(self._planograms),
+                'named': len(self._names),
+                'hits': self.hits,
+                'compiles': self.compiles
+            }
@@ -0,0 +1,240 @@
+"""
+Pluggable product detectors
+
+- mock:      the fixed demo boxes the app used to return
+- classical: downscale, edge map, morphological close, contour filtering and NMS (OpenCV + NumPy)
+- model:     a CPU object detection model from the Hugging Face hub (transformers)
+
+Every backend returns a Detections object: compact N x 4 box and N score
+arrays in original image pixels, plus the time the detection took.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+import lazy_modules
+from image_pipeline import as_decoded_image
+
+DETECTOR_MOCK = 'mock'
+DETECTOR_CLASSICAL = 'classical'
+DETECTOR_MODEL = 'model'
+DETECTORS = (DETECTOR_MOCK, DETECTOR_CLASSICAL, DETECTOR_MODEL)
+
+DEFAULT_DETECTION_MODEL = 'hustvl/yolos-tiny'
+
+
+class Detections:
+    """Boxes as int32 [x, y, width, height] rows with float32 scores"""
+
+    __slots__ = ('boxes', 'scores', 'labels', 'backend', 'latency_ms')
+
+    def __init__(self, boxes, scores, backend, latency_ms=None, labels=None):
+        self.boxes = np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+        self.scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+        self.labels = labels
+        self.backend = backend
+        self.latency_ms = latency_ms
+
+    def __len__(self):
+        return self.boxes.shape[0]
+
+    def to_regions(self):
+        """Product dicts in the format the comparison stage and templates use"""
+        regions = []
+        for index, ((x, y, width, height), score) in enumerate(zip(self.boxes.tolist(), self.scores.tolist())):
+            region = {'x': x, 'y': y, 'width': width, 'height': height, 'area': width * height,
+                      'confidence': round(score, 3)}
+            if self.labels is not None:
+                region['label'] = self.labels[index]
+            regions.append(region)
+        return regions
+
+    def summary(self):
+        return {'backend': self.backend, 'count': len(self),
+                'latency_ms': round(self.latency_ms, 3) if self.latency_ms is not None else None}
+
+
+def box_iou(box, boxes):
+    """IoU of one x, y, w, h box against an N x 4 array"""
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[0] + box[2], boxes[:, 0] + boxes[:, 2])
+    y2 = np.minimum(box[1] + box[3], boxes[:, 1] + boxes[:, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    union = box[2] * box[3] + boxes[:, 2] * boxes[:, 3] - intersection
+    return intersection / np.maximum(union, 1e-9)
+
+
+def non_max_suppression(boxes, scores, iou_threshold=0.5):
+    """
+    Greedy NMS; returns the indices kept, best score first. Each step compares
+    the current best box against all remaining boxes at once.
+    """
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    order = np.argsort(-np.asarray(scores, dtype=np.float32), kind='stable')
+    keep = []
+    while order.size:
+        best = order[0]
+        keep.append(int(best))
+        rest = order[1:]
+        order = rest[box_iou(boxes[best], boxes[rest]) <= iou_threshold]
+    return np.asarray(keep, dtype=np.int64)
+
+
+class Detector:
+    """Base class: subclasses implement _detect(image) -> (boxes, scores, labels)"""
+
+    name = None
+
+    def detect(self, image):
+        image = as_decoded_image(image)
+        started = time.perf_counter()
+        boxes, scores, labels = self._detect(image)
+        return Detections(boxes, scores, self.name, (time.perf_counter() - started) * 1000.0, labels)
+
+    def _detect(self, image):
+        raise NotImplementedError
+
+
+class MockDetector(Detector):
+    """The fixed demo layout, whatever the input"""
+
+    name = DETECTOR_MOCK
+
+    BOXES = [
+        (50, 30, 100, 80), (200, 30, 120, 80), (370, 30, 90, 80), (510, 30, 110, 80), (670, 30, 80, 80),
+        (50, 150, 100, 80), (200, 150, 120, 80), (370, 150, 90, 80), (510, 150, 110, 80), (670, 150, 80, 80)
+    ]
+    SCORES = [0.92, 0.88, 0.95, 0.91, 0.87, 0.93, 0.89, 0.94, 0.90, 0.86]
+
+    def _detect(self, image):
+        return self.BOXES, self.SCORES, None
+
+
+class ClassicalDetector(Detector):
+    """
+    Edge-based detection on the image's working view (capped at
+    MAX_WORKING_RESOLUTION, shared with the other stages), or on a smaller
+    thumbnail of it when max_side is set. Closing the edge map
+    joins the outline, label and texture fragments of one product into a
+    single blob, so contours map to products rather than to thousands of
+    edge pieces. Candidates are filtered by size, shape and solidity, and
+    overlapping ones merged by NMS.
+    """
+
+    name = DETECTOR_CLASSICAL
+
+    def __init__(self, max_side=None, min_area_ratio=0.002, max_area_ratio=0.25, max_aspect=6.0,
+                 close_ratio=0.006, min_fill=0.35, iou_threshold=0.4):
+        self.max_side = max_side
+        self.min_area_ratio = min_area_ratio
+        self.max_area_ratio = max_area_ratio
+        self.max_aspect = max_aspect
+        self.close_ratio = close_ratio
+        self.min_fill = min_fill
+        self.iou_threshold = iou_threshold
+
+    def _detect(self, image):
+        cv2 = lazy_modules.cv2()
+        if self.max_side is None:
+            gray = image.working_gray
+        else:
+            gray = np.asarray(image.thumbnail(min(self.max_side, image.max_working_side)).convert('L'))
+        height, width = gray.shape
+        original_width, original_height = image.size
+        scale_x, scale_y = original_width / width, original_height / height
+
+        edges = cv2.Canny(cv2.GaussianBlur(gray, (5, 5), 0), 50, 150)
+        kernel_side = max(3, int(round(max(width, height) * self.close_ratio)) | 1)
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_side, kernel_side))
+        closed = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, kernel)
+
+        contours, _ = cv2.findContours(closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        if not contours:
+            return np.empty((0, 4)), np.empty(0), None
+
+        boxes = np.array([cv2.boundingRect(contour) for contour in contours], dtype=np.float32)
+        areas = np.array([cv2.contourArea(contour) for contour in contours], dtype=np.float32)
+
+        box_areas = boxes[:, 2] * boxes[:, 3]
+        fill = areas / np.maximum(box_areas, 1.0)
+        aspect = np.maximum(boxes[:, 2], boxes[:, 3]) / np.maximum(np.minimum(boxes[:, 2], boxes[:, 3]), 1.0)
+        image_area = float(width * height)
+        keep = ((box_areas >= self.min_area_ratio * image_area)
+                & (box_areas <= self.max_area_ratio * image_area)
+                & (aspect <= self.max_aspect)
+                & (fill >= self.min_fill))
+        boxes, scores = boxes[keep], np.clip(fill[keep], 0.0, 1.0)
+
+        kept = non_max_suppression(boxes, scores, self.iou_threshold)
+        boxes, scores = boxes[kept], scores[kept]
+
+        # Back to original image pixels, sorted by top edge, then left edge
+        boxes = np.rint(boxes * np.array([scale_x, scale_y, scale_x, scale_y], dtype=np.float32))
+        order = np.lexsort((boxes[:, 0], boxes[:, 1]))
+        return boxes[order], scores[order], None
+
+
+class ModelDetector(Detector):
+    """
+    A transformers object detection model (DETR/YOLOS family) on CPU. The
+    model is loaded on first use; labels come from the model config.
+    """
+
+    name = DETECTOR_MODEL
+
+    def __init__(self, model_name=DEFAULT_DETECTION_MODEL, score_threshold=0.5, max_side=800, iou_threshold=0.5):
+        self.model_name = model_name
+        self.score_threshold = score_threshold
+        self.max_side = max_side
+        self.iou_threshold = iou_threshold
+        self.processor = None
+        self.model = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self.model is None:
+                transformers = lazy_modules.transformers()
+                self.torch = lazy_modules.torch()
+                self.processor = transformers.AutoImageProcessor.from_pretrained(self.model_name)
+                model = transformers.AutoModelForObjectDetection.from_pretrained(self.model_name)
+                model.eval()
+                self.model = model
+        return self.processor, self.model
+
+    def _detect(self, image):
+        processor, model = self._load()
+        thumbnail = image.thumbnail(self.max_side)
+        width, height = thumbnail.size
+        original_width, original_height = image.size
+
+        inputs = processor(images=thumbnail, return_tensors='pt')
+        with self.torch.no_grad():
+            outputs = model(**inputs)
+        result = processor.post_process_object_detection(outputs, threshold=self.score_threshold,
+                                                         target_sizes=[(height, width)])[0]
+
+        corners = result['boxes'].numpy().reshape(-1, 4)
+        scores = result['scores'].numpy()
+        label_ids = result['labels'].numpy()
+        boxes = np.column_stack([corners[:, 0], corners[:, 1], corners[:, 2] - corners[:, 0], corners[:, 3] - corners[:, 1]])
+
+        kept = non_max_suppression(boxes, scores, self.iou_threshold)
+        boxes = np.rint(boxes[kept] * np.array([original_width / width, original_height / height] * 2, dtype=np.float32))
+        id2label = getattr(model.config, 'id2label', {}) or {}
+        labels = [id2label.get(int(label_id), str(int(label_id))) for label_id in label_ids[kept]]
+        return boxes, scores[kept], labels
+
+
+def create_detector(name, **options):
+    """Build the named detector; options go to its constructor"""
+    if name == DETECTOR_MOCK:
+        return MockDetector()
+    if name == DETECTOR_CLASSICAL:
+        return ClassicalDetector(**options)
+    if name == DETECTOR_MODEL:
+        return ModelDetector(**options)
+    raise ValueError(f'Unknown detector {name!r}; expected one of {", ".join(DETECTORS)}')
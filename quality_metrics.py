@@ -0,0 +1,449 @@
+"""
+Vectorized image quality signals computed with NumPy on a downscaled view
+
+All metrics come from one small RGB thumbnail (QUALITY_ANALYSIS_SIDE on the
+longest side), so the cost is fixed regardless of the photo's resolution.
+"""
+
+import os
+
+import numpy as np
+
+from image_pipeline import as_decoded_image
+
+QUALITY_ANALYSIS_SIDE = int(os.environ.get('QUALITY_ANALYSIS_SIDE', 512))
+
+# Limits calibrated at QUALITY_ANALYSIS_SIDE; see describe_issues()
+DEFAULT_THRESHOLDS = {
+    'laplacian_var': 100.0,        # blurry when both sharpness measures are below their limits
+    'tenengrad': 20000.0,
+    'brightness_low': 50.0,        # underexposed below this mean
+    'brightness_high': 205.0,      # overexposed above this mean
+    'dark_clip_ratio': 0.15,       # share of pixels crushed to black ...
+    'dark_clip_brightness': 80.0,  # ... counts only when the mean is also below this
+    'bright_clip_ratio': 0.15,     # share of pixels blown to white ...
+    'bright_clip_brightness': 185.0,  # ... counts only when the mean is also above this
+    'glare_ratio': 0.015,          # share of the frame covered by specular highlights
+    'noise_sigma': 1.0,
+    'tilt_degrees': 3.0
+}
+
+# Margin around each threshold inside which a verdict is considered borderline
+BORDERLINE_MARGIN = 0.35
+
+GLARE_VALUE = 245
+GLARE_SATURATION = 40
+GLARE_BLOCK = 8
+
+# Immerkaer's Laplacian-difference kernel is insensitive to edges at first order
+_NOISE_SCALE = np.sqrt(np.pi / 2.0) / 6.0
+
+
+def _laplacian(gray):
+    return (gray[1:-1, :-2] + gray[1:-1, 2:] + gray[:-2, 1:-1] + gray[2:, 1:-1]
+            - 4.0 * gray[1:-1, 1:-1])
+
+
+def _sobel(gray):
+    """Sobel gradients on the interior (H-2 x W-2) computed with array slicing"""
+    top, middle, bottom = gray[:-2], gray[1:-1], gray[2:]
+    gx = ((top[:, 2:] + 2.0 * middle[:, 2:] + bottom[:, 2:])
+          - (top[:, :-2] + 2.0 * middle[:, :-2] + bottom[:, :-2]))
+    gy = ((bottom[:, :-2] + 2.0 * bottom[:, 1:-1] + bottom[:, 2:])
+          - (top[:, :-2] + 2.0 * top[:, 1:-1] + top[:, 2:]))
+    return gx, gy
+
+
+def _noise_sigma(gray, gx, gy):
+    """
+    Fast noise estimate (Immerkaer 1996) over the flattest half of the image,
+    so edges and texture aren't mistaken for noise
+    """
+    height, width = gray.shape
+    if height < 3 or width < 3:
+        return 0.0
+    response = (gray[:-2, :-2] - 2.0 * gray[:-2, 1:-1] + gray[:-2, 2:]
+                - 2.0 * gray[1:-1, :-2] + 4.0 * gray[1:-1, 1:-1] - 2.0 * gray[1:-1, 2:]
+                + gray[2:, :-2] - 2.0 * gray[2:, 1:-1] + gray[2:, 2:])
+    activity = np.abs(gx) + np.abs(gy)
+    flat = activity <= np.median(activity)
+    return float(_NOISE_SCALE * np.abs(response[flat]).mean())
+
+
+def _glare_blocks(hsv):
+    """
+    GLARE_BLOCK-sized cells that are mostly bright and unsaturated and not
+    connected to the image border. Large white areas reaching the edge (walls,
+    backdrops, paper) are background, not reflections, and are left out.
+    """
+    mask = (hsv[:, :, 2] >= GLARE_VALUE) & (hsv[:, :, 1] <= GLARE_SATURATION)
+    height, width = mask.shape
+    rows, cols = height // GLARE_BLOCK, width // GLARE_BLOCK
+    if not (rows and cols):
+        return np.zeros((rows, cols), dtype=bool)
+    cells = mask[:rows * GLARE_BLOCK, :cols * GLARE_BLOCK].reshape(rows, GLARE_BLOCK, cols, GLARE_BLOCK)
+    bright = cells.mean(axis=(1, 3)) > 0.5
+
+    # Flood fill from the border through bright blocks, one 4-neighbour step per pass
+    background = np.zeros_like(bright)
+    background[0, :], background[-1, :] = bright[0, :], bright[-1, :]
+    background[:, 0] |= bright[:, 0]
+    background[:, -1] |= bright[:, -1]
+    while True:
+        grown = background.copy()
+        grown[1:, :] |= background[:-1, :]
+        grown[:-1, :] |= background[1:, :]
+        grown[:, 1:] |= background[:, :-1]
+        grown[:, :-1] |= background[:, 1:]
+        grown &= bright
+        if np.array_equal(grown, background):
+            break
+        background = grown
+
+    return bright & ~background
+
+
+def _glare(hsv):
+    """(share of the image covered by glare blocks, number of glare blocks)"""
+    glare = _glare_blocks(hsv)
+    if not glare.size:
+        return 0.0, 0
+    return float(glare.mean()), int(glare.sum())
+
+
+def _tilt(gx, gy, max_angle=15.0, max_points=8000):
+    """
+    Camera roll in degrees (positive when horizontal lines rise to the right).
+    Shelf edges are the longest straight lines in the frame: strong horizontal
+    edge pixels are projected onto rows along each candidate angle, and the
+    angle that stacks them into the sharpest row profile wins. A coarse 1
+    degree sweep is refined in 0.25 degree steps.
+    """
+    magnitude = np.abs(gy)
+    mask = magnitude > np.abs(gx)
+    if not mask.any():
+        return 0.0
+    mask &= magnitude >= np.percentile(magnitude[mask], 90)
+    ys, xs = np.nonzero(mask)
+    weights = magnitude[mask]
+    if ys.size > max_points:
+        keep = np.linspace(0, ys.size - 1, max_points).astype(np.int64)
+        ys, xs, weights = ys[keep], xs[keep], weights[keep]
+    xs = xs - xs.mean()
+
+    def best_angle(angles):
+        rows = np.rint(ys[None, :] + xs[None, :] * np.tan(np.radians(angles))[:, None]).astype(np.int64)
+        rows -= rows.min()
+        span = int(rows.max()) + 1
+        rows += (np.arange(len(angles)) * span)[:, None]
+        profiles = np.bincount(rows.ravel(), weights=np.broadcast_to(weights, rows.shape).ravel(),
+                               minlength=span * len(angles)).reshape(len(angles), span)
+        return float(angles[np.argmax((profiles * profiles).sum(axis=1))])
+
+    coarse = best_angle(np.arange(-max_angle, max_angle + 0.5, 1.0))
+    return best_angle(np.arange(coarse - 1.0, coarse + 1.125, 0.25))
+
+
+def compute_metrics(image, max_side=None):
+    """
+    All quality signals in one pass over a downscaled grayscale/HSV view.
+    Returns plain floats so the result can be cached or serialized.
+    """
+    image = as_decoded_image(image)
+    thumbnail = image.thumbnail(max_side or QUALITY_ANALYSIS_SIDE)
+    gray_u8 = np.asarray(thumbnail.convert('L'))
+    gray = gray_u8.astype(np.float32)
+    hsv = np.asarray(thumbnail.convert('HSV'))
+
+    histogram = np.bincount(gray_u8.ravel(), minlength=256)
+    pixels = float(gray_u8.size)
+    gx, gy = _sobel(gray)
+    glare_ratio, glare_blocks = _glare(hsv)
+
+    return {
+        'analysis_size': list(thumbnail.size),
+        'laplacian_var': float(_laplacian(gray).var()),
+        'tenengrad': float(np.mean(gx * gx + gy * gy)),
+        'brightness': float(gray.mean()),
+        'dark_clip_ratio': float(histogram[:8].sum() / pixels),
+        'bright_clip_ratio': float(histogram[248:].sum() / pixels),
+        'glare_ratio': glare_ratio,
+        'glare_blocks': glare_blocks,
+        'noise_sigma': _noise_sigma(gray, gx, gy),
+        'tilt_degrees': _tilt(gx, gy)
+    }
+
+
+def describe_issues(metrics, thresholds=None):
+    """Turn metrics into issue dicts in the format analyze_image_quality returns"""
+    limits = {**DEFAULT_THRESHOLDS, **(thresholds or {})}
+    issues = []
+
+    if metrics['laplacian_var'] < limits['laplacian_var'] and metrics['tenengrad'] < limits['tenengrad']:
+        issues.append({
+            'type': 'blur',
+            'severity': 'high' if metrics['laplacian_var'] < limits['laplacian_var'] / 2 else 'medium',
+            'description': f'Image appears to be blurry (sharpness {metrics["laplacian_var"]:.0f})'
+        })
+
+    # A white backdrop or dark packaging clips plenty of pixels in a well exposed
+    # photo, so clipping only counts when the overall mean is skewed the same way
+    underexposed = metrics['brightness'] < limits['brightness_low'] or (
+        metrics['dark_clip_ratio'] > limits['dark_clip_ratio'] and metrics['brightness'] < limits['dark_clip_brightness'])
+    overexposed = metrics['brightness'] > limits['brightness_high'] or (
+        metrics['bright_clip_ratio'] > limits['bright_clip_ratio'] and metrics['brightness'] > limits['bright_clip_brightness'])
+    if underexposed:
+        issues.append({
+            'type': 'exposure',
+            'severity': 'medium',
+            'description': f'Image appears underexposed ({metrics["dark_clip_ratio"]:.0%} of pixels clipped to black)'
+        })
+    elif overexposed:
+        issues.append({
+            'type': 'exposure',
+            'severity': 'medium',
+            'description': f'Image appears overexposed ({metrics["bright_clip_ratio"]:.0%} of pixels clipped to white)'
+        })
+
+    if metrics['glare_ratio'] > limits['glare_ratio']:
+        issues.append({
+            'type': 'glare',
+            'severity': 'high' if metrics['glare_ratio'] > limits['glare_ratio'] * 5 else 'medium',
+            'description': f'Specular glare covers {metrics["glare_ratio"]:.1%} of the image'
+        })
+
+    if metrics['noise_sigma'] > limits['noise_sigma']:
+        issues.append({
+            'type': 'noise',
+            'severity': 'low',
+            'description': f'Image is noisy (estimated sigma {metrics["noise_sigma"]:.1f})'
+        })
+
+    if abs(metrics['tilt_degrees']) > limits['tilt_degrees']:
+        issues.append({
+            'type': 'tilt',
+            'severity': 'low',
+            'description': f'Camera appears tilted by {metrics["tilt_degrees"]:.1f} degrees'
+        })
+
+    return issues
+
+
+def _near(value, limit, margin):
+    return abs(value - limit) <= abs(limit) * margin
+
+
+def is_borderline(metrics, thresholds=None, margin=BORDERLINE_MARGIN):
+    """
+    True when a signal sits close to the limit that decides its issue, i.e.
+    the cheap checks can't give a confident verdict and the image model is
+    worth running. Clearly good and clearly bad images return False.
+    """
+    limits = {**DEFAULT_THRESHOLDS, **(thresholds or {})}
+    sharpness = (metrics['laplacian_var'], limits['laplacian_var']), (metrics['tenengrad'], limits['tenengrad'])
+    for (value, limit), (other, other_limit) in (sharpness, sharpness[::-1]):
+        if _near(value, limit, margin) and other < other_limit * (1 + margin):
+            return True
+    if _near(metrics['brightness'], limits['brightness_low'], margin):
+        return True
+    if abs(metrics['brightness'] - limits['brightness_high']) <= (255 - limits['brightness_high']) * margin:
+        return True
+    if _near(metrics['glare_ratio'], limits['glare_ratio'], margin) or _near(metrics['noise_sigma'], limits['noise_sigma'], margin):
+        return True
+    return _near(abs(metrics['tilt_degrees']), limits['tilt_degrees'], margin)
+
+
+def has_serious_issue(issues):
+    """True when an issue of medium or high severity is already flagged; the image model can't clear it"""
+    return any(issue['severity'] in ('medium', 'high') for issue in issues)
+
+
+def cascade_verdict(metrics, issues, thresholds=None, margin=BORDERLINE_MARGIN):
+    """
+    Verdict of the cheap checks for the quality cascade: 'bad' when they
+    already flag a serious issue, 'good' when no signal is within margin of
+    its limit, and None when the image is ambiguous and worth the image model.
+    """
+    if has_serious_issue(issues):
+        return 'bad'
+    if is_borderline(metrics, thresholds, margin):
+        return None
+    return 'good'
+
+
+# Tiled analysis: the same kind of signals per grid cell, for a defect heatmap
+
+DEFAULT_TILE_GRID = (4, 4)
+
+# Input side of the image model; tiles are cropped from a thumbnail that gives each about this much
+TILE_MODEL_SIDE = 224
+
+TILE_THRESHOLDS = {
+    'sharpness': 4.0,       # Tenengrad divided by intensity variance, so independent of contrast
+    'min_contrast': 8.0,    # flatter tiles (intensity std) are not judged for blur
+    'glare_ratio': 0.1,     # share of the tile covered by glare blocks
+    'brightness_low': 50.0,
+    'ai_confidence': 0.7,   # image model confidence below this counts against a tile
+    'bad_score': 0.5        # tiles scoring at least this form bad regions
+}
+
+# Tiles need a few pixels each for the gradient filters
+MIN_TILE_SIDE = 8
+
+
+def _tiles(array, rows, cols):
+    """View an H x W array as rows x tile_h x cols x tile_w, dropping the remainder"""
+    height, width = array.shape
+    tile_height, tile_width = height // rows, width // cols
+    return array[:rows * tile_height, :cols * tile_width].reshape(rows, tile_height, cols, tile_width)
+
+
+def tile_grid(image, grid=DEFAULT_TILE_GRID, max_side=None):
+    """
+    The (rows, cols) actually used for an image: grid, reduced so every tile
+    of the analysis thumbnail is at least MIN_TILE_SIDE pixels. Tile metrics
+    and tile crops both use it, so model confidences line up with the tiles.
+    """
+    width, height = as_decoded_image(image).thumbnail(max_side or QUALITY_ANALYSIS_SIDE).size
+    return max(1, min(grid[0], height // MIN_TILE_SIDE)), max(1, min(grid[1], width // MIN_TILE_SIDE))
+
+
+def compute_tile_metrics(image, grid=DEFAULT_TILE_GRID, max_side=None):
+    """Sharpness, contrast, brightness and glare for every tile, as rows x cols arrays"""
+    image = as_decoded_image(image)
+    thumbnail = image.thumbnail(max_side or QUALITY_ANALYSIS_SIDE)
+    gray = np.asarray(thumbnail.convert('L')).astype(np.float32)
+    hsv = np.asarray(thumbnail.convert('HSV'))
+    height, width = gray.shape
+    rows, cols = tile_grid(image, grid, max_side)
+
+    gx, gy = _sobel(gray)
+    energy = np.pad(gx * gx + gy * gy, 1, mode='edge')
+    glare_blocks = _glare_blocks(hsv)
+    glare = np.zeros(gray.shape, dtype=np.float32)
+    glare[:glare_blocks.shape[0] * GLARE_BLOCK, :glare_blocks.shape[1] * GLARE_BLOCK] = np.kron(
+        glare_blocks, np.ones((GLARE_BLOCK, GLARE_BLOCK), dtype=np.float32))
+
+    gray_tiles = _tiles(gray, rows, cols)
+    variance = gray_tiles.var(axis=(1, 3))
+    return {
+        'grid': (rows, cols),
+        'tile_size': (width // cols, height // rows),
+        'analysis_size': thumbnail.size,
+        'sharpness': _tiles(energy, rows, cols).mean(axis=(1, 3)) / (variance + 1.0),
+        'contrast': np.sqrt(variance),
+        'brightness': gray_tiles.mean(axis=(1, 3)),
+        'glare_ratio': _tiles(glare, rows, cols).mean(axis=(1, 3))
+    }
+
+
+def score_tiles(tile_metrics, thresholds=None, ai_confidences=None):
+    """
+    Badness per tile from 0 (fine) to 1, overall and per signal.
+    ai_confidences, if given, is a rows x cols array of model confidences.
+    """
+    limits = {**TILE_THRESHOLDS, **(thresholds or {})}
+    blur = np.clip(2.0 * (1.0 - tile_metrics['sharpness'] / limits['sharpness']), 0.0, 1.0)
+    blur[tile_metrics['contrast'] < limits['min_contrast']] = 0.0
+    components = {
+        'blur': blur,
+        'glare': np.clip(tile_metrics['glare_ratio'] / limits['glare_ratio'], 0.0, 1.0),
+        'dark': np.clip(2.0 * (1.0 - tile_metrics['brightness'] / limits['brightness_low']), 0.0, 1.0)
+    }
+    if ai_confidences is not None:
+        components['ai_confidence'] = np.clip(2.0 * (1.0 - ai_confidences / limits['ai_confidence']), 0.0, 1.0)
+    return np.maximum.reduce(list(components.values())), components
+
+
+def find_bad_regions(scores, threshold):
+    """Groups of 4-connected tiles scoring at least threshold, as lists of (row, col)"""
+    bad = scores >= threshold
+    seen = np.zeros_like(bad)
+    regions = []
+    rows, cols = bad.shape
+    for start in zip(*np.nonzero(bad)):
+        if seen[start]:
+            continue
+        seen[start] = True
+        stack, region = [start], []
+        while stack:
+            row, col = stack.pop()
+            region.append((int(row), int(col)))
+            for r, c in ((row - 1, col), (row + 1, col), (row, col - 1), (row, col + 1)):
+                if 0 <= r < rows and 0 <= c < cols and bad[r, c] and not seen[r, c]:
+                    seen[r, c] = True
+                    stack.append((r, c))
+        regions.append(region)
+    return regions
+
+
+def tile_crops(image, grid=DEFAULT_TILE_GRID):
+    """RGB crops of each tile (row-major) sized for the image model, from one thumbnail"""
+    image = as_decoded_image(image)
+    rows, cols = tile_grid(image, grid)
+    thumbnail = image.thumbnail(TILE_MODEL_SIDE * max(rows, cols))
+    width, height = thumbnail.size
+    return [thumbnail.crop((col * width // cols, row * height // rows,
+                            (col + 1) * width // cols, (row + 1) * height // rows))
+            for row in range(rows) for col in range(cols)]
+
+
+def build_quality_map(image, grid=DEFAULT_TILE_GRID, thresholds=None, ai_confidences=None):
+    """
+    Compact per-region quality report: a rows x cols heatmap of badness scores
+    and bounding boxes (original image pixels) of connected bad tiles.
+    ai_confidences, if given, are per-tile model confidences in row-major order
+    (as for tile_crops); tiles the model is unsure about score as bad.
+    """
+    image = as_decoded_image(image)
+    limits = {**TILE_THRESHOLDS, **(thresholds or {})}
+    tile_metrics = compute_tile_metrics(image, grid)
+    rows, cols = tile_metrics['grid']
+
+    confidences = None
+    if ai_confidences is not None and len(ai_confidences) == rows * cols:
+        confidences = np.asarray(ai_confidences, dtype=np.float32).reshape(rows, cols)
+    scores, components = score_tiles(tile_metrics, limits, confidences)
+
+    width, height = image.size
+    analysis_width, analysis_height = tile_metrics['analysis_size']
+    scale_x, scale_y = width / analysis_width, height / analysis_height
+    tile_width, tile_height = tile_metrics['tile_size']
+
+    regions = []
+    for tiles in find_bad_regions(scores, limits['bad_score']):
+        region_rows = [row for row, _ in tiles]
+        region_cols = [col for _, col in tiles]
+        index = tuple(np.array(tiles).T)
+        x0, y0 = min(region_cols) * tile_width, min(region_rows) * tile_height
+        x1, y1 = (max(region_cols) + 1) * tile_width, (max(region_rows) + 1) * tile_height
+        region = {
+            'x': int(x0 * scale_x),
+            'y': int(y0 * scale_y),
+            'width': int((x1 - x0) * scale_x),
+            'height': int((y1 - y0) * scale_y),
+            'tiles': len(tiles),
+            'score': round(float(scores[index].max()), 2),
+            'reasons': [name for name, values in components.items() if values[index].max() >= limits['bad_score']]
+        }
+        if confidences is not None:
+            region['ai_confidence'] = round(float(confidences[index].mean()), 3)
+        regions.append(region)
+
+    regions.sort(key=lambda region: region['score'], reverse=True)
+    return {
+        'grid': [rows, cols],
+        'heatmap': np.round(scores.astype(np.float64), 2).tolist(),
+        'ai_confidence': np.round(confidences.astype(np.float64), 3).tolist() if confidences is not None else None,
+        'regions': regions
+    }
+
+
+def region_issues(quality_map):
+    """Issues (with coordinates for the results overlay) for each bad region"""
+    return [{
+        'type': 'region_quality',
+        'severity': 'high' if region['score'] >= 0.8 else 'medium',
+        'description': f'Poor image quality in part of the photo ({", ".join(region["reasons"])})',
+        'coordinates': {key: region[key] for key in ('x', 'y', 'width', 'height')}
+    } for region in quality_map['regions']]
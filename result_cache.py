@@ -0,0 +1,161 @@
+"""
+Content-addressed cache for analysis results
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def hash_bytes(data):
+    """SHA-256 hex digest of raw file contents"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_metadata(metadata):
+    """SHA-256 hex digest of parsed metadata, independent of whitespace in the source file"""
+    canonical = json.dumps(metadata, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def make_cache_key(image_hash, metadata_hash, variant=None):
+    """variant separates results of the same inputs analyzed with different options"""
+    key = f'{image_hash}:{metadata_hash}:{variant}' if variant else f'{image_hash}:{metadata_hash}'
+    return hashlib.sha256(key.encode('ascii')).hexdigest()
+
+
+class DiskCache:
+    """JSON files on disk, evicted by age (TTL) and by total size (oldest first)"""
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024, ttl_seconds=24 * 3600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._index = {}  # key -> (size, mtime)
+        self._total_bytes = 0
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f'{key}.json')
+
+    def _scan(self):
+        """Rebuild the index from files left by a previous run"""
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith('.json'):
+                    continue
+                stat = os.stat(os.path.join(root, name))
+                self._index[name[:-5]] = (stat.st_size, stat.st_mtime)
+                self._total_bytes += stat.st_size
+
+    def _remove(self, key):
+        size, _ = self._index.pop(key, (0, 0))
+        self._total_bytes -= size
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def get(self, key):
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                return None
+            if self.ttl_seconds and time.time() - entry[1] > self.ttl_seconds:
+                self._remove(key)
+                return None
+        try:
+            with open(self._path(key), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            with self._lock:
+                self._remove(key)
+            return None
+
+    def set(self, key, value):
+        data = json.dumps(value).encode('utf-8')
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file and rename so readers never see a partial entry
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            old_size, _ = self._index.get(key, (0, 0))
+            self._index[key] = (len(data), time.time())
+            self._total_bytes += len(data) - old_size
+            self._evict()
+
+    def _evict(self):
+        now = time.time()
+        if self.ttl_seconds:
+            for key in [k for k, (_, mtime) in self._index.items() if now - mtime > self.ttl_seconds]:
+                self._remove(key)
+        if self._total_bytes > self.max_bytes:
+            for key in sorted(self._index, key=lambda k: self._index[k][1]):
+                if self._total_bytes <= self.max_bytes:
+                    break
+                self._remove(key)
+
+    def __len__(self):
+        return len(self._index)
+
+
+class ResultCache:
+    """In-memory LRU in front of an optional on-disk tier"""
+
+    def __init__(self, max_entries=256, disk_dir=None, disk_max_bytes=512 * 1024 * 1024, ttl_seconds=24 * 3600):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.disk = DiskCache(disk_dir, disk_max_bytes, ttl_seconds) if disk_dir else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+        value = self.disk.get(key) if self.disk is not None else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._put(key, value)
+        return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._put(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def _put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'memory_entries': len(self._entries),
+                'disk_entries': len(self.disk) if self.disk is not None else None,
+                'memory_hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses
+            }
@@ -0,0 +1,188 @@
+"""
+Persistent audit history in SQLite
+
+Every analysis is saved once as an audit row (full result as JSON) plus one
+row per anomaly, so result pages can be reloaded or shared without running
+the pipeline again, and history/trend queries never touch the model. The
+database runs in WAL mode (see sqlite_db.py).
+
+Lists are paginated with a cursor (the created_at and id of the last row of
+the previous page) rather than OFFSET, so deep pages cost the same as the
+first one.
+"""
+
+import json
+import time
+import uuid
+
+from sqlite_db import SQLiteDatabase
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS audits (
+    id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    store_id TEXT,
+    image_hash TEXT NOT NULL,
+    metadata_hash TEXT NOT NULL,
+    variant TEXT,
+    image_filename TEXT,
+    metadata_filename TEXT,
+    anomaly_count INTEGER NOT NULL,
+    quality_issue_count INTEGER NOT NULL,
+    result TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS audits_created ON audits (created_at, id);
+CREATE INDEX IF NOT EXISTS audits_store_created ON audits (store_id, created_at, id);
+CREATE INDEX IF NOT EXISTS audits_inputs ON audits (image_hash, metadata_hash, variant, created_at);
+
+CREATE TABLE IF NOT EXISTS anomalies (
+    id INTEGER PRIMARY KEY,
+    audit_id TEXT NOT NULL REFERENCES audits (id) ON DELETE CASCADE,
+    created_at REAL NOT NULL,
+    store_id TEXT,
+    type TEXT NOT NULL,
+    severity TEXT,
+    sku TEXT,
+    section TEXT,
+    description TEXT
+);
+CREATE INDEX IF NOT EXISTS anomalies_type_created ON anomalies (type, created_at, id);
+CREATE INDEX IF NOT EXISTS anomalies_store_created ON anomalies (store_id, created_at, id);
+CREATE INDEX IF NOT EXISTS anomalies_created ON anomalies (created_at, id);
+CREATE INDEX IF NOT EXISTS anomalies_audit ON anomalies (audit_id);
+"""
+
+MAX_PAGE_SIZE = 500
+
+TREND_BUCKETS = {'hour': 3600, 'day': 86400, 'week': 7 * 86400}
+
+
+def encode_cursor(created_at, row_id):
+    return f'{created_at!r}_{row_id}'
+
+
+def decode_cursor(cursor):
+    """(created_at, id) from a cursor; raises ValueError for malformed ones"""
+    created_at, _, row_id = cursor.partition('_')
+    if not row_id:
+        raise ValueError(f'Invalid cursor {cursor!r}')
+    return float(created_at), row_id
+
+
+class ResultStore(SQLiteDatabase):
+    """Audits and their anomalies in one SQLite file"""
+
+    def __init__(self, path):
+        super().__init__(path, SCHEMA)
+
+    def save(self, analysis, image_hash, metadata_hash, variant=None, store_id=None,
+             image_filename=None, metadata_filename=None):
+        """Store one audit and its anomalies; returns the audit id"""
+        audit_id = uuid.uuid4().hex
+        created_at = time.time()
+        anomalies = analysis['anomalies']
+        rows = []
+        for anomaly in anomalies:
+            item = anomaly.get('metadata_item') or {}
+            rows.append((audit_id, created_at, store_id, anomaly['type'], anomaly.get('severity'),
+                         item.get('sku'), item.get('section') or anomaly.get('detected_section'),
+                         anomaly.get('description')))
+
+        connection = self._connection()
+        with self._write_lock, connection:
+            connection.execute(
+                'INSERT INTO audits (id, created_at, store_id, image_hash, metadata_hash, variant, image_filename, '
+                'metadata_filename, anomaly_count, quality_issue_count, result) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (audit_id, created_at, store_id, image_hash, metadata_hash, variant, image_filename, metadata_filename,
+                 len(anomalies), len(analysis['quality_issues']), json.dumps(analysis)))
+            connection.executemany(
+                'INSERT INTO anomalies (audit_id, created_at, store_id, type, severity, sku, section, description) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        return audit_id
+
+    def get(self, audit_id):
+        """Audit summary plus the full analysis under 'result', or None"""
+        row = self._connection().execute('SELECT * FROM audits WHERE id = ?', (audit_id,)).fetchone()
+        if row is None:
+            return None
+        audit = self._audit_summary(row)
+        audit['metadata_filename'] = row['metadata_filename']
+        audit['result'] = json.loads(row['result'])
+        return audit
+
+    def find_latest(self, image_hash, metadata_hash, variant=None, since=None):
+        """Id of the newest audit of the same inputs (saved at or after since), or None"""
+        row = self._connection().execute(
+            'SELECT id FROM audits WHERE image_hash = ? AND metadata_hash = ? AND variant IS ? AND created_at >= ? '
+            'ORDER BY created_at DESC LIMIT 1', (image_hash, metadata_hash, variant, since or 0)).fetchone()
+        return row['id'] if row is not None else None
+
+    @staticmethod
+    def _audit_summary(row):
+        return {
+            'audit_id': row['id'],
+            'created_at': row['created_at'],
+            'store_id': row['store_id'],
+            'image_hash': row['image_hash'],
+            'metadata_hash': row['metadata_hash'],
+            'variant': row['variant'],
+            'image_filename': row['image_filename'],
+            'anomaly_count': row['anomaly_count'],
+            'quality_issue_count': row['quality_issue_count']
+        }
+
+    @staticmethod
+    def _filters(store_id=None, since=None, until=None, anomaly_type=None):
+        clauses, params = [], []
+        for column, value, operator in (('store_id', store_id, '='), ('type', anomaly_type, '='),
+                                        ('created_at', since, '>='), ('created_at', until, '<')):
+            if value is not None:
+                clauses.append(f'{column} {operator} ?')
+                params.append(value)
+        return clauses, params
+
+    def _page(self, table, columns, clauses, params, limit, cursor):
+        """Newest first; the cursor continues after the last row of the previous page"""
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        if cursor:
+            created_at, row_id = decode_cursor(cursor)
+            clauses = clauses + ['(created_at < ? OR (created_at = ? AND id < ?))']
+            params = params + [created_at, created_at, row_id if table == 'audits' else int(row_id)]
+        where = f'WHERE {" AND ".join(clauses)}' if clauses else ''
+        rows = self._connection().execute(
+            f'SELECT {columns} FROM {table} {where} ORDER BY created_at DESC, id DESC LIMIT ?',
+            params + [limit + 1]).fetchall()
+        next_cursor = encode_cursor(rows[limit - 1]['created_at'], rows[limit - 1]['id']) if len(rows) > limit else None
+        return rows[:limit], next_cursor
+
+    def list_audits(self, store_id=None, since=None, until=None, limit=50, cursor=None):
+        """{'audits': [...], 'next_cursor': str or None}, newest first"""
+        clauses, params = self._filters(store_id, since, until)
+        columns = ('id, created_at, store_id, image_hash, metadata_hash, variant, image_filename, '
+                   'anomaly_count, quality_issue_count')
+        rows, next_cursor = self._page('audits', columns, clauses, params, limit, cursor)
+        return {'audits': [self._audit_summary(row) for row in rows], 'next_cursor': next_cursor}
+
+    def list_anomalies(self, anomaly_type=None, store_id=None, since=None, until=None, limit=50, cursor=None):
+        """{'anomalies': [...], 'next_cursor': str or None}, newest first, across all audits"""
+        clauses, params = self._filters(store_id, since, until, anomaly_type)
+        rows, next_cursor = self._page('anomalies', '*', clauses, params, limit, cursor)
+        return {'anomalies': [dict(row) for row in rows], 'next_cursor': next_cursor}
+
+    def anomaly_trend(self, bucket='day', anomaly_type=None, store_id=None, since=None, until=None):
+        """Anomaly counts per time bucket and type, computed in SQL from the indexed columns"""
+        seconds = TREND_BUCKETS[bucket]
+        clauses, params = self._filters(store_id, since, until, anomaly_type)
+        where = f'WHERE {" AND ".join(clauses)}' if clauses else ''
+        rows = self._connection().execute(
+            f'SELECT CAST(created_at / {seconds} AS INTEGER) * {seconds} AS bucket_start, type, COUNT(*) AS count '
+            f'FROM anomalies {where} GROUP BY bucket_start, type ORDER BY bucket_start, type', params).fetchall()
+        return [dict(row) for row in rows]
+
+    def stats(self):
+        """Number of saved audits and anomalies"""
+        connection = self._connection()
+        return {
+            'audits': connection.execute('SELECT COUNT(*) FROM audits').fetchone()[0],
+            'anomalies': connection.execute('SELECT COUNT(*) FROM anomalies').fetchone()[0]
+        }
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""
+Shelf Vision Audit Tool - Bulk Audit Runner Script
+
+Audits every image/metadata pair in a directory or zip/tar archive and writes
+one JSON line per image, followed by a summary line with the throughput.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+
+from bulk_audit import create_pool, default_workers, extract_archive, find_pairs, run_bulk, to_json_lines
+from engines import ENGINES
+from serving import APP_VARIANTS, variant_engines
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Audit many shelf photos in parallel')
+    parser.add_argument('source', help='Directory or zip/tar archive of image + metadata (.txt) pairs with matching names')
+    parser.add_argument('-o', '--output', help='JSON Lines output file (default: stdout)')
+    parser.add_argument('-w', '--workers', type=int, default=default_workers(), help='Worker processes (default: CPU count)')
+    parser.add_argument('--variant', default='full', choices=sorted(APP_VARIANTS), help='App variant whose engines to use (default: full)')
+    parser.add_argument('--mode', choices=ENGINES, help="Engine to run (mock, opencv or vit; default: the variant's default engine)")
+    args = parser.parse_args()
+    if args.mode and args.mode not in variant_engines(args.variant):
+        parser.error(f"--mode {args.mode} is not enabled in the {args.variant} variant "
+                     f"(engines: {', '.join(variant_engines(args.variant))})")
+
+    with tempfile.TemporaryDirectory() as extract_dir:
+        if os.path.isdir(args.source):
+            base_dir = args.source
+        else:
+            extract_archive(args.source, extract_dir)
+            base_dir = extract_dir
+
+        pairs, unmatched = find_pairs(base_dir)
+        output = open(args.output, 'w') if args.output else sys.stdout
+        try:
+            with create_pool(args.workers, APP_VARIANTS[args.variant], args.mode) as pool:
+                for line in to_json_lines(run_bulk(pairs, pool, base_dir=base_dir, unmatched=unmatched)):
+                    output.write(line)
+                    output.flush()
+        finally:
+            if output is not sys.stdout:
+                output.close()
+
+
+if __name__ == '__main__':
+    main()
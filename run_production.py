@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+"""
+Shelf Vision Audit Tool - Production Runner Script
+
+Serves an app variant with gunicorn using gunicorn.conf.py: the model is
+loaded once and shared by all worker processes. Requires gunicorn (Linux/macOS).
+"""
+
+import argparse
+import os
+import sys
+
+from serving import APP_VARIANTS
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the audit tool with gunicorn')
+    parser.add_argument('variant', nargs='?', default='full', choices=sorted(APP_VARIANTS), help='App variant (default: full)')
+    parser.add_argument('-w', '--workers', type=int, help='Worker processes (default: from the core count)')
+    parser.add_argument('-t', '--threads', type=int, help='Request threads per worker')
+    parser.add_argument('-b', '--bind', help='Address to listen on, e.g. 0.0.0.0:8000')
+    args = parser.parse_args()
+
+    os.environ['APP_VARIANT'] = args.variant
+    for name, value in (('WEB_WORKERS', args.workers), ('WEB_THREADS', args.threads), ('BIND', args.bind)):
+        if value:
+            os.environ[name] = str(value)
+
+    config = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn.conf.py')
+    os.execvp(sys.executable, [sys.executable, '-m', 'gunicorn', '-c', config, 'wsgi:app'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Production serving with a pre-forking WSGI server (gunicorn)
+
+The app is imported once in the master process with the ViT model loaded,
+then the workers are forked from it. Inference never writes to the weights,
+so the workers share the master's weight pages copy-on-write and N workers
+cost about one copy of the model. gc.freeze() moves everything loaded so far
+out of the collector's reach, so garbage collection in a worker doesn't
+write to (and so copy) the shared pages either.
+
+The master runs PyTorch with a single intra-op thread: an OpenMP thread
+pool started before fork() deadlocks the children. Each worker sets its own
+thread count after the fork and runs a warmup pass before taking requests.
+"""
+
+import gc
+import importlib
+import os
+import time
+
+import lazy_modules
+from engines import ENGINE_MOCK, ENGINE_OPENCV, ENGINES
+
+APP_VARIANTS = {'full': 'app', 'simple': 'app_simple', 'minimal': 'app_minimal'}
+DEFAULT_PORTS = {'full': 5002, 'simple': 5001, 'minimal': 5000}
+# Engines of the reduced versions; the full version reads them from ENGINES
+VARIANT_ENGINES = {'simple': (ENGINE_MOCK,), 'minimal': (ENGINE_OPENCV,)}
+
+# Set by preload() in the master; workers inherit it
+_app_module = None
+
+
+def cpu_count():
+    """Cores this process may run on (respects CPU affinity, e.g. in containers)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def variant_engines(variant):
+    """Engines the variant enables, without importing its app"""
+    if variant in VARIANT_ENGINES:
+        return VARIANT_ENGINES[variant]
+    names = os.environ.get('ENGINES', ','.join(ENGINES)).split(',')
+    return tuple(name.strip().lower() for name in names if name.strip())
+
+
+def default_workers(variant='full', cores=None):
+    """
+    Worker processes for the variant. The full version gives each worker
+    several cores for batched ViT passes; the others run one request per core.
+    """
+    cores = cores or cpu_count()
+    if variant == 'full':
+        return max(2, cores // 2)
+    return max(2, cores)
+
+
+def default_threads(variant='full'):
+    """Request threads per worker; the full version needs enough to fill an inference batch"""
+    if variant == 'full':
+        return max(1, int(os.environ.get('INFERENCE_MAX_BATCH_SIZE', 8)))
+    return 4
+
+
+def torch_threads(workers, cores=None):
+    """Intra-op threads per worker so all workers together use each core once"""
+    cores = cores or cpu_count()
+    return max(1, cores // max(1, workers))
+
+
+def preload(variant='full'):
+    """Import the app variant in the master, load its model and freeze the heap for sharing"""
+    global _app_module
+    if variant not in APP_VARIANTS:
+        raise ValueError(f'Unknown app variant {variant!r}; expected one of {", ".join(APP_VARIANTS)}')
+
+    started = time.perf_counter()
+    if variant == 'full':
+        # Load before forking instead of in each worker, and keep OpenMP out of the master
+        os.environ['MODEL_LOAD_MODE'] = 'startup'
+        torch = lazy_modules.torch()
+        torch.set_num_threads(1)
+
+    _app_module = importlib.import_module(APP_VARIANTS[variant])
+    registry = getattr(_app_module, 'model_registry', None)
+    if registry is not None and not registry.is_ready:
+        print(f"Error preloading AI models, workers will retry on first use: {registry.error}")
+
+    freeze_heap()
+    print(f"Preloaded {variant} app in {time.perf_counter() - started:.1f}s (pid {os.getpid()})")
+    return _app_module.app
+
+
+def freeze_heap():
+    """Collect once, then exclude every surviving object from future collections"""
+    gc.collect()
+    gc.freeze()
+
+
+def configure_worker(workers):
+    """Per-worker setup right after the fork"""
+    if _app_module is None:
+        return
+    registry = getattr(_app_module, 'model_registry', None)
+    if registry is not None:
+        torch = lazy_modules.torch()
+        torch.set_num_threads(int(os.environ.get('TORCH_THREADS', 0)) or torch_threads(workers))
+        registry.after_fork()
+
+
+def warmup():
+    """
+    Run one forward pass per batch size and render the index page, so the
+    first real requests don't pay for allocator growth and template compiles.
+    Returns the seconds spent.
+    """
+    if _app_module is None:
+        return 0.0
+    started = time.perf_counter()
+    registry = getattr(_app_module, 'model_registry', None)
+    if registry is not None:
+        batch_sizes = {1, int(_app_module.app.config.get('INFERENCE_MAX_BATCH_SIZE', 1))}
+        registry.warmup(sorted(batch_sizes))
+    try:
+        _app_module.app.test_client().get('/')
+    except Exception as e:
+        print(f"Error warming up templates: {str(e)}")
+    return time.perf_counter() - started
+
+
+def worker_memory(pid=None):
+    """Resident, proportional and unique set sizes in MB from /proc (Linux only); None elsewhere"""
+    path = f'/proc/{pid or os.getpid()}/smaps_rollup'
+    fields = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(':') and parts[1].isdigit():
+                    fields[parts[0][:-1]] = int(parts[1])
+    except OSError:
+        return None
+    unique = fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)
+    return {
+        'rss_mb': round(fields.get('Rss', 0) / 1024, 1),
+        'pss_mb': round(fields.get('Pss', 0) / 1024, 1),
+        'uss_mb': round(unique / 1024, 1)
+    }
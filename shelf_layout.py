@@ -0,0 +1,186 @@
+"""
+Shelf rows and (row, column) slots for detected products
+
+Shelf edges show up as horizontal lines spanning most of the photo. They are
+found from a projection of horizontal edges onto the vertical axis; boxes
+are then assigned to the band between two shelf edges (row) and ordered
+left to right within it (column). Sections use the metadata convention:
+row letter from the top, column number from the left, e.g. A1, B12, AA3.
+"""
+
+import bisect
+import re
+
+import numpy as np
+
+from image_pipeline import as_decoded_image
+
+# A row of the edge map counts as a shelf edge when this share of its pixels are horizontal edges
+SHELF_LINE_COVERAGE = 0.85
+
+# Boxes shorter than this share of their row's median height are not assigned a slot
+MIN_FACING_HEIGHT = 0.5
+
+SECTION_PATTERN = re.compile(r'^([A-Za-z]+)(\d+)$')
+
+
+def row_label(row):
+    """0 -> A, 25 -> Z, 26 -> AA"""
+    label = ''
+    row += 1
+    while row:
+        row, remainder = divmod(row - 1, 26)
+        label = chr(ord('A') + remainder) + label
+    return label
+
+
+def section_name(row, column):
+    return f'{row_label(row)}{column + 1}'
+
+
+def parse_section(section):
+    """'B12' -> (1, 11); None for sections that aren't a row letter plus a column number"""
+    match = SECTION_PATTERN.match(str(section).strip())
+    if not match:
+        return None
+    row = 0
+    for char in match.group(1).upper():
+        row = row * 26 + (ord(char) - ord('A') + 1)
+    column = int(match.group(2))
+    if column < 1:
+        return None
+    return row - 1, column - 1
+
+
+def find_shelf_lines(image, coverage=SHELF_LINE_COVERAGE):
+    """
+    Y positions (original pixels) of horizontal lines spanning most of the
+    image width, found on the working view the detector also uses
+    """
+    image = as_decoded_image(image)
+    gray = image.working_gray.astype(np.float32)
+    if gray.shape[0] < 3:
+        return []
+
+    # Vertical gradient; a shelf edge is a run of rows where most columns have one
+    gradient = np.abs(gray[2:, :] - gray[:-2, :])
+    profile = (gradient > 40.0).mean(axis=1)
+    on_line = profile >= coverage
+    if not on_line.any():
+        return []
+
+    # Merge adjacent rows (both edges of a thick line) into one line at their centre
+    rows = np.nonzero(on_line)[0]
+    breaks = np.nonzero(np.diff(rows) > max(2, gray.shape[0] // 100))[0] + 1
+    scale_y = image.size[1] / gray.shape[0]
+    return [float((group.mean() + 1) * scale_y) for group in np.split(rows, breaks)]
+
+
+def _cluster_rows(centers, heights):
+    """Fallback without shelf lines: split box centres where the vertical gap exceeds half a box height"""
+    order = np.argsort(centers)
+    gaps = np.diff(centers[order])
+    limit = max(1.0, float(np.median(heights)) * 0.5)
+    boundaries = [float((centers[order][i] + centers[order][i + 1]) / 2) for i in np.nonzero(gaps > limit)[0]]
+    return boundaries
+
+
+class ShelfLayout:
+    """
+    Products grouped into shelf rows with a sorted index per row.
+
+    Row lookups bisect the sorted row boundaries and column lookups bisect
+    the sorted x centres of a row, so locating a point is O(log n); a
+    section like 'B2' maps to its product by list index.
+    """
+
+    def __init__(self, products, boundaries, lines=None, image_size=None):
+        self.products = products
+        self.lines = lines or []
+        self.image_size = image_size
+
+        boxes = np.array([[p['x'], p['y'], p['width'], p['height']] for p in products], dtype=np.float64).reshape(-1, 4)
+        centers_x = boxes[:, 0] + boxes[:, 2] / 2.0
+        centers_y = boxes[:, 1] + boxes[:, 3] / 2.0
+
+        # Band index of each box, then drop bands without products (e.g. above the top shelf edge)
+        bands = np.searchsorted(np.asarray(boundaries, dtype=np.float64), centers_y)
+        occupied = np.unique(bands)
+        row_of_box = np.searchsorted(occupied, bands)
+
+        self.rows = []          # per row: product indices sorted by x
+        self.row_x_centers = []  # per row: sorted x centres, for bisect
+        self.row_bounds = []     # per row: (top, bottom) of its boxes
+        for row in range(len(occupied)):
+            members = np.nonzero(row_of_box == row)[0]
+            # Much shorter boxes in a band are price tags, labels or text, not facings
+            members = members[boxes[members, 3] >= MIN_FACING_HEIGHT * np.median(boxes[members, 3])]
+            members = members[np.argsort(centers_x[members], kind='stable')]
+            self.rows.append(members.tolist())
+            self.row_x_centers.append(centers_x[members].tolist())
+            self.row_bounds.append((float(boxes[members, 1].min()), float((boxes[members, 1] + boxes[members, 3]).max())))
+        # Row boundaries halfway between neighbouring rows, for locating points
+        self._row_edges = [(self.row_bounds[i][1] + self.row_bounds[i + 1][0]) / 2.0 for i in range(len(self.rows) - 1)]
+
+        for product in products:
+            product['row'], product['column'], product['section'] = None, None, None
+        for row, members in enumerate(self.rows):
+            for column, index in enumerate(members):
+                products[index]['row'] = row
+                products[index]['column'] = column
+                products[index]['section'] = section_name(row, column)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def lookup(self, section):
+        """Index into products of the box in a section such as 'B2', or None"""
+        slot = parse_section(section)
+        if slot is None:
+            return None
+        row, column = slot
+        if row >= len(self.rows) or column >= len(self.rows[row]):
+            return None
+        return self.rows[row][column]
+
+    def locate(self, x, y):
+        """(row, column) of the product closest to a point, by bisecting rows and then x centres"""
+        if not self.rows:
+            return None
+        row = bisect.bisect_left(self._row_edges, y)
+        centers = self.row_x_centers[row]
+        position = bisect.bisect_left(centers, x)
+        if position == len(centers) or (position > 0 and x - centers[position - 1] < centers[position] - x):
+            position -= 1
+        return row, position
+
+    def row_region(self, row):
+        """Coordinates of a whole shelf row, e.g. to highlight where a product should be"""
+        top, bottom = self.row_bounds[row]
+        width = self.image_size[0] if self.image_size else max(
+            self.products[i]['x'] + self.products[i]['width'] for i in self.rows[row])
+        return {'x': 0, 'y': int(top), 'width': int(width), 'height': int(bottom - top)}
+
+    def summary(self):
+        return {
+            'rows': len(self.rows),
+            'products_per_row': [len(members) for members in self.rows],
+            'shelf_lines': [int(round(y)) for y in self.lines]
+        }
+
+
+def build_layout(image, products):
+    """
+    Segment shelf rows and annotate each product dict with row, column and
+    section. Rows come from shelf lines when the photo shows them, otherwise
+    from gaps between box centres.
+    """
+    image = as_decoded_image(image)
+    lines = find_shelf_lines(image)
+    boundaries = lines
+    if not lines and products:
+        centers = np.array([p['y'] + p['height'] / 2.0 for p in products], dtype=np.float64)
+        heights = np.array([p['height'] for p in products], dtype=np.float64)
+        boundaries = _cluster_rows(centers, heights)
+    return ShelfLayout(products, boundaries, lines=lines, image_size=image.size)
+
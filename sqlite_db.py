@@ -0,0 +1,44 @@
+"""
+Per-thread connections to one SQLite database file
+
+Audit history, job records and uploaded planograms all live in the same
+file, so every server process (each gunicorn worker, process pool children)
+sees the same state. The database runs in WAL mode: readers don't block
+the single writer, and each thread keeps its own connection.
+"""
+
+import os
+import sqlite3
+import threading
+
+
+class SQLiteDatabase:
+    """Base class for stores backed by one SQLite file; schema is run once on open"""
+
+    def __init__(self, path, schema):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        with self._write_lock:
+            self._connection().executescript(schema)
+        if hasattr(os, 'register_at_fork'):
+            # A forked server worker must not reuse the parent's connection
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('PRAGMA foreign_keys=ON')
+            self._local.connection = connection
+        return connection
@@ -0,0 +1,44 @@
+"""
+Deterministic synthetic shelf images
+
+Shelves of coloured product boxes drawn like create_sample_image.py, with a
+matching metadata line per product. Used by the pipeline benchmark and as
+the fixed input of the inference backend parity check, so neither depends
+on photos being present in the tree.
+"""
+
+import random
+
+from PIL import Image, ImageDraw
+
+SHELF_ROWS = 5
+PRODUCT_COLORS = [
+    (255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 0), (255, 0, 255),
+    (0, 255, 255), (128, 0, 0), (0, 128, 0), (0, 0, 128), (128, 128, 0)
+]
+
+
+def generate_shelf(width, height, products_per_row, seed=0):
+    """Draw a shelf image like create_sample_image.py and return (image, metadata lines)"""
+    rng = random.Random(seed)
+    img = Image.new('RGB', (width, height), (255, 255, 255))
+    draw = ImageDraw.Draw(img)
+    row_height = height // SHELF_ROWS
+    slot_width = width / products_per_row
+    lines = []
+
+    for row in range(SHELF_ROWS):
+        shelf_y = (row + 1) * row_height
+        draw.line([(0, shelf_y), (width, shelf_y)], fill=(200, 200, 200), width=max(2, height // 120))
+        for column in range(products_per_row):
+            w = int(slot_width * rng.uniform(0.55, 0.8))
+            h = int(row_height * rng.uniform(0.55, 0.75))
+            x = int(column * slot_width + (slot_width - w) / 2)
+            y = shelf_y - h - max(2, row_height // 20)
+            draw.rectangle([x, y, x + w, y + h], fill=PRODUCT_COLORS[(row * products_per_row + column) % len(PRODUCT_COLORS)],
+                           outline=(0, 0, 0), width=max(1, width // 400))
+            sku = f'SKU{row * products_per_row + column:06d}'
+            price = rng.randint(199, 4999) / 100.0
+            lines.append(f'{sku} ${price:.2f} {chr(ord("A") + row)}{column + 1} Product_{row}_{column}')
+
+    return img, lines
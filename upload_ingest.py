@@ -0,0 +1,199 @@
+"""
+Streaming ingest for uploaded files: hash while reading, validate by content,
+and persist to the upload folder only when (and how) the caller asks
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+KIND_JPEG = 'jpeg'
+KIND_PNG = 'png'
+KIND_TEXT = 'text'
+
+IMAGE_KINDS = {KIND_JPEG, KIND_PNG}
+METADATA_KINDS = {KIND_TEXT}
+
+EXTENSIONS = {KIND_JPEG: 'jpg', KIND_PNG: 'png', KIND_TEXT: 'txt'}
+
+JPEG_MAGIC = b'\xff\xd8\xff'
+PNG_MAGIC = b'\x89PNG\r\n\x1a\n'
+
+SNIFF_BYTES = 512
+
+
+class UploadRejected(ValueError):
+    """The upload is empty or its contents don't match an accepted type"""
+
+
+def sniff_kind(head):
+    """Identify a file from its first bytes instead of trusting its extension"""
+    if head.startswith(JPEG_MAGIC):
+        return KIND_JPEG
+    if head.startswith(PNG_MAGIC):
+        return KIND_PNG
+    if b'\x00' in head:
+        return None
+    try:
+        # A multi-byte character may be cut off at the end of the sample
+        head.decode('utf-8')
+    except UnicodeDecodeError as e:
+        if e.start < len(head) - 3:
+            return None
+    return KIND_TEXT
+
+
+class IngestedUpload:
+    """Upload contents kept in memory, or in a temp file when larger than the spool limit"""
+
+    def __init__(self, filename, kind, sha256, size, data=None, temp_path=None):
+        self.filename = filename
+        self.kind = kind
+        self.sha256 = sha256
+        self.size = size
+        self.data = data
+        self.temp_path = temp_path
+
+    @property
+    def extension(self):
+        return EXTENSIONS[self.kind]
+
+    def read_bytes(self):
+        if self.data is not None:
+            return self.data
+        with open(self.temp_path, 'rb') as f:
+            return f.read()
+
+    def close(self):
+        """Remove the spill file, if any"""
+        if self.temp_path:
+            try:
+                os.remove(self.temp_path)
+            except OSError:
+                pass
+            self.temp_path = None
+
+
+def ingest_upload(file_storage, allowed_kinds, chunk_size=64 * 1024, spool_limit=16 * 1024 * 1024):
+    """
+    Read an uploaded file in chunks, hashing the bytes as they arrive and
+    checking the magic bytes of the first chunk. Raises UploadRejected.
+    """
+    hasher = hashlib.sha256()
+    chunks = []
+    head = b''
+    kind = None
+    size = 0
+    spill = None
+    temp_path = None
+
+    try:
+        while True:
+            chunk = file_storage.stream.read(chunk_size)
+            if not chunk:
+                break
+
+            if kind is None:
+                head += chunk[:SNIFF_BYTES - len(head)]
+                if len(head) >= SNIFF_BYTES:
+                    kind = sniff_kind(head)
+                    if kind not in allowed_kinds:
+                        raise UploadRejected(f'Unsupported file contents for {file_storage.filename!r}')
+
+            hasher.update(chunk)
+            size += len(chunk)
+
+            if spill is None and size > spool_limit:
+                fd, temp_path = tempfile.mkstemp(prefix='upload_')
+                spill = os.fdopen(fd, 'wb')
+                spill.writelines(chunks)
+                chunks = None
+            if spill is not None:
+                spill.write(chunk)
+            else:
+                chunks.append(chunk)
+
+        if size == 0:
+            raise UploadRejected(f'Empty file {file_storage.filename!r}')
+        if kind is None:
+            # Whole file was shorter than the sniff window
+            kind = sniff_kind(head)
+            if kind not in allowed_kinds:
+                raise UploadRejected(f'Unsupported file contents for {file_storage.filename!r}')
+    except Exception:
+        if spill is not None:
+            spill.close()
+            os.remove(temp_path)
+        raise
+
+    if spill is not None:
+        spill.close()
+        return IngestedUpload(file_storage.filename, kind, hasher.hexdigest(), size, temp_path=temp_path)
+    return IngestedUpload(file_storage.filename, kind, hasher.hexdigest(), size, data=b''.join(chunks))
+
+
+class UploadPersister:
+    """
+    Write ingested uploads to upload storage under their content hash. In
+    'async' mode in-memory uploads are written by a background thread; 'off'
+    skips persistence unless a caller needs the file on disk. Contents that
+    are already stored are not written again.
+    """
+
+    def __init__(self, storage, mode='async', workers=2):
+        self.storage = storage
+        self.mode = mode
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self.workers = workers
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='upload-writer')
+            return self._executor
+
+    def _write(self, upload, data, path):
+        # Write next to the destination and rename so readers never see a partial file;
+        # concurrent writers of the same content, in any process, each get their own temp file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.partial')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                # mkstemp creates the file private to this user; stored uploads are served as static files
+                os.fchmod(f.fileno(), 0o644)
+                if data is not None:
+                    f.write(data)
+                else:
+                    with open(upload.temp_path, 'rb') as source:
+                        shutil.copyfileobj(source, f)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Error saving upload {path}: {str(e)}")
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def persist(self, upload, required=False):
+        """
+        Save the upload and return its storage name, or None when persistence
+        is off. required=True writes synchronously in every mode.
+        """
+        if self.mode == 'off' and not required:
+            return None
+
+        filename = self.storage.name_for(upload.sha256, upload.extension)
+        if self.storage.claim(filename):
+            return filename
+
+        path = self.storage.path(filename)
+        if required or self.mode == 'sync' or upload.data is None:
+            # Spilled uploads are copied before the request removes the temp file
+            self._write(upload, upload.data, path)
+        else:
+            self._get_executor().submit(self._write, upload, upload.data, path)
+        return filename
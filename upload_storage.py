@@ -0,0 +1,178 @@
+"""
+Content-addressed upload storage with retention and quota eviction
+
+Uploads are stored under the SHA-256 of their contents, sharded into two
+levels of hash-prefixed directories (uploads/ab/cd/abcd....jpg), so no
+directory grows past a few thousand entries and the same photo uploaded
+twice is stored once. Names stay relative to the static folder, so saved
+files are still served with url_for('static', filename='uploads/' + name).
+
+A background sweeper removes files older than the retention period and,
+when the folder is over its quota, the least recently stored or re-used
+files first. Re-uploading a stored file refreshes its modification time.
+"""
+
+import os
+import re
+import threading
+import time
+
+# Shard names: ab/cd/<64 hex chars>.<ext>; flat names from before sharding are still accepted
+SHARDED_NAME = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.[a-z]{2,4}$')
+FLAT_NAME = re.compile(r'^[\w.-]+\.[A-Za-z]{2,4}$')
+
+# Partial writes older than this are left over from a crash and can be removed
+PARTIAL_MAX_AGE = 3600
+
+
+class UploadStorage:
+    """Sharded, deduplicated upload folder with a retention/quota sweeper"""
+
+    def __init__(self, folder, retention_seconds=0, quota_bytes=0):
+        self.folder = folder
+        self.retention_seconds = retention_seconds
+        self.quota_bytes = quota_bytes
+        self._lock = threading.Lock()
+        self._sweeper = None
+        self._stop = threading.Event()
+        self.dedup_hits = 0
+        self.last_sweep = None
+        os.makedirs(folder, exist_ok=True)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # The sweeper thread stays in the parent (e.g. the gunicorn master), one per folder
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def name_for(sha256, extension):
+        """Storage name of a file with this content hash"""
+        return f'{sha256[:2]}/{sha256[2:4]}/{sha256}.{extension}'
+
+    def path(self, name):
+        """Absolute path of a stored name; raises ValueError for names outside the folder"""
+        if not name or not (SHARDED_NAME.match(name) or FLAT_NAME.match(name)) or '..' in name:
+            raise ValueError(f'Invalid upload name {name!r}')
+        return os.path.join(self.folder, *name.split('/'))
+
+    def exists(self, name):
+        try:
+            return os.path.isfile(self.path(name))
+        except ValueError:
+            return False
+
+    def claim(self, name):
+        """
+        True if the file is already stored; its modification time is then
+        refreshed so eviction treats it as recently used
+        """
+        path = self.path(name)
+        try:
+            os.utime(path)
+        except OSError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            return False
+        with self._lock:
+            self.dedup_hits += 1
+        return True
+
+    def sweep(self):
+        """Remove expired files, then the oldest ones while over quota; returns what was done"""
+        started = time.perf_counter()
+        now = time.time()
+        files = []
+        removed = removed_bytes = 0
+
+        for root, _, names in os.walk(self.folder):
+            for file_name in names:
+                if file_name.startswith('.'):
+                    # .gitkeep and similar
+                    continue
+                path = os.path.join(root, file_name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                age = now - stat.st_mtime
+                if file_name.endswith('.partial'):
+                    if age > PARTIAL_MAX_AGE:
+                        removed_bytes += self._remove(path, stat.st_size)
+                        removed += 1
+                    continue
+                if self.retention_seconds and age > self.retention_seconds:
+                    removed_bytes += self._remove(path, stat.st_size)
+                    removed += 1
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        total_bytes = sum(size for _, size, _ in files)
+        kept = len(files)
+        if self.quota_bytes and total_bytes > self.quota_bytes:
+            # Oldest first
+            files.sort()
+            for _, size, path in files:
+                if total_bytes <= self.quota_bytes:
+                    break
+                total_bytes -= size
+                removed_bytes += self._remove(path, size)
+                removed += 1
+                kept -= 1
+
+        self._prune_empty_shards()
+        result = {
+            'files': kept,
+            'bytes': total_bytes,
+            'removed_files': removed,
+            'removed_bytes': removed_bytes,
+            'seconds': round(time.perf_counter() - started, 3),
+            'finished_at': time.time()
+        }
+        with self._lock:
+            self.last_sweep = result
+        return result
+
+    @staticmethod
+    def _remove(path, size):
+        try:
+            os.remove(path)
+            return size
+        except OSError:
+            return 0
+
+    def _prune_empty_shards(self):
+        """Remove shard directories left empty by eviction, deepest first"""
+        for root, _, _ in os.walk(self.folder, topdown=False):
+            if root != self.folder:
+                try:
+                    os.rmdir(root)  # Fails unless empty
+                except OSError:
+                    pass
+
+    def start_sweeper(self, interval):
+        """Sweep every interval seconds in a daemon thread; a no-op without retention or quota"""
+        if self._sweeper is not None or not (self.retention_seconds or self.quota_bytes):
+            return
+
+        def _run():
+            while not self._stop.is_set():
+                try:
+                    self.sweep()
+                except Exception as e:
+                    print(f"Error sweeping uploads: {str(e)}")
+                self._stop.wait(interval)
+
+        self._sweeper = threading.Thread(target=_run, name='upload-sweeper', daemon=True)
+        self._sweeper.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'retention_seconds': self.retention_seconds,
+                'quota_bytes': self.quota_bytes,
+                'dedup_hits': self.dedup_hits,
+                'last_sweep': self.last_sweep
+            }
@@ -0,0 +1,13 @@
+"""
+WSGI entry point for production servers
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+APP_VARIANT selects full (app.py, default), simple or minimal.
+"""
+
+import os
+
+from serving import preload
+
+app = preload(os.environ.get('APP_VARIANT', 'full'))